@@ -0,0 +1,115 @@
+"""Declarative title rules, indexed by the event and counter each one watches"""
+import functools
+import json
+import os
+
+
+ACHIEVEMENTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "achievements.json")
+# Event -> fields of "when" naming the counter a rule watches, and the field holding its threshold
+EVENTS = {
+    # Player level
+    "level": ((), "at_least"),
+    # Total XP, a skill's XP (no subskill) or a subskill's XP
+    "xp": (("skill", "subskill"), "at_least"),
+    # Times a registered action was performed
+    "action": (("action",), "count"),
+    # Consecutive days, up to the event's, with XP in a skill (any skill if none is given)
+    "streak": (("skill",), "days"),
+}
+
+
+class Rule:
+    """Unlock title once the counter watched by (event, key) reaches threshold"""
+    __slots__ = ("title", "event", "key", "threshold")
+
+    def __init__(self, title: str, event: str, key: tuple, threshold: int):
+        self.title = title
+        self.event = event
+        self.key = key
+        self.threshold = threshold
+
+    @classmethod
+    def from_config(cls, config: dict) -> "Rule":
+        """
+        Build a rule from its config entry, e.g.
+        {"title": "Maestro", "when": {"event": "xp", "skill": "music", "subskill": "piano", "at_least": 5000}}
+
+        Raises:
+            ValueError: The entry names an unknown event or has no integer threshold.
+        """
+        when = config.get("when", {})
+        event = when.get("event")
+        if event not in EVENTS:
+            raise ValueError(f"Rule {config.get('title')!r} has unknown event {event!r}, use one of {', '.join(EVENTS)}")
+        fields, threshold_field = EVENTS[event]
+        threshold = when.get(threshold_field)
+        if not isinstance(threshold, int):
+            raise ValueError(f"Rule {config.get('title')!r} needs an integer {threshold_field!r}")
+        return cls(config["title"], event, tuple(when.get(field) for field in fields), threshold)
+
+
+class AchievementRules:
+    """
+    A rule set grouped by the counter each rule watches.
+
+    Every (event, key) pair maps to its rules sorted by threshold, so an event
+    only looks at the group for the counter it changed, whatever the number of
+    rules.
+    """
+
+    def __init__(self, rules: list):
+        self.rules = rules
+        groups = {}
+        for rule in rules:
+            groups.setdefault((rule.event, rule.key), []).append(rule)
+        self.groups = {watch: sorted(group, key=lambda rule: rule.threshold) for watch, group in groups.items()}
+
+    @classmethod
+    def from_config(cls, config: dict) -> "AchievementRules":
+        return cls([Rule.from_config(entry) for entry in config.get("rules", [])])
+
+    def tracker(self, unlocked) -> "AchievementTracker":
+        return AchievementTracker(self, unlocked)
+
+
+@functools.lru_cache(maxsize=None)
+def load_rules(path: str = None) -> AchievementRules:
+    """Parse a rules file once per path, APOLLO_ACHIEVEMENTS or ACHIEVEMENTS_FILE by default"""
+    with open(path or os.getenv("APOLLO_ACHIEVEMENTS") or ACHIEVEMENTS_FILE, "r", encoding="utf-8") as file:
+        return AchievementRules.from_config(json.load(file))
+
+
+class AchievementTracker:
+    """
+    One player's progress through an AchievementRules.
+
+    Keeps, per watched counter, a queue of the rules not met yet with the lowest
+    threshold last. Counters only grow (and a streak that resets was never
+    enough for the head rule), so an event compares its value with one
+    threshold and pops rules only as they are met.
+    """
+
+    def __init__(self, rules: AchievementRules, unlocked):
+        unlocked = set(unlocked)
+        self.pending = {}
+        for watch, group in rules.groups.items():
+            queue = [rule for rule in reversed(group) if rule.title not in unlocked]
+            if queue:
+                self.pending[watch] = queue
+
+    def next_threshold(self, event: str, key: tuple) -> int:
+        """Lowest threshold not met yet on a counter, or None if no rule waits on it"""
+        queue = self.pending.get((event, key))
+        return queue[-1].threshold if queue else None
+
+    def reached(self, event: str, key: tuple, value: int) -> list:
+        """Titles of the waiting rules on this counter that value meets, lowest threshold first"""
+        queue = self.pending.get((event, key))
+        if not queue or queue[-1].threshold > value:
+            return []
+        titles = []
+        while queue and queue[-1].threshold <= value:
+            titles.append(queue.pop().title)
+        if not queue:
+            del self.pending[(event, key)]
+        return titles
@@ -1,30 +1,198 @@
+import imaplib
+import random
+import threading
 import time
 
-from email_client import DiscordClient
+from email_client import DiscordClient, IDLE_TIMEOUT_S
+from metrics import METRICS
+from notifiers import create_notifier
+from outbox import OUTBOX_FILE, Outbox
+from player_registry import PlayerRegistry
 from xp_system import XPSystem
 
 
+class AdaptivePollScheduler:
+    """Poll quickly after activity and back off with jitter while the inbox is quiet."""
+    def __init__(
+        self,
+        min_interval_s: float = 2,
+        max_interval_s: float = 60,
+        backoff_factor: float = 2,
+        jitter: float = 0.2,
+    ):
+        """
+        Args:
+            min_interval_s (float): Delay used right after new messages arrive.
+            max_interval_s (float): Ceiling for the delay while idle.
+            backoff_factor (float): Multiplier applied after each empty poll.
+            jitter (float): Fraction of the delay randomly added or removed.
+        """
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+        self.interval_s = min_interval_s
+
+    def next_delay(self, had_activity: bool) -> float:
+        """Return seconds to wait before the next poll"""
+        if had_activity:
+            self.interval_s = self.min_interval_s
+        else:
+            self.interval_s = min(self.interval_s * self.backoff_factor, self.max_interval_s)
+        delay = self.interval_s * (1 + random.uniform(-self.jitter, self.jitter))
+        return max(0, min(delay, self.max_interval_s))
+
+
 class ApolloXPController:
     """Manages email polling and XP system integration."""
-    def __init__(self):
+    def __init__(
+        self,
+        push: bool = False,
+        idle_timeout_s: float = IDLE_TIMEOUT_S,
+        min_poll_interval_s: float = 2,
+        max_poll_interval_s: float = 60,
+        multi_player: bool = False,
+        catch_up: bool = False,
+        metrics_file: str = None,
+        metrics_port: int = None,
+        notifier: str = None,
+    ):
         """
         Initialize the ApolloXPController.
 
         Args:
-            email_client (EmailClient): An instance of the EmailClient class.
-            xp_system (XPSystem): An instance of the XPSystem class.
-            poll_interval (int): Time interval (in seconds) for polling emails.
+            push (bool): Hold one IMAP session open with IDLE instead of polling.
+                Falls back to polling when the server lacks IDLE.
+            idle_timeout_s (float): Seconds before an IDLE is re-issued.
+            min_poll_interval_s (float): Poll delay right after activity.
+            max_poll_interval_s (float): Ceiling for the poll delay while idle.
+            multi_player (bool): Give every sender in EXPECTED_SENDER their own XPSystem
+                instead of sharing rdas_player.pkl.
+            catch_up (bool): Work through the backlog with catch_up() before the main loop.
+            metrics_file (str): Enable metrics and rewrite this file in Prometheus text
+                format after every batch.
+            metrics_port (int): Enable metrics and serve them for Prometheus on this local port.
+            notifier (str): Name of the notifiers.NOTIFIERS sink the outbox delivers to,
+                APOLLO_NOTIFIER or Discord by default.
         """
         self.email_client = DiscordClient()
         self.filename = "rdas_player.pkl"
-        self.xp_system = XPSystem.load_progress(self.filename)
-        self.poll_interval_s = 10
+        # Notifications are queued on disk and sent from a background thread
+        self.outbox = Outbox(create_notifier(notifier), OUTBOX_FILE)
+        if multi_player:
+            self.xp_system = None
+            self.players = PlayerRegistry(notifier=self.outbox)
+        else:
+            self.xp_system = XPSystem.recover(self.filename)
+            self.xp_system.set_notifier(self.outbox)
+            self.players = None
+        self.scheduler = AdaptivePollScheduler(min_poll_interval_s, max_poll_interval_s)
+        self.push = push
+        self.catch_up_first = catch_up
+        self.idle_timeout_s = idle_timeout_s
+        self.reconnect_backoff_s = 1
+        self.max_reconnect_backoff_s = 300
+        self._stop = threading.Event()
+        self.metrics_file = metrics_file
+        if metrics_file or metrics_port:
+            METRICS.enable()
+        if metrics_port:
+            METRICS.serve(metrics_port)
+
+    def stop(self):
+        """Ask a running controller to exit after its current step."""
+        self._stop.set()
+
+    def process_new_messages(self, new_emails: list):
+        """Feed new emails to the XP system as one batch, or to each sender's XP system"""
+        if not new_emails:
+            return
+        if self.players is not None:
+            self.players.process([(new_email["sender"], new_email["message"]) for new_email in new_emails])
+        else:
+            self.xp_system.process_messages([new_email["message"] for new_email in new_emails])
+        self.write_metrics()
+
+    def write_metrics(self):
+        """Refresh the Prometheus metrics file, if one was requested"""
+        if self.metrics_file:
+            METRICS.write_prometheus(self.metrics_file)
+
+    def catch_up(self, workers: int = None) -> dict:
+        """
+        Apply every message waiting past the checkpoint, in timestamp order.
+
+        Meant for restarting after downtime: parsing runs on a process pool and
+        the XP system gets the whole backlog as one batch.
+
+        Args:
+            workers (int): Parser processes, defaults to the CPU count.
+
+        Returns:
+            dict: Counts from EmailClient.catch_up plus seconds and messages_per_sec.
+        """
+        started = time.perf_counter()
+        new_emails, report = self.email_client.catch_up(workers)
+        self.process_new_messages(new_emails)
+        report["seconds"] = time.perf_counter() - started
+        report["messages_per_sec"] = report["fetched"] / report["seconds"] if report["seconds"] else 0.0
+        print(
+            f"Caught up on {report['new']} new of {report['fetched']} messages "
+            f"({report['duplicates']} duplicates) at {report['messages_per_sec']:.0f} messages/sec"
+        )
+        return report
 
     def run(self):
         """Run program"""
         print("Starting Apollo Controller")
-        while True:
-            new_email_messages = self.email_client.fetch_and_store_emails()
-            for new_message in new_email_messages:
-                self.xp_system.process_message(new_message)
-            time.sleep(self.poll_interval_s)
+        self.outbox.start()
+        try:
+            if self.catch_up_first:
+                try:
+                    self.catch_up()
+                except (imaplib.IMAP4.error, OSError) as e:
+                    print(f"Catch-up failed: {e}, continuing with normal fetching")
+                    self.email_client.close_session()
+            if self.push:
+                self.run_push()
+            else:
+                self.run_poll()
+        finally:
+            if self.players is not None:
+                self.players.close()
+            else:
+                self.xp_system.close()
+            self.outbox.stop()
+            self.write_metrics()
+
+    def run_poll(self):
+        """Poll the inbox over one persistent session on an adaptive schedule"""
+        try:
+            while not self._stop.is_set():
+                with METRICS.timer("poll_cycle"):
+                    new_emails = self.email_client.fetch_new_emails()
+                    self.process_new_messages(new_emails)
+                self._stop.wait(self.scheduler.next_delay(bool(new_emails)))
+        finally:
+            self.email_client.close()
+
+    def run_push(self):
+        """Hold an IMAP IDLE session open and only fetch when new mail arrives"""
+        backoff_s = self.reconnect_backoff_s
+        while not self._stop.is_set():
+            try:
+                mail = self.email_client.get_connection()
+                if not self.email_client.supports_idle(mail):
+                    print("IMAP server does not support IDLE, falling back to polling")
+                    self.run_poll()
+                    return
+                backoff_s = self.reconnect_backoff_s
+                while not self._stop.is_set():
+                    self.process_new_messages(self.email_client.fetch_new_emails(mail))
+                    self.email_client.idle(mail, self.idle_timeout_s, self._stop)
+                self.email_client.close()
+            except (imaplib.IMAP4.error, OSError) as e:
+                print(f"IMAP session lost: {e}, reconnecting in {backoff_s}s")
+                self.email_client.close_session()
+                self._stop.wait(backoff_s)
+                backoff_s = min(backoff_s * 2, self.max_reconnect_backoff_s)
@@ -0,0 +1,195 @@
+"""asyncio controller running fetch, parse, process and notify as overlapping stages"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from apollo_xp_controller import ApolloXPController
+
+
+class _QueueNotifier:
+    """Notifier handing messages from the processing thread to the notify stage"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+        self.loop = loop
+        self.queue = queue
+
+    def send_message(self, body: str, subject: str = "", recipient: str = None) -> bool:
+        # Blocks the processing thread while the notify queue is full
+        asyncio.run_coroutine_threadsafe(self.queue.put((body, subject, recipient)), self.loop).result()
+        return True
+
+
+class AsyncApolloXPController(ApolloXPController):
+    """
+    Pipeline version of ApolloXPController.
+
+    Stages are linked by bounded queues so a slow stage applies backpressure to
+    the ones before it:
+
+        fetch -> parse (parse_workers) -> process (in order) -> notify (notify_workers)
+
+    Fetching the next batch overlaps with parsing, processing and notifying the
+    current one. The notify stage hands messages to the durable outbox, whose
+    sender thread does the network I/O. The synchronous run() is still
+    available; use run_pipeline() or await run_async() for this mode. The
+    pipeline always polls, push mode stays with run().
+    """
+
+    def __init__(self, *args, queue_size: int = 4, parse_workers: int = 2, notify_workers: int = 1, **kwargs):
+        """
+        Args:
+            queue_size (int): Capacity of each queue between stages.
+            parse_workers (int): Batches parsed concurrently.
+            notify_workers (int): Notifications delivered concurrently.
+            Other arguments are passed to ApolloXPController.
+        """
+        super().__init__(*args, **kwargs)
+        self.queue_size = queue_size
+        self.parse_workers = parse_workers
+        self.notify_workers = notify_workers
+        self._loop = None
+        self._async_stop = None
+
+    def stop(self):
+        """Ask the pipeline to drain and exit"""
+        super().stop()
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._async_stop.set)
+            except RuntimeError:
+                # The pipeline already finished and closed its loop
+                pass
+
+    def run_pipeline(self):
+        """Run the pipeline until stop() is called"""
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        """Run every stage until stop() is called, then drain the queues"""
+        print("Starting Apollo Controller pipeline")
+        self._loop = asyncio.get_running_loop()
+        self._async_stop = asyncio.Event()
+        if self._stop.is_set():
+            self._async_stop.set()
+        raw_queue = asyncio.Queue(self.queue_size)
+        parsed_queue = asyncio.Queue(self.queue_size)
+        notify_queue = asyncio.Queue(self.queue_size)
+        notifier = _QueueNotifier(self._loop, notify_queue)
+        if self.players is not None:
+            self.players.notifier = notifier
+        else:
+            self.xp_system.set_notifier(notifier)
+
+        self.outbox.start()
+        with ThreadPoolExecutor(self.parse_workers, thread_name_prefix="parse") as parse_executor:
+            parsers = [
+                asyncio.create_task(self._parse_stage(raw_queue, parsed_queue, parse_executor))
+                for _ in range(self.parse_workers)
+            ]
+            notifiers = [asyncio.create_task(self._notify_stage(notify_queue)) for _ in range(self.notify_workers)]
+            processor = asyncio.create_task(self._process_stage(parsed_queue, notify_queue))
+            try:
+                await self._fetch_stage(raw_queue)
+            finally:
+                # Each stage passes one None per downstream worker once it has drained
+                for _ in parsers:
+                    await raw_queue.put(None)
+                await asyncio.gather(*parsers)
+                await parsed_queue.put(None)
+                await processor
+                for _ in notifiers:
+                    await notify_queue.put(None)
+                await asyncio.gather(*notifiers)
+                await asyncio.to_thread(self._shutdown)
+                self._loop = None
+
+    def _shutdown(self):
+        self.email_client.close()
+        if self.players is not None:
+            self.players.close()
+        else:
+            self.xp_system.close()
+        self.outbox.stop()
+
+    async def _fetch_stage(self, raw_queue: asyncio.Queue):
+        """Poll for raw messages, handing each batch on with a sequence number"""
+        seq = 0
+        # Highest UID handed on so far, only meaningful within its mailbox UIDVALIDITY
+        fetched_uid, fetched_uidvalidity = 0, None
+        while not self._async_stop.is_set():
+            try:
+                checkpoint, raw_emails = await asyncio.to_thread(
+                    self.email_client.fetch_raw_emails, fetched_uid, None, fetched_uidvalidity
+                )
+            except Exception as e:
+                print(f"Error fetching emails: {e}")
+                raw_emails = []
+            else:
+                if checkpoint["uidvalidity"] != fetched_uidvalidity:
+                    # The mailbox was rebuilt and its UIDs start over
+                    fetched_uid, fetched_uidvalidity = 0, checkpoint["uidvalidity"]
+            if raw_emails:
+                # Don't fetch messages that are still in flight again
+                fetched_uid = max(fetched_uid, checkpoint["last_uid"], *(uid or 0 for uid, _ in raw_emails))
+                await raw_queue.put((seq, checkpoint, raw_emails))
+                seq += 1
+            try:
+                await asyncio.wait_for(self._async_stop.wait(), self.scheduler.next_delay(bool(raw_emails)))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _parse_stage(self, raw_queue: asyncio.Queue, parsed_queue: asyncio.Queue, executor):
+        while True:
+            item = await raw_queue.get()
+            if item is None:
+                return
+            seq, checkpoint, raw_emails = item
+            parsed = await self._loop.run_in_executor(executor, self._parse_batch, raw_emails)
+            await parsed_queue.put((seq, checkpoint, parsed))
+
+    def _parse_batch(self, raw_emails: list) -> list:
+        parsed = []
+        for uid, raw in raw_emails:
+            try:
+                parsed.append((uid, self.email_client.parse_raw(raw)))
+            except Exception as e:
+                print(f"Skipping email, got error {str(e)}")
+                parsed.append((uid, None))
+        return parsed
+
+    async def _process_stage(self, parsed_queue: asyncio.Queue, notify_queue: asyncio.Queue):
+        """Log and apply batches strictly in fetch order, then advance the checkpoint"""
+        next_seq = 0
+        waiting = {}
+        while True:
+            item = await parsed_queue.get()
+            if item is None:
+                return
+            seq, checkpoint, parsed = item
+            waiting[seq] = (checkpoint, parsed)
+            # Parse workers can finish out of order
+            while next_seq in waiting:
+                checkpoint, parsed = waiting.pop(next_seq)
+                try:
+                    await asyncio.to_thread(self._process_batch, checkpoint, parsed)
+                except Exception as e:
+                    # Keep draining so later batches still apply and shutdown completes
+                    print(f"Error processing batch {next_seq}: {e}")
+                next_seq += 1
+
+    def _process_batch(self, checkpoint: dict, parsed: list):
+        new_emails = []
+        for uid, parsed_email in parsed:
+            if parsed_email is not None and self.email_client.store_new_email(parsed_email):
+                new_emails.append(parsed_email)
+            if uid is not None:
+                checkpoint["last_uid"] = max(checkpoint["last_uid"], uid)
+        self.email_client.save_checkpoint(checkpoint)
+        self.process_new_messages(new_emails)
+
+    async def _notify_stage(self, notify_queue: asyncio.Queue):
+        while True:
+            item = await notify_queue.get()
+            if item is None:
+                return
+            await asyncio.to_thread(self.outbox.send_message, *item)
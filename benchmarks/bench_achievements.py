@@ -0,0 +1,49 @@
+"""Cost of logging an action as the number of achievement rules grows
+
+Run from the repository root:
+    python -m benchmarks.bench_achievements --rules 0 1000 100000
+"""
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+
+from achievements import AchievementRules
+from notifiers import NullNotifier
+from xp_system import XPSystem
+
+
+def make_rules(count: int) -> AchievementRules:
+    """count rules spread over every event kind, almost all watching counters the benchmark never touches"""
+    kinds = [
+        lambda i: {"event": "action", "action": f"action {i}", "count": 10},
+        lambda i: {"event": "xp", "skill": f"skill {i}", "subskill": "general", "at_least": 10},
+        lambda i: {"event": "streak", "skill": f"skill {i}", "days": 7},
+        lambda i: {"event": "level", "at_least": 1000 + i},
+    ]
+    rules = [{"title": f"title {i}", "when": kinds[i % len(kinds)](i)} for i in range(count)]
+    return AchievementRules.from_config({"rules": rules})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", type=int, nargs="+", default=[0, 1000, 100000])
+    parser.add_argument("--actions", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'rules':>8} {'us per action':>14}")
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        for count in args.rules:
+            xp_system = XPSystem(os.path.join(tmp, "player.pkl"), notifier=NullNotifier())
+            xp_system.set_achievements(make_rules(count))
+            xp_system.add_action("music", "piano", 1, "scales")
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(devnull):
+                for _ in range(args.actions):
+                    xp_system.update_xp(1, "music", "piano", action="scales")
+            print(f"{count:>8} {(time.perf_counter() - start) / args.actions * 1e6:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""End-to-end benchmarks against local IMAP, SMTP and Discord webhook stand-ins
+
+Generates a synthetic mailbox, then measures:
+    process_message  - XPSystem.process_message one message at a time
+    process_messages - the same messages through XPSystem.process_messages in batches
+    notify           - DiscordClient and EmailClient sends to the fake webhook and SMTP servers
+    controller       - ApolloXPController polling a fake IMAP backlog, then live deliveries
+
+Results are written as JSON so runs on different commits can be compared.
+
+Run from the repository root:
+    python -m benchmarks.bench_e2e --messages 500
+    python -m benchmarks.bench_e2e --compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from apollo_xp_controller import AdaptivePollScheduler, ApolloXPController
+from email_client import DiscordClient, EmailClient
+from journal import Journal
+from tests.fake_imap import FakeIMAPServer
+from tests.fake_smtp import FakeSMTPServer
+from tests.fake_webhook import FakeWebhookServer
+from xp_system import XPSystem
+
+
+SENDER = "player@example.com"
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# Actions registered at the start of every synthetic mailbox, on top of "sing practice"
+BENCH_ACTIONS = [
+    ("programming", "terminal", 15, "vim kata"),
+    ("physical", "strength", 20, "gym session"),
+    ("life", "chores", 5, "dishes"),
+    ("social", "friends", 10, "call a friend"),
+]
+
+
+def make_mailbox(count: int, seed: int = 0) -> list:
+    """Return count command messages: mostly actions with some status queries and noise"""
+    rng = random.Random(seed)
+    actions = ["sing practice"] + [action for *_, action in BENCH_ACTIONS]
+    messages = [f"!add {skill} {subskill} {xp} {action}" for skill, subskill, xp, action in BENCH_ACTIONS]
+    while len(messages) < count:
+        roll = rng.random()
+        if roll < 0.8:
+            messages.append(rng.choice(actions))
+        elif roll < 0.9:
+            messages.append("!status")
+        elif roll < 0.95:
+            messages.append("!level")
+        else:
+            messages.append("not a command")
+    return messages[:count]
+
+
+def make_raw_email(body: str, index: int) -> bytes:
+    return (
+        f"From: {SENDER}\r\nDate: Mon, 4 Dec 2023 {10 + index // 3600:02d}:{index // 60 % 60:02d}:{index % 60:02d} +0000\r\n"
+        f"Subject: log\r\n\r\n{body}\r\n"
+    ).encode()
+
+
+def percentiles(samples_s: list) -> dict:
+    """Summarise durations in seconds as millisecond percentiles"""
+    if not samples_s:
+        return {}
+    ordered = sorted(samples_s)
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": pick(0.5),
+        "p90_ms": pick(0.9),
+        "p99_ms": pick(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+@contextlib.contextmanager
+def timed_method(cls, name: str, timings: list):
+    """Record (finished at, seconds, first argument) for every call to cls.name"""
+    original = getattr(cls, name)
+
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            timings.append((end, end - start, args[0] if args else None))
+
+    setattr(cls, name, wrapper)
+    try:
+        yield timings
+    finally:
+        setattr(cls, name, original)
+
+
+@contextlib.contextmanager
+def timed_persistence(timings: list):
+    """Time journal appends (with their batched fsyncs) and commits, which write snapshots"""
+    with timed_method(Journal, "append", timings), timed_method(XPSystem, "commit", timings):
+        yield timings
+
+
+class TimedNotifier:
+    """Forward notifications to a transport, timing each send"""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.timings = []
+
+    def send_message(self, body: str, subject: str = "", recipient: str = None) -> bool:
+        start = time.perf_counter()
+        try:
+            return self.transport.send_message(body, subject, recipient)
+        finally:
+            self.timings.append(time.perf_counter() - start)
+
+
+def bench_process_message(messages: list, webhook_url: str) -> dict:
+    """Apply messages one at a time with journaling and webhook notifications"""
+    notifier = TimedNotifier(DiscordClient())
+    with tempfile.TemporaryDirectory() as tmp:
+        xp_system = XPSystem.recover(os.path.join(tmp, "player.pkl"))
+        xp_system.set_notifier(notifier)
+        latencies = []
+        with timed_persistence([]) as persistence, patch_env("DISCORD_WEBHOOK", webhook_url):
+            start = time.perf_counter()
+            for msg in messages:
+                begin = time.perf_counter()
+                xp_system.process_message(msg)
+                latencies.append(time.perf_counter() - begin)
+            elapsed = time.perf_counter() - start
+        xp_system.close()
+    actions = max(1, sum(1 for *_, record in persistence if isinstance(record, dict) and record["op"] == "xp"))
+    return {
+        "messages": len(messages),
+        "seconds": elapsed,
+        "messages_per_sec": len(messages) / elapsed,
+        "latency": percentiles(latencies),
+        "persistence_ms_per_action": sum(seconds for _, seconds, _ in persistence) / actions * 1000,
+        "notifications": len(notifier.timings),
+        "notify_ms_per_message": sum(notifier.timings) / len(messages) * 1000,
+    }
+
+
+def bench_process_messages(messages: list, webhook_url: str, batch_size: int) -> dict:
+    """Apply the same messages through process_messages in batches"""
+    notifier = TimedNotifier(DiscordClient())
+    with tempfile.TemporaryDirectory() as tmp:
+        xp_system = XPSystem.recover(os.path.join(tmp, "player.pkl"))
+        xp_system.set_notifier(notifier)
+        latencies = []
+        with timed_persistence([]) as persistence, patch_env("DISCORD_WEBHOOK", webhook_url):
+            start = time.perf_counter()
+            for i in range(0, len(messages), batch_size):
+                begin = time.perf_counter()
+                xp_system.process_messages(messages[i:i + batch_size])
+                latencies.append(time.perf_counter() - begin)
+            elapsed = time.perf_counter() - start
+        xp_system.close()
+    return {
+        "messages": len(messages),
+        "batch_size": batch_size,
+        "seconds": elapsed,
+        "messages_per_sec": len(messages) / elapsed,
+        "batch_latency": percentiles(latencies),
+        "persistence_ms_per_message": sum(seconds for _, seconds, _ in persistence) / len(messages) * 1000,
+        "notifications": len(notifier.timings),
+        "notify_ms_per_message": sum(notifier.timings) / len(messages) * 1000,
+    }
+
+
+def bench_notify(count: int, webhook_url: str, smtp_address: tuple) -> dict:
+    """Time individual notification sends over each transport"""
+    results = {}
+    discord = DiscordClient()
+    smtp = EmailClient()
+    smtp.smtp_host, smtp.smtp_port = smtp_address
+    smtp.smtp_tls = False
+    with patch_env("DISCORD_WEBHOOK", webhook_url):
+        for name, client in (("discord", discord), ("smtp", smtp)):
+            timings = []
+            for i in range(count):
+                start = time.perf_counter()
+                client.send_message(f"Level Up! {i}")
+                timings.append(time.perf_counter() - start)
+            results[name] = {"messages": count, "messages_per_sec": count / sum(timings), "latency": percentiles(timings)}
+    smtp.smtp_pool().close()
+    return results
+
+
+def bench_controller(messages: list, live: int, webhook_url: str) -> dict:
+    """Drive ApolloXPController over a fake IMAP backlog, then time live deliveries"""
+    server = FakeIMAPServer(idle=False)
+    for index, msg in enumerate(messages):
+        server.add_message(make_raw_email(msg, index))
+    host, port = server.start()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp, patch_env("DISCORD_WEBHOOK", webhook_url):
+        # The controller keeps its state, log and outbox in the working directory
+        os.chdir(tmp)
+        try:
+            with timed_method(XPSystem, "process_messages", []) as batches:
+                controller = ApolloXPController()
+                controller.scheduler = AdaptivePollScheduler(0.005, 0.05)
+                controller.email_client.imap_host, controller.email_client.imap_port = host, port
+                controller.email_client.imap_ssl = False
+                thread = threading.Thread(target=controller.run, daemon=True)
+                start = time.perf_counter()
+                thread.start()
+                wait_for(lambda: processed(batches) >= len(messages))
+                backlog_s = time.perf_counter() - start
+                controller.outbox.flush(60)
+                backlog_flushed_s = time.perf_counter() - start
+
+                live_latencies = []
+                for index in range(len(messages), len(messages) + live):
+                    expected = processed(batches) + 1
+                    delivered = time.perf_counter()
+                    server.add_message(make_raw_email("sing practice", index))
+                    wait_for(lambda: processed(batches) >= expected)
+                    live_latencies.append(batches[-1][0] - delivered)
+                controller.stop()
+                thread.join(60)
+        finally:
+            os.chdir(cwd)
+            server.stop()
+    return {
+        "messages": len(messages),
+        "backlog_seconds": backlog_s,
+        "backlog_messages_per_sec": len(messages) / backlog_s,
+        "backlog_with_notifications_seconds": backlog_flushed_s,
+        "imap_bytes_sent": server.bytes_sent,
+        "live_latency": percentiles(live_latencies),
+    }
+
+
+def processed(batches: list) -> int:
+    return sum(len(messages) for _, _, messages in batches)
+
+
+def wait_for(condition, timeout_s: float = 60):
+    deadline = time.monotonic() + timeout_s
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("benchmark did not finish in time")
+        time.sleep(0.001)
+
+
+@contextlib.contextmanager
+def patch_env(name: str, value: str):
+    previous = os.environ.get(name)
+    os.environ[name] = value
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = previous
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(old_path: str, new_path: str):
+    """Print every shared metric of two result files with its relative change"""
+    with open(old_path, encoding="utf-8") as file:
+        old = json.load(file)
+    with open(new_path, encoding="utf-8") as file:
+        new = json.load(file)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    old_metrics, new_metrics = flatten(old["results"]), flatten(new["results"])
+    for name, value in new_metrics.items():
+        if name in old_metrics:
+            change = (value - old_metrics[name]) / old_metrics[name] * 100 if old_metrics[name] else 0.0
+            print(f"{name:>60}: {old_metrics[name]:12.3f} -> {value:12.3f} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500, help="size of the synthetic mailbox")
+    parser.add_argument("--batch-size", type=int, default=50, help="messages per process_messages call")
+    parser.add_argument("--notifications", type=int, default=50, help="sends per transport in the notify benchmark")
+    parser.add_argument("--live", type=int, default=20, help="messages delivered one at a time to the running controller")
+    parser.add_argument("--webhook-delay-ms", type=float, default=0)
+    parser.add_argument("--smtp-delay-ms", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="result file, benchmarks/results/<commit>.json by default")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    os.environ.setdefault("EMAIL_USERNAME", "bench@example.com")
+    os.environ.setdefault("EMAIL_PASSWORD", "bench")
+    os.environ["EXPECTED_SENDER"] = SENDER
+    commit = git_commit()
+    output = os.path.abspath(args.output or os.path.join(RESULTS_DIR, f"{commit or 'local'}.json"))
+
+    webhook = FakeWebhookServer(args.webhook_delay_ms / 1000)
+    webhook_url = webhook.start()
+    smtp = FakeSMTPServer(args.smtp_delay_ms / 1000)
+    smtp_address = smtp.start()
+    messages = make_mailbox(args.messages, args.seed)
+    results = {}
+    try:
+        # The code under test logs every step to stdout
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results["process_message"] = bench_process_message(messages, webhook_url)
+            results["process_messages"] = bench_process_messages(messages, webhook_url, args.batch_size)
+            results["notify"] = bench_notify(args.notifications, webhook_url, smtp_address)
+            results["controller"] = bench_controller(messages, args.live, webhook_url)
+    finally:
+        webhook.stop()
+        smtp.stop()
+
+    for name, value in flatten(results).items():
+        print(f"{name:>60}: {value:12.3f}")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({
+            "commit": commit,
+            "python": sys.version.split()[0],
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "args": vars(args),
+            "results": results,
+        }, file, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
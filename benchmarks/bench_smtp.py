@@ -0,0 +1,61 @@
+"""Compare one SMTP connection per email with the pooled send_messages path
+
+Run from the repository root:
+    python -m benchmarks.bench_smtp --messages 50 --connect-delay-ms 20 --login-delay-ms 20
+"""
+import argparse
+import os
+import time
+
+from email_client import EmailClient
+from tests.fake_smtp import FakeSMTPServer
+
+
+def send_unpooled(client: EmailClient, count: int):
+    """Connect, send and quit for every message, as send_message used to"""
+    for i in range(count):
+        server = client.connect_smtp()
+        server.sendmail(os.environ["EMAIL_USERNAME"], os.environ["EXPECTED_SENDER"], client.build_message(f"Level Up! {i}"))
+        server.quit()
+
+
+def send_pooled(client: EmailClient, count: int):
+    """Send every message through send_message on the shared pool"""
+    for i in range(count):
+        client.send_message(f"Level Up! {i}")
+
+
+def send_bulk(client: EmailClient, count: int):
+    """Send every message in one send_messages call"""
+    client.send_messages([f"Level Up! {i}" for i in range(count)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--connect-delay-ms", type=float, default=20)
+    parser.add_argument("--login-delay-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault("EMAIL_USERNAME", "bench@example.com")
+    os.environ.setdefault("EMAIL_PASSWORD", "bench")
+    os.environ.setdefault("EXPECTED_SENDER", "player@example.com")
+
+    for name, send in (("unpooled", send_unpooled), ("pooled", send_pooled), ("bulk", send_bulk)):
+        server = FakeSMTPServer(args.connect_delay_ms / 1000, args.login_delay_ms / 1000)
+        host, port = server.start()
+        client = EmailClient()
+        client.smtp_host, client.smtp_port, client.smtp_tls = host, port, False
+        start = time.perf_counter()
+        send(client, args.messages)
+        elapsed = time.perf_counter() - start
+        client.smtp_pool().close()
+        server.stop()
+        print(
+            f"{name:>9}: {args.messages} messages in {elapsed:.3f}s "
+            f"({args.messages / elapsed:.1f} msg/s, {server.connections} connections)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Cold start of xp_system: import time, first command and lazy notifier backends
+
+Each run is a fresh interpreter under python -X importtime, measuring:
+    import_ms         - import xp_system, from its -X importtime cumulative time
+    first_command_ms  - XPSystem() plus a first !status with an in-memory sink
+    notifier_ms.NAME  - creating each named sink, importing its backend on first use
+The heaviest top-level imports of the median run are listed to show what to trim next.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup --runs 15
+    python -m benchmarks.bench_startup --compare benchmarks/results/startup-old.json benchmarks/results/startup-new.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.bench_e2e import RESULTS_DIR, compare, git_commit
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Runs in the child interpreter; prints its timings as JSON on the last line
+CHILD = """
+import json, os, sys, tempfile, time
+start = time.perf_counter()
+import xp_system
+imported = time.perf_counter()
+with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+    stdout, sys.stdout = sys.stdout, devnull
+    xp_system.XPSystem(os.path.join(tmp, "player.pkl"), notifier="memory").process_message("!status")
+    sys.stdout = stdout
+commanded = time.perf_counter()
+from notifiers import create_notifier
+notifier_ms = {}
+for name in sys.argv[1:]:
+    before = time.perf_counter()
+    create_notifier(name)
+    notifier_ms[name] = (time.perf_counter() - before) * 1000
+print(json.dumps({
+    "wall_import_ms": (imported - start) * 1000,
+    "first_command_ms": (commanded - imported) * 1000,
+    "notifier_ms": notifier_ms,
+}))
+"""
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Cumulative microseconds of every top-level import in -X importtime output"""
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith("  "):
+            imports[name.strip()] = int(cumulative)
+    return imports
+
+
+def run_once(notifiers: list) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD, *notifiers],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+        # Measure the default build, not whatever the caller exported
+        env={**os.environ, "APOLLO_METRICS": "0"},
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    imports = parse_importtime(result.stderr)
+    timings["import_ms"] = imports.get("xp_system", 0) / 1000
+    timings["top_imports_ms"] = {name: us / 1000 for name, us in imports.items() if name != "xp_system"}
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=15)
+    parser.add_argument("--notifiers", nargs="+", default=["null", "console", "discord", "smtp"])
+    parser.add_argument("--top", type=int, default=8, help="heaviest top-level imports to list")
+    parser.add_argument("--output", help="result file, benchmarks/results/startup-<commit>.json by default")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # A first run compiles any stale bytecode so every measured run is a warm-disk cold start
+    run_once(args.notifiers)
+    runs = sorted((run_once(args.notifiers) for _ in range(args.runs)), key=lambda run: run["import_ms"])
+    median = runs[len(runs) // 2]
+    results = {
+        "import_ms": statistics.median(run["import_ms"] for run in runs),
+        "wall_import_ms": statistics.median(run["wall_import_ms"] for run in runs),
+        "first_command_ms": statistics.median(run["first_command_ms"] for run in runs),
+        "notifier_ms": {name: statistics.median(run["notifier_ms"][name] for run in runs) for name in args.notifiers},
+    }
+
+    print(f"import xp_system: {results['import_ms']:.1f} ms (wall {results['wall_import_ms']:.1f} ms)")
+    print(f"first command:    {results['first_command_ms']:.1f} ms")
+    for name, ms in results["notifier_ms"].items():
+        print(f"notifier {name + ':':<8} {ms:.1f} ms")
+    print("heaviest top-level imports in the median run, lazily imported backends included:")
+    for name, ms in sorted(median["top_imports_ms"].items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"    {name:<24} {ms:8.1f} ms")
+
+    commit = git_commit()
+    output = os.path.abspath(args.output or os.path.join(RESULTS_DIR, f"startup-{commit or 'local'}.json"))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({"commit": commit, "runs": args.runs, "results": results}, file, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
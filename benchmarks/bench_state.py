@@ -0,0 +1,145 @@
+"""Compare pickle saves with the player_state format at large action and XP event counts
+
+The events table loads a player that logged that many XP events, one every
+ten minutes, from the current format (saved rollups, compacted events) and
+from version 3 (every event saved, rollups rebuilt on load).
+
+Run from the repository root:
+    python -m benchmarks.bench_state --actions 1000 10000 100000 --events 10000 100000 1000000
+"""
+import argparse
+import contextlib
+import json
+import os
+import pickle
+import tempfile
+import time
+import tracemalloc
+
+from player_state import HEADER, STATE_MAGIC, decode_state, encode_state
+from xp_history import XPHistory
+from xp_system import XPSystem
+
+
+def make_player(actions: int) -> XPSystem:
+    """A player with many registered actions spread over every subskill"""
+    xp_system = XPSystem()
+    subskills = [(skill, subskill) for skill, tree in xp_system.skill_tree.items() for subskill in tree]
+    for i in range(actions):
+        skill, subskill = subskills[i % len(subskills)]
+        xp_system.actions.add(f"action number {i}", skill, subskill, i % 50)
+        xp_system.skill_tree[skill][subskill] += i
+    return xp_system
+
+
+def event_columns(events: int) -> tuple:
+    """(keys, times, key_ids, amounts) of events XP events, one every ten minutes, over every subskill"""
+    keys = [(skill, subskill) for skill, tree in XPSystem().skill_tree.items() for subskill in tree]
+    start = time.time() - events * 600
+    return (
+        keys,
+        [start + i * 600 for i in range(events)],
+        [i % len(keys) for i in range(events)],
+        [i % 50 for i in range(events)],
+    )
+
+
+def make_history_player(columns: tuple) -> XPSystem:
+    xp_system = XPSystem()
+    history = xp_system.history = XPHistory()
+    keys, times, key_ids, amounts = columns
+    for at, key_id, xp in zip(times, key_ids, amounts):
+        history.record(*keys[key_id], xp, at)
+    return xp_system
+
+
+def version_3_state(xp_system: XPSystem, columns: tuple) -> bytes:
+    """The same player as a version 3 file, which saved every event and no rollups"""
+    body = json.loads(encode_state(xp_system)[HEADER.size:])
+    body["history"] = list(columns)
+    # Actions pointed into the skills list until version 5
+    skills = [skill[0] for skill in body["skills"]]
+    names, subskills, subskill_ids, xp = body["actions"]
+    pairs = [(skills.index(skill), subskill) for skill, subskill in (subskills[i] for i in subskill_ids)]
+    body["actions"] = [
+        names, [skill for skill, _ in pairs], [body["skills"][skill][2].index(subskill) for skill, subskill in pairs], xp,
+    ]
+    return HEADER.pack(STATE_MAGIC, 3) + json.dumps(body, separators=(",", ":")).encode("utf-8")
+
+
+def load_state(data: bytes) -> XPSystem:
+    """What XPSystem.load_progress does for a state file"""
+    xp_system = XPSystem()
+    decode_state(data).apply_to(xp_system)
+    xp_system._init_transient()
+    return xp_system
+
+
+def measure(function, repeat: int):
+    """Best wall time of repeat calls, and the peak and retained memory of one call"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    result = function()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return best, peak, retained
+
+
+def run_formats(count: int, formats: tuple, directory: str, repeat: int):
+    """Print a size, save and cold load row for each (name, dump, load) format"""
+    for name, dump, load in formats:
+        path = os.path.join(directory, name)
+
+        def save():
+            with open(path, "wb") as file:
+                file.write(dump())
+
+        def cold_load():
+            with open(path, "rb") as file:
+                return load(file.read())
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            save_s, _, _ = measure(save, repeat)
+            load_s, peak, retained = measure(cold_load, repeat)
+        print(
+            f"{count:>8} {name:>7} {os.path.getsize(path) / 1024:>9.1f} {save_s * 1000:>9.2f} "
+            f"{load_s * 1000:>9.2f} {peak / 2 ** 20:>13.2f} {retained / 2 ** 20:>10.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--actions", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--events", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    columns = f"{'format':>7} {'size KB':>9} {'save ms':>9} {'load ms':>9} {'load peak MB':>13} {'loaded MB':>10}"
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'actions':>8} {columns}")
+        for actions in args.actions:
+            xp_system = make_player(actions)
+            formats = (
+                ("pickle", lambda: pickle.dumps(xp_system), pickle.loads),
+                ("state", lambda: encode_state(xp_system), load_state),
+            )
+            run_formats(actions, formats, tmp, args.repeat)
+
+        print(f"\n{'events':>8} {columns}")
+        for events in args.events:
+            history_columns = event_columns(events)
+            xp_system = make_history_player(history_columns)
+            formats = (
+                ("state", lambda: encode_state(xp_system), load_state),
+                ("v3", lambda: version_3_state(xp_system, history_columns), load_state),
+            )
+            run_formats(events, formats, tmp, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,24 +2,165 @@
 """Scrape email account to find texts that were sent"""
 import os
 
-import csv
+import base64
+import contextlib
 import email
+import json
+import re
 from email.header import decode_header
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import imaplib
+import multiprocessing
 import requests
+import select
 import smtplib
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import parseaddr, parsedate_to_datetime
 
+from imap_parsing import decode_partial, find_text_section, parse_fetch_response
+from message_log import MessageLog, migrate_csv
+from metrics import METRICS
 
+
+# Segmented log of processed emails
+EMAIL_LOG = "email_log"
+# Single CSV the emails used to be logged to, migrated into EMAIL_LOG on first use
 EMAIL_CSV = "emails.csv"
+EMAIL_INDEX = EMAIL_CSV + ".idx"
+# First line of the dedup index; files without it hold older keys and are rebuilt
+INDEX_HEADER = "# dedup index v2: sender and Date\n"
+IMAP_CHECKPOINT = "imap_checkpoint.json"
 IMAP_SERVER = "imap.gmail.com"
 SMTP_SERVER = "smtp.gmail.com"
+SMTP_IDLE_EXPIRY_S = 60
+FETCH_BATCH_SIZE = 50
+CATCH_UP_CHUNK_SIZE = 200
+# Catch-up parser processes start from a fresh interpreter rather than a fork, which
+# would copy a lock held by the outbox or metrics threads into the worker, locked
+CATCH_UP_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+UID_PATTERN = re.compile(rb"UID (\d+)")
+UIDVALIDITY_PATTERN = re.compile(rb"UIDVALIDITY (\d+)")
+EXISTS_PATTERN = re.compile(rb"\* \d+ EXISTS")
+# RFC 2177 servers may drop IDLE after 30 minutes, so re-issue it well before
+IDLE_TIMEOUT_S = 20 * 60
+IDLE_COMMAND_TIMEOUT_S = 30
+IDLE_WAKE_S = 1
+SESSION_NOOP_AFTER_S = 60
+PARTIAL_HEADERS = "FROM DATE SUBJECT MESSAGE-ID"
+# Enough for any command message; the rest of a long body or attachment is never downloaded
+MESSAGE_BYTE_CAP = 1024
+DISCORD_MESSAGE_LIMIT = 2000
+DISCORD_MAX_RATE_LIMIT_RETRIES = 5
+# Longest rate limit wait honoured on the sending thread; longer ones fail the post and are left to the outbox backoff
+DISCORD_MAX_RETRY_AFTER_S = 60
+
+
+class SMTPConnectionPool:
+    """Keep authenticated SMTP sessions open between sends"""
+
+    def __init__(self, connect, max_size: int = 2, idle_expiry_s: float = SMTP_IDLE_EXPIRY_S):
+        """
+        Args:
+            connect: Callable returning a logged in smtplib.SMTP, or None on failure.
+            max_size (int): Most idle sessions kept open.
+            idle_expiry_s (float): Idle sessions older than this are closed rather than reused.
+        """
+        self.connect = connect
+        self.max_size = max_size
+        self.idle_expiry_s = idle_expiry_s
+        self._idle = []  # (server, last used) pairs, most recent last
+        self._lock = threading.Lock()
+
+    def acquire(self) -> smtplib.SMTP:
+        """Take a healthy pooled session, connecting a new one if none is available."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.idle_expiry_s and self._healthy(server):
+                return server
+            self._close(server)
+        return self._connect()
+
+    def release(self, server: smtplib.SMTP, healthy: bool = True):
+        """Return a session to the pool, closing it if broken or the pool is full."""
+        with self._lock:
+            if healthy and len(self._idle) < self.max_size:
+                self._idle.append((server, time.monotonic()))
+                return
+        self._close(server)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a session for a with block, yielding a lease with a sendmail method."""
+        lease = _SMTPLease(self, self.acquire())
+        healthy = False
+        try:
+            yield lease
+            healthy = True
+        finally:
+            self.release(lease.server, healthy)
+
+    def close(self):
+        """Close every idle session."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._close(server)
+
+    def _connect(self) -> smtplib.SMTP:
+        server = self.connect()
+        if server is None:
+            raise ConnectionError("Could not connect to SMTP server")
+        return server
+
+    @staticmethod
+    def _healthy(server: smtplib.SMTP) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    @staticmethod
+    def _close(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+
+class _SMTPLease:
+    """A pooled SMTP session that transparently reconnects if the server dropped it"""
+
+    def __init__(self, pool: SMTPConnectionPool, server: smtplib.SMTP):
+        self.pool = pool
+        self.server = server
+
+    def sendmail(self, from_addr: str, to_addr: str, msg: str):
+        try:
+            self.server.sendmail(from_addr, to_addr, msg)
+        except smtplib.SMTPServerDisconnected:
+            self.pool._close(self.server)
+            self.server = self.pool._connect()
+            self.server.sendmail(from_addr, to_addr, msg)
 
 
 class EmailClient:
     """Scrape emails from email account"""
 
+    imap_host = IMAP_SERVER
+    imap_port = 993
+    imap_ssl = True
+    smtp_host = SMTP_SERVER
+    smtp_port = 587
+    smtp_tls = True
+    # Fetch headers and BODYSTRUCTURE first, then only the capped text section
+    partial_fetch = False
+
     def connect_to_email(self) -> imaplib.IMAP4_SSL:
         """
         Connect to the gmail account using IMAP.
@@ -36,11 +177,136 @@ class EmailClient:
             )
 
         # mail: imaplib.IMAP4_SSL = imaplib.IMAP4_SSL("outlook.office365.com", 993)
-        mail = imaplib.IMAP4_SSL("imap.gmail.com")
-        mail.login(email_username, email_password)
-        mail.select("inbox")
+        with METRICS.timer("imap_login"):
+            if self.imap_ssl:
+                mail = imaplib.IMAP4_SSL(self.imap_host, self.imap_port)
+            else:
+                mail = imaplib.IMAP4(self.imap_host, self.imap_port)
+            mail.login(email_username, email_password)
+            mail.select("inbox")
+        METRICS.increment("imap_logins")
+        return mail
+
+    def get_connection(self):
+        """
+        Return the cached authenticated IMAP session, reconnecting when it has died.
+
+        A session idle for longer than SESSION_NOOP_AFTER_S is checked with NOOP
+        before being reused, so back-to-back polls cost no extra round trip.
+        """
+        mail = getattr(self, "_mail", None)
+        if mail is not None:
+            if time.monotonic() - self._session_used_at < SESSION_NOOP_AFTER_S:
+                return mail
+            try:
+                typ, _ = mail.noop()
+                if typ == "OK":
+                    self._session_used_at = time.monotonic()
+                    return mail
+            except (imaplib.IMAP4.error, OSError) as e:
+                print(f"IMAP session check failed: {e}, reconnecting")
+            self.close_session()
+        mail = self.connect_to_email()
+        self._mail = mail
+        self._session_uidvalidity = self._read_uidvalidity(mail)
+        self._session_used_at = time.monotonic()
         return mail
 
+    def close(self):
+        """Log out of the cached IMAP session and close the message log, on shutdown."""
+        self.close_session()
+        log = getattr(self, "_message_log", None)
+        self._message_log = None
+        if log is not None:
+            log.close()
+
+    def close_session(self):
+        """
+        Log out of the cached IMAP session, if any, so the next fetch reconnects.
+
+        The message log stays open, as other threads may be writing to it.
+        """
+        mail = getattr(self, "_mail", None)
+        self._mail = None
+        if mail is None:
+            return
+        try:
+            mail.logout()
+        except Exception:
+            pass
+
+    def supports_idle(self, mail) -> bool:
+        """Check whether the IMAP server advertises the IDLE extension."""
+        return "IDLE" in mail.capabilities
+
+    def idle(self, mail, timeout_s: float = IDLE_TIMEOUT_S, stop_event=None) -> bool:
+        """
+        Block in IMAP IDLE until the server announces new mail or timeout_s passes.
+
+        Args:
+            mail: A selected IMAP connection whose server supports IDLE.
+            timeout_s (float): Seconds to wait before ending IDLE so it can be re-issued
+                ahead of the server's inactivity timeout.
+            stop_event (threading.Event): Optional event that ends the wait early.
+
+        Returns:
+            bool: True if the server reported new messages.
+        """
+        # New mail announced alongside the previous command is not repeated during IDLE
+        if mail.untagged_responses.pop("EXISTS", None):
+            return True
+        tag = mail._new_tag()
+        mail.send(tag + b" IDLE\r\n")
+        buffer = bytearray()
+        line = self._idle_readline(mail.sock, buffer, time.monotonic() + IDLE_COMMAND_TIMEOUT_S)
+        if line is None or not line.startswith(b"+"):
+            raise imaplib.IMAP4.abort(f"IDLE rejected: {line!r}")
+
+        got_new = False
+        deadline = time.monotonic() + timeout_s
+        while not got_new and time.monotonic() < deadline:
+            if stop_event is not None and stop_event.is_set():
+                break
+            line = self._idle_readline(mail.sock, buffer, min(deadline, time.monotonic() + IDLE_WAKE_S))
+            got_new = line is not None and EXISTS_PATTERN.match(line) is not None
+
+        mail.send(b"DONE\r\n")
+        command_deadline = time.monotonic() + IDLE_COMMAND_TIMEOUT_S
+        while True:
+            line = self._idle_readline(mail.sock, buffer, command_deadline)
+            if line is None:
+                raise imaplib.IMAP4.abort("Timed out waiting for IDLE to complete")
+            if line.startswith(tag):
+                break
+            got_new = got_new or EXISTS_PATTERN.match(line) is not None
+        return got_new
+
+    @staticmethod
+    def _idle_readline(sock, buffer: bytearray, deadline: float):
+        """
+        Read one line straight from the socket, or return None at the deadline.
+
+        imaplib's buffered file cannot be read with a timeout without breaking it,
+        so IDLE responses are read from the socket directly.
+        """
+        while b"\n" not in buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # SSL sockets may hold decrypted bytes that select() cannot see
+            if not getattr(sock, "pending", lambda: 0)():
+                ready, _, _ = select.select([sock], [], [], remaining)
+                if not ready:
+                    return None
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise imaplib.IMAP4.abort("Connection closed during IDLE")
+            buffer += chunk
+        end = buffer.index(b"\n") + 1
+        line = bytes(buffer[:end])
+        del buffer[:end]
+        return line
+
     def decode_header_value(self, value: str) -> str:
         """Decode email header value."""
         decoded, encoding = decode_header(value)[0]
@@ -80,108 +346,528 @@ class EmailClient:
             "message": content.strip(),
         }
 
-    def save_to_csv(self, data: dict):
-        """Append email data to a CSV file."""
-        with open(EMAIL_CSV, "a", newline="", encoding="utf-8") as file:
-            writer = csv.writer(file)
-            writer.writerow([data["timestamp"], data["sender"], data["subject"], data["message"]])
+    def message_log(self) -> MessageLog:
+        """The email log, opened (and migrated from the legacy CSV) on first use."""
+        log = getattr(self, "_message_log", None)
+        if log is None:
+            log = self._message_log = open_message_log()
+        return log
+
+    def save_email(self, data: dict):
+        """Append email data to the message log and record it in the dedup index."""
+        with METRICS.timer("log_append"):
+            self.message_log().append(data)
+            self._index_key(dedup_key(data["sender"], data["timestamp"]))
 
-    def email_already_logged(self, timestamp: str) -> bool:
-        """Check if the email timestamp already exists in the CSV file."""
+    def _load_index(self) -> set:
+        """
+        Load the dedup index of logged (sender, Date) keys, building it on first use.
+
+        The index is a file with a header line and one key per line. If it is
+        missing or in an older format it is rebuilt from the message log.
+        """
+        index = getattr(self, "_logged_keys", None)
+        if index is not None:
+            return index
+        with METRICS.timer("dedup_index_load"):
+            index = self._read_index()
+        self._logged_keys = index
+        return index
+
+    def _read_index(self) -> set:
         try:
-            with open(EMAIL_CSV, "r", encoding="utf-8") as file:
-                reader = csv.reader(file)
-                return any(row[0] == timestamp for row in reader)
+            with open(EMAIL_INDEX, "r", encoding="utf-8") as file:
+                if file.readline() == INDEX_HEADER:
+                    return {line.rstrip("\n") for line in file}
         except FileNotFoundError:
-            # If file doesn't exist, it's the first time writing
+            pass
+        index = {dedup_key(record["sender"], record["timestamp"]) for record in self.message_log()}
+        tmp_path = EMAIL_INDEX + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(INDEX_HEADER)
+            file.writelines(f"{key}\n" for key in index)
+        os.replace(tmp_path, EMAIL_INDEX)
+        return index
+
+    def _index_key(self, key: str):
+        """Add a key to the in-memory index and append it to the index file."""
+        index = self._load_index()
+        if key in index:
+            return
+        index.add(key)
+        with open(EMAIL_INDEX, "a", encoding="utf-8") as file:
+            file.write(f"{key}\n")
+
+    def email_already_logged(self, sender: str, timestamp: str) -> bool:
+        """Check if an email from sender with this Date already exists in the message log."""
+        with METRICS.timer("dedup_lookup"):
+            return dedup_key(sender, timestamp) in self._load_index()
+
+    def _read_uidvalidity(self, mail) -> int:
+        """Read the mailbox UIDVALIDITY, preferring the untagged SELECT response."""
+        try:
+            _, data = mail.response("UIDVALIDITY")
+            if not data or data[0] is None:
+                _, data = mail.status("inbox", "(UIDVALIDITY)")
+                data = UIDVALIDITY_PATTERN.findall(data[0])
+            return int(data[0])
+        except Exception:
+            return 0
+
+    def _load_checkpoint(self, uidvalidity: int) -> dict:
+        """Load the last seen UID, starting over when the mailbox UIDVALIDITY changed."""
+        try:
+            with open(IMAP_CHECKPOINT, "r", encoding="utf-8") as file:
+                checkpoint = json.load(file)
+            if checkpoint.get("uidvalidity") == uidvalidity:
+                return checkpoint
+        except (FileNotFoundError, ValueError):
+            pass
+        return {"uidvalidity": uidvalidity, "last_uid": 0}
+
+    def _checkpoint_for(self, mail) -> dict:
+        """Load the checkpoint for a connection, using the cached UIDVALIDITY of the session"""
+        if mail is getattr(self, "_mail", None):
+            return self._load_checkpoint(self._session_uidvalidity)
+        return self._load_checkpoint(self._read_uidvalidity(mail))
+
+    def save_checkpoint(self, checkpoint: dict):
+        """Atomically persist the UID checkpoint."""
+        tmp_path = IMAP_CHECKPOINT + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(checkpoint, file)
+        os.replace(tmp_path, IMAP_CHECKPOINT)
+
+    def allowed_senders(self) -> list:
+        """Addresses whose mail is processed, from the comma separated EXPECTED_SENDER"""
+        return [sender.strip() for sender in os.getenv("EXPECTED_SENDER", "").split(",") if sender.strip()]
+
+    def _from_criteria(self) -> str:
+        """IMAP SEARCH criteria matching any allowed sender"""
+        senders = self.allowed_senders()
+        criteria = f'FROM "{senders[-1]}"'
+        for sender in reversed(senders[:-1]):
+            criteria = f'OR FROM "{sender}" {criteria}'
+        return criteria
+
+    def _search_new_uids(self, mail, last_uid: int) -> list:
+        """Search for UIDs from the expected sender newer than last_uid."""
+        with METRICS.timer("imap_search"):
+            _, data = mail.uid("search", None, f'({self._from_criteria()} UID {last_uid + 1}:*)')
+        uids = [int(uid) for uid in data[0].split()] if data and data[0] else []
+        # "UID n:*" always matches the newest message, even when it is older than n
+        return sorted(uid for uid in uids if uid > last_uid)
+
+    @staticmethod
+    def _uid_set(uids: list) -> str:
+        """Compress sorted UIDs into an IMAP sequence set, e.g. 1:3,7,9:10."""
+        ranges = []
+        for uid in uids:
+            if ranges and uid == ranges[-1][1] + 1:
+                ranges[-1][1] = uid
+            else:
+                ranges.append([uid, uid])
+        return ",".join(str(lo) if lo == hi else f"{lo}:{hi}" for lo, hi in ranges)
+
+    def _fetch_uids(self, mail, uids: list, query: str = "(RFC822)"):
+        """Yield (uid, raw message) pairs, issuing one UID FETCH per batch."""
+        if self.partial_fetch:
+            yield from self._fetch_partial(mail, uids)
+            return
+        for start in range(0, len(uids), FETCH_BATCH_SIZE):
+            batch = uids[start:start + FETCH_BATCH_SIZE]
+            with METRICS.timer("imap_fetch"):
+                _, msg_data = mail.uid("fetch", self._uid_set(batch), query)
+            METRICS.increment("imap_fetched_messages", len(batch))
+            for response_part in msg_data:
+                if isinstance(response_part, tuple):
+                    match = UID_PATTERN.search(response_part[0])
+                    yield (int(match.group(1)) if match else None), response_part[1]
+
+    def _fetch_partial(self, mail, uids: list):
+        """
+        Yield (uid, raw message) pairs without downloading whole messages.
+
+        Each batch takes one FETCH for the headers and BODYSTRUCTURE, then one
+        per distinct text section for at most MESSAGE_BYTE_CAP bytes of it. The
+        decoded text is wrapped in a small single-part message so parse_raw
+        treats it like any other.
+        """
+        for start in range(0, len(uids), FETCH_BATCH_SIZE):
+            batch = uids[start:start + FETCH_BATCH_SIZE]
+            with METRICS.timer("imap_fetch"):
+                _, msg_data = mail.uid(
+                    "fetch", self._uid_set(batch), f"(BODY.PEEK[HEADER.FIELDS ({PARTIAL_HEADERS})] BODYSTRUCTURE)"
+                )
+            METRICS.increment("imap_fetched_messages", len(batch))
+            headers = {}
+            sections = {}
+            for fields in parse_fetch_response(msg_data):
+                uid = int(fields["UID"])
+                # Servers may echo the field list back in their own case or order
+                headers[uid] = next((v for k, v in fields.items() if k.startswith("BODY[HEADER.FIELDS")), None) or b""
+                found = find_text_section(fields.get("BODYSTRUCTURE") or [])
+                if found:
+                    sections.setdefault(found[0], []).append((uid, found))
+
+            texts = {}
+            for section, wanted in sections.items():
+                with METRICS.timer("imap_fetch"):
+                    _, msg_data = mail.uid(
+                        "fetch", self._uid_set([uid for uid, _ in wanted]), f"(BODY.PEEK[{section}]<0.{MESSAGE_BYTE_CAP}>)"
+                    )
+                data = {
+                    int(fields["UID"]): fields.get(f"BODY[{section}]<0>") or b"" for fields in parse_fetch_response(msg_data)
+                }
+                for uid, (_, encoding, charset) in wanted:
+                    texts[uid] = decode_partial(data.get(uid, b""), encoding, charset)
+
+            for uid in sorted(headers):
+                body = base64.encodebytes(texts.get(uid, "").encode("utf-8"))
+                yield uid, (
+                    headers[uid].rstrip(b"\r\n") + b"\r\nContent-Type: text/plain; charset=utf-8"
+                    b"\r\nContent-Transfer-Encoding: base64\r\n\r\n" + body
+                )
+
+    def parse_raw(self, raw: bytes) -> dict:
+        """Parse a raw RFC822 message."""
+        with METRICS.timer("parse_email"):
+            return self.parse_email(email.message_from_bytes(raw))
+
+    def store_new_email(self, parsed_email: dict) -> bool:
+        """Log an email from an allowed sender, returning False for duplicates."""
+        if not any(sender in parsed_email["sender"] for sender in self.allowed_senders()):
+            return False
+        if self.email_already_logged(parsed_email["sender"], parsed_email["timestamp"]):
+            print(f"Got duplicate email from {parsed_email['sender']} with timestamp {parsed_email['timestamp']}, skipping")
             return False
+        self.save_email(parsed_email)
+        print(f"Saved email from {parsed_email['sender']} at time {parsed_email['timestamp']}")
+        return True
+
+    def fetch_and_store_emails(self, mail=None):
+        """
+        Fetch and process emails from Gmail newer than the UID checkpoint.
+
+        Args:
+            mail: Optional open IMAP connection to use instead of the cached session.
+
+        Returns:
+            list: Message text of each new email.
+        """
+        return [parsed_email["message"] for parsed_email in self.fetch_new_emails(mail)]
+
+    def fetch_raw_emails(self, after_uid: int = 0, mail=None, uidvalidity: int = None) -> tuple:
+        """
+        Fetch raw messages past the UID checkpoint without parsing or logging them.
+
+        The checkpoint is not advanced; callers save it with save_checkpoint once
+        the messages are logged. Connection errors drop the session and are raised.
 
-    def fetch_and_store_emails(self):
-        """Fetch and process emails from Gmail."""
-        mail = None
-        new_messages = []
+        Args:
+            after_uid (int): Also skip UIDs up to this one, e.g. messages already in flight.
+            mail: Optional open IMAP connection to use instead of the cached session.
+            uidvalidity (int): UIDVALIDITY after_uid belongs to, after_uid is ignored once the mailbox's differs.
+
+        Returns:
+            tuple: The stored checkpoint dict and a list of (uid, raw bytes) pairs.
+        """
         try:
-            # Connect to Gmail's IMAP server
-            mail = self.connect_to_email()
-
-            # Search for all emails
-            _, messages = mail.search(None, f'(FROM "{os.getenv("EXPECTED_SENDER")}")')
-            messages = messages[0].split()
-
-            for msg_num in messages:  # Fetch the last 5 emails for testing
-                _, msg_data = mail.fetch(msg_num, "(RFC822)")
-                for response_part in msg_data:
-                    if isinstance(response_part, tuple):
-                        msg = email.message_from_bytes(response_part[1])
-                        try:
-                            parsed_email = self.parse_email(msg)
-                            if os.getenv("EXPECTED_SENDER") in parsed_email["sender"]:
-                                if not self.email_already_logged(parsed_email["timestamp"]):
-                                    self.save_to_csv(parsed_email)
-                                    new_messages.append(parsed_email["message"])
-                                    print(f"Saved email from {parsed_email['sender']} at time {parsed_email['timestamp']}")
-                                else:
-                                    print(f"Got duplicate email with timestamp {parsed_email['timestamp']}, breaking loop")
-                                    return
-                        except Exception as e:
-                            print(f"Skipping email, got error {str(e)}")
+            if mail is None:
+                mail = self.get_connection()
+            checkpoint = self._checkpoint_for(mail)
+            if uidvalidity is not None and uidvalidity != checkpoint["uidvalidity"]:
+                after_uid = 0
+            uids = self._search_new_uids(mail, max(checkpoint["last_uid"], after_uid))
+            raw_emails = list(self._fetch_uids(mail, uids))
+            self._session_used_at = time.monotonic()
+            return checkpoint, raw_emails
+        except Exception:
+            if mail is not None and mail is getattr(self, "_mail", None):
+                self.close_session()
+            raise
+
+    def fetch_new_emails(self, mail=None) -> list:
+        """
+        Fetch, log and return new emails newer than the UID checkpoint.
+
+        Args:
+            mail: Optional open IMAP connection to use instead of the cached session.
+
+        Returns:
+            list: Parsed email dicts with timestamp, sender, subject and message.
+        """
+        new_emails = []
+        checkpoint = None
+        try:
+            # Reuse the authenticated session with Gmail's IMAP server
+            if mail is None:
+                mail = self.get_connection()
+            checkpoint = self._checkpoint_for(mail)
+
+            # Only ask for messages past the last seen UID
+            uids = self._search_new_uids(mail, checkpoint["last_uid"])
+
+            for uid, raw in self._fetch_uids(mail, uids):
+                try:
+                    parsed_email = self.parse_raw(raw)
+                    if self.store_new_email(parsed_email):
+                        new_emails.append(parsed_email)
+                except Exception as e:
+                    print(f"Skipping email, got error {str(e)}")
+                if uid is not None:
+                    checkpoint["last_uid"] = max(checkpoint["last_uid"], uid)
+            self._session_used_at = time.monotonic()
 
         except Exception as e:
             print(f"Error fetching emails: {e}")
+            # Drop a possibly broken session so the next poll reconnects
+            if mail is not None and mail is getattr(self, "_mail", None):
+                self.close_session()
 
         finally:
-            if mail:
-                mail.logout()
-            return new_messages
+            if checkpoint is not None:
+                self.save_checkpoint(checkpoint)
+            return new_emails
+
+    def catch_up(self, workers: int = None, chunk_size: int = None, mail=None) -> tuple:
+        """
+        Fetch and log a large backlog past the UID checkpoint.
+
+        While one chunk of UIDs is being fetched, earlier chunks are parsed on a
+        process pool. Once everything is parsed the emails are logged in
+        timestamp order, so duplicates of each other or of earlier logs are
+        skipped wherever they sit in the backlog, and the checkpoint is saved.
+
+        Args:
+            workers (int): Parser processes, defaults to the CPU count.
+            chunk_size (int): UIDs fetched and parsed per chunk, CATCH_UP_CHUNK_SIZE by default.
+            mail: Optional open IMAP connection to use instead of the cached session.
+
+        Returns:
+            tuple: The newly logged email dicts in timestamp order and a dict
+                counting fetched, new, duplicate and unparseable messages.
+        """
+        if mail is None:
+            mail = self.get_connection()
+        checkpoint = self._checkpoint_for(mail)
+        uids = self._search_new_uids(mail, checkpoint["last_uid"])
+        chunk_size = chunk_size or CATCH_UP_CHUNK_SIZE
+        parsed = []
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(CATCH_UP_START_METHOD)) as executor:
+            futures = []
+            for start in range(0, len(uids), chunk_size):
+                raw_emails = list(self._fetch_uids(mail, uids[start:start + chunk_size]))
+                futures.append(executor.submit(parse_raw_batch, raw_emails))
+            for future in futures:
+                parsed.extend(future.result())
+        self._session_used_at = time.monotonic()
+
+        new_emails = []
+        errors = 0
+        for uid, parsed_email in sorted(parsed, key=_timestamp_order):
+            if parsed_email is None:
+                errors += 1
+            elif self.store_new_email(parsed_email):
+                new_emails.append(parsed_email)
+            if uid is not None:
+                checkpoint["last_uid"] = max(checkpoint["last_uid"], uid)
+        self.save_checkpoint(checkpoint)
+        report = {
+            "fetched": len(parsed),
+            "new": len(new_emails),
+            "duplicates": len(parsed) - len(new_emails) - errors,
+            "errors": errors,
+        }
+        return new_emails, report
 
     def connect_smtp(self):
         """Connect to the SMTP server."""
         try:
-            server = smtplib.SMTP(SMTP_SERVER, 587)
-            server.starttls()
+            server = smtplib.SMTP(self.smtp_host, self.smtp_port)
+            if self.smtp_tls:
+                server.starttls()
             server.login(os.environ["EMAIL_USERNAME"], os.environ["EMAIL_PASSWORD"])
             return server
         except Exception as e:
             print(f"Failed to connect to SMTP server: {e}")
             return None
 
-    def send_message(self, body: str, subject: str = ""):
-        """Send an email message."""
-        try:
-            # Set up the server and login
-            server = self.connect_smtp()
-            if server is None:
-                print("Failed to send email. SMTP server connection error.")
-                return
-
-            # Create email message
-            message = MIMEMultipart()
-            message["From"] = os.environ["EMAIL_USERNAME"]
-            message["To"] = os.environ["EXPECTED_SENDER"]
-            message["Subject"] = subject
-            message.attach(MIMEText(body, "plain"))
+    def smtp_pool(self) -> "SMTPConnectionPool":
+        """Return the SMTP connection pool shared by this client's sends."""
+        pool = getattr(self, "_smtp_pool", None)
+        if pool is None:
+            pool = self._smtp_pool = SMTPConnectionPool(self.connect_smtp)
+        return pool
+
+    def build_message(self, body: str, subject: str = "", recipients: list = None) -> str:
+        """Build the MIME text of an outgoing email, to every allowed sender unless recipients are given."""
+        message = MIMEMultipart()
+        message["From"] = os.environ["EMAIL_USERNAME"]
+        message["To"] = ", ".join(recipients or self.allowed_senders())
+        message["Subject"] = subject
+        message.attach(MIMEText(body, "plain"))
+        return message.as_string()
+
+    def send_message(self, body: str, subject: str = "", recipient: str = None) -> bool:
+        """Send an email message to recipient, or to every allowed sender."""
+        return self.send_messages([(body, subject, recipient)]) == 1
+
+    def send_messages(self, messages: list) -> int:
+        """
+        Send many email messages through one pooled SMTP session.
 
-            # Send the email
-            server.sendmail(os.environ["EMAIL_USERNAME"], os.environ["EXPECTED_SENDER"], message.as_string())
-            server.quit()
+        Args:
+            messages (list): Message bodies, or (body, subject) or (body, subject, recipient) tuples.
+                Messages without a recipient go to every allowed sender.
 
-            print(f"Message sent to {os.environ['EXPECTED_SENDER']}")
+        Returns:
+            int: Number of messages sent.
+        """
+        pool = self.smtp_pool()
+        sent = 0
+        try:
+            # Set up the server and login, or reuse a pooled session
+            with pool.connection() as server:
+                for item in messages:
+                    # Pad a bare body or (body, subject) with the default subject and recipient
+                    body, subject, recipient = (*((item,) if isinstance(item, str) else item), "", None)[:3]
+                    recipients = [recipient] if recipient else self.allowed_senders()
+                    with METRICS.timer("smtp_send"):
+                        message = self.build_message(body, subject, recipients)
+                        server.sendmail(os.environ["EMAIL_USERNAME"], recipients, message)
+                    sent += 1
+                    print(f"Message sent to {', '.join(recipients)}")
+        except ConnectionError:
+            print("Failed to send email. SMTP server connection error.")
         except Exception as e:
             print(f"Failed to send message: {e}")
+        return sent
+
+
+def split_message(body: str, limit: int) -> list:
+    """Split text into chunks of at most limit characters, preferring line breaks."""
+    chunks = []
+    current = ""
+    for line in body.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            chunks.append(current)
+            current = ""
+        current += line
+    if current or not chunks:
+        chunks.append(current)
+    return chunks
+
+
+def dedup_key(sender: str, timestamp: str) -> str:
+    """
+    Dedup index key of an email: the sender's address and its Date.
+
+    Folded header whitespace is collapsed so the key fits on one index line,
+    and the two parts are joined with a tab, which neither can then contain.
+    """
+    address = parseaddr(sender)[1].lower() or " ".join(sender.split())
+    return f"{address}\t{' '.join(timestamp.split())}"
+
+
+def open_message_log() -> MessageLog:
+    """Open EMAIL_LOG, moving the rows of a legacy EMAIL_CSV into it if the log is new"""
+    log = MessageLog(EMAIL_LOG)
+    if not os.path.exists(EMAIL_CSV):
+        return log
+    if log.segments:
+        # The migrated log was moved into place but the CSV not renamed before a crash
+        os.replace(EMAIL_CSV, EMAIL_CSV + ".migrated")
+        return log
+    log.close()
+    count = migrate_csv(EMAIL_CSV, EMAIL_LOG)
+    print(f"Migrated {count} emails from {EMAIL_CSV} to {EMAIL_LOG}")
+    return MessageLog(EMAIL_LOG)
+
+
+def parse_raw_batch(raw_emails: list) -> list:
+    """Parse (uid, raw) pairs into (uid, parsed email or None); runs in worker processes."""
+    client = EmailClient()
+    parsed = []
+    for uid, raw in raw_emails:
+        try:
+            parsed.append((uid, client.parse_raw(raw)))
+        except Exception as e:
+            print(f"Skipping email, got error {str(e)}")
+            parsed.append((uid, None))
+    return parsed
+
+
+def _timestamp_order(item: tuple) -> tuple:
+    """Sort key putting parsed emails in Date order, UID order breaking ties"""
+    uid, parsed_email = item
+    try:
+        sent = parsedate_to_datetime(parsed_email["timestamp"]).timestamp()
+    except (TypeError, ValueError, IndexError):
+        # Unparseable messages and dates keep their mailbox position at the end
+        sent = float("inf")
+    return sent, uid or 0
 
 
 class DiscordClient(EmailClient):
     """Use discord to send messages instead of text"""
 
-    def send_message(self, body: str, subject: str = ""):
-        data = {"content": body}
-        response = requests.post(
-            os.environ["DISCORD_WEBHOOK"],
-            json=data,
-            timeout=10,
-        )
+    def session(self) -> requests.Session:
+        """Return the HTTP session reused for every webhook post."""
+        session = getattr(self, "_session", None)
+        if session is None:
+            session = self._session = requests.Session()
+        return session
+
+    def send_message(self, body: str, subject: str = "", recipient: str = None) -> bool:
+        """Post a message to the webhook, split to fit Discord's length limit. Every player shares the channel."""
+        sent = True
+        for chunk in split_message(body, DISCORD_MESSAGE_LIMIT):
+            sent = self._post(chunk) and sent
+        return sent
+
+    def _post(self, content: str) -> bool:
+        """Post one chunk, waiting out 429 rate limits."""
+        for attempt in range(DISCORD_MAX_RATE_LIMIT_RETRIES + 1):
+            with METRICS.timer("webhook_post"):
+                response = self.session().post(
+                    os.environ["DISCORD_WEBHOOK"],
+                    json={"content": content},
+                    timeout=10,
+                )
+            if response.status_code != 429:
+                break
+            METRICS.increment("webhook_rate_limited")
+            retry_after_s = self._retry_after_s(response)
+            if retry_after_s > DISCORD_MAX_RETRY_AFTER_S:
+                print(f"Discord asked to wait {retry_after_s}s, leaving the retry to the caller")
+                break
+            # Only wait when another attempt follows
+            if attempt < DISCORD_MAX_RATE_LIMIT_RETRIES:
+                time.sleep(retry_after_s)
         if response.status_code != 204:
+            METRICS.increment("webhook_failures")
             print("Failed to send message")
+            return False
+        return True
+
+    @staticmethod
+    def _retry_after_s(response) -> float:
+        """Read how long Discord asked us to wait, from the header or JSON body, never less than 0."""
+        try:
+            return max(0.0, float(response.headers["Retry-After"]))
+        except (KeyError, TypeError, ValueError):
+            pass
+        try:
+            return max(0.0, float(response.json()["retry_after"]))
+        except (KeyError, TypeError, ValueError):
+            return 1.0
 
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+"""Parse IMAP FETCH responses and BODYSTRUCTURE for partial message fetches"""
+import base64
+import binascii
+import quopri
+import re
+
+
+TOKEN_PATTERN = re.compile(
+    rb'\s*(?:(?P<open>\()|(?P<close>\))|"(?P<quoted>(?:[^"\\]|\\.)*)"'
+    rb'|\{(?P<literal>\d+)\}$|(?P<atom>[^\s()"\[]+(?:\[[^\]]*\])?(?:<\d+(?:\.\d+)?>)?))'
+)
+QP_TAIL_PATTERN = re.compile(rb"=[0-9A-Fa-f]?$")
+
+
+def _tokens(msg_data: list):
+    """Yield tokens from imaplib's mix of bytes lines and (line, literal) tuples"""
+    for segment in msg_data:
+        text, literal = segment if isinstance(segment, tuple) else (segment, None)
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            match = TOKEN_PATTERN.match(text, position)
+            if match is None or match.end() == position:
+                break
+            position = match.end()
+            if match.group("open"):
+                yield "("
+            elif match.group("close"):
+                yield ")"
+            elif match.group("quoted") is not None:
+                yield re.sub(rb"\\(.)", rb"\1", match.group("quoted"))
+            elif match.group("literal") is not None:
+                yield literal
+            else:
+                atom = match.group("atom")
+                yield None if atom.upper() == b"NIL" else atom
+
+
+def _parse_lists(tokens) -> list:
+    """Nest tokens into Python lists following the parentheses"""
+    stack = [[]]
+    for token in tokens:
+        if token == "(":
+            stack.append([])
+        elif token == ")":
+            if len(stack) > 1:
+                finished = stack.pop()
+                stack[-1].append(finished)
+        else:
+            stack[-1].append(token)
+    return stack[0]
+
+
+def parse_fetch_response(msg_data: list) -> list:
+    """
+    Parse the data returned by mail.uid("fetch", ...) into one dict per message.
+
+    Keys are the upper-cased data item names, e.g. "UID", "BODYSTRUCTURE" or
+    "BODY[HEADER.FIELDS (FROM DATE)]". Literals come back as bytes.
+    """
+    top = _parse_lists(_tokens(msg_data))
+    messages = []
+    for item in top:
+        if not isinstance(item, list):
+            continue
+        fields = {}
+        for i in range(0, len(item) - 1, 2):
+            name = item[i]
+            if isinstance(name, bytes):
+                fields[name.decode().upper()] = item[i + 1]
+        messages.append(fields)
+    return messages
+
+
+def _text(value) -> str:
+    return value.decode(errors="replace").lower() if isinstance(value, bytes) else ""
+
+
+def _params(value) -> dict:
+    """Turn a BODYSTRUCTURE parameter list into a dict with lower-case keys"""
+    if not isinstance(value, list):
+        return {}
+    return {_text(value[i]): value[i + 1] for i in range(0, len(value) - 1, 2)}
+
+
+def _parts(structure: list, prefix: str = ""):
+    """Yield (section, single-part structure) for every leaf part, in order"""
+    if structure and isinstance(structure[0], list):
+        index = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            index += 1
+            yield from _parts(child, f"{prefix}{index}.")
+    else:
+        yield prefix.rstrip(".") or "TEXT", structure
+
+
+def find_text_section(structure: list):
+    """
+    Pick the part parse_email would use: a .txt attachment, else the last inline text/plain.
+
+    Returns:
+        tuple: (section, transfer encoding, charset), or None if there is no such part.
+    """
+    body = None
+    attachment = None
+    for section, part in _parts(structure):
+        if len(part) < 7:
+            continue
+        content_type = f"{_text(part[0])}/{_text(part[1])}"
+        # Text parts carry a line count before the extension data
+        extension = part[8:] if content_type.startswith("text/") else part[7:]
+        disposition = extension[1] if len(extension) > 1 and isinstance(extension[1], list) else []
+        disposition_type = _text(disposition[0]) if disposition else ""
+        filename = _params(disposition[1] if len(disposition) > 1 else None).get("filename")
+        filename = filename or _params(part[2]).get("name")
+        # Mirror "attachment" in str(Content-Disposition) from parse_email
+        is_attachment = disposition_type == "attachment"
+        charset = _text(_params(part[2]).get("charset")) or "utf-8"
+        found = (section, _text(part[5]), charset)
+        if section == "TEXT":
+            # Single part messages use their body whatever its type
+            return found
+        if content_type == "text/plain" and not is_attachment:
+            body = found
+        if is_attachment and filename and _text(filename).endswith(".txt"):
+            attachment = found
+    return attachment or body
+
+
+def decode_partial(data: bytes, encoding: str, charset: str) -> str:
+    """Decode a possibly truncated body section"""
+    if encoding == "base64":
+        compact = b"".join(data.split())
+        compact = compact[:len(compact) - len(compact) % 4]
+        try:
+            data = base64.b64decode(compact)
+        except (binascii.Error, ValueError):
+            data = b""
+    elif encoding == "quoted-printable":
+        # Don't let a cut "=XX" escape turn into garbage
+        data = quopri.decodestring(QP_TAIL_PATTERN.sub(b"", data))
+    try:
+        return data.decode(charset, errors="ignore")
+    except LookupError:
+        return data.decode("utf-8", errors="ignore")
@@ -0,0 +1,93 @@
+"""Append-only journal of XP events for cheap, crash-safe persistence"""
+import json
+import os
+import time
+
+
+JOURNAL_SUFFIX = ".journal"
+# Force journal writes to disk after this many records or seconds, whichever comes first
+FSYNC_EVERY = 32
+FSYNC_INTERVAL_S = 1.0
+
+
+class Journal:
+    """
+    Write-ahead log of small JSON records, one per line.
+
+    Records are flushed to the OS on every append so a process crash loses
+    nothing. They are fsynced by sync(), which the owner calls once a batch of
+    changes is complete, and by append() every FSYNC_EVERY records or
+    FSYNC_INTERVAL_S seconds within a long batch. A power loss can only lose
+    records of a batch still in progress.
+    """
+
+    def __init__(self, path: str, fsync_every: int = FSYNC_EVERY, fsync_interval_s: float = FSYNC_INTERVAL_S):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval_s = fsync_interval_s
+        self.records = self._repair()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _repair(self) -> int:
+        """Cut off a torn final line so new records start on a clean line, returning the record count"""
+        records = 0
+        valid_bytes = 0
+        try:
+            with open(self.path, "rb") as file:
+                for line in file:
+                    try:
+                        json.loads(line)
+                    except ValueError:
+                        break
+                    if not line.endswith(b"\n"):
+                        break
+                    records += 1
+                    valid_bytes += len(line)
+            if valid_bytes < os.path.getsize(self.path):
+                os.truncate(self.path, valid_bytes)
+        except FileNotFoundError:
+            pass
+        return records
+
+    @staticmethod
+    def read(path: str):
+        """Yield the records in a journal file, stopping at a torn final line"""
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # A crash mid-append leaves at most one partial line at the end
+                        return
+        except FileNotFoundError:
+            return
+
+    def append(self, record: dict):
+        """Append one record"""
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        self.records += 1
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval_s:
+            self.sync()
+
+    def sync(self):
+        """fsync every appended record"""
+        if self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def reset(self):
+        """Empty the journal once its records are covered by a snapshot"""
+        self._file.close()
+        self._file = open(self.path, "w", encoding="utf-8")
+        self.records = 0
+        self._unsynced = 0
+
+    def close(self):
+        self.sync()
+        self._file.close()
@@ -0,0 +1,313 @@
+"""Segmented, indexed log of processed emails"""
+import bisect
+import csv
+import json
+import mmap
+import os
+import shutil
+import struct
+import time
+from array import array
+from email.utils import parsedate_to_datetime
+
+
+SEGMENT_SUFFIX = ".log"
+INDEX_SUFFIX = ".idx"
+# Start a new segment once the active one reaches this size...
+MAX_SEGMENT_BYTES = 4 * 2 ** 20
+# ...or spans this much message time
+MAX_SEGMENT_AGE_S = 7 * 24 * 60 * 60
+# Records between two sparse index entries
+INDEX_EVERY = 64
+# One sparse index entry: message time and byte offset of the record
+INDEX_ENTRY = struct.Struct("<dQ")
+CSV_FIELDS = ("timestamp", "sender", "subject", "message")
+# Directory a legacy CSV is migrated into before it replaces the log
+MIGRATING_SUFFIX = ".migrating"
+# Furthest a Date header may run ahead of the local clock before it is treated as now
+MAX_CLOCK_SKEW_S = 5 * 60
+
+
+def message_time(timestamp: str, default: float = None) -> float:
+    """Unix time of an email Date header, or default (the current time) if it does not parse"""
+    try:
+        return parsedate_to_datetime(timestamp).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return time.time() if default is None else default
+
+
+class Segment:
+    """
+    One log file and its sparse index.
+
+    Records are JSON lines carrying their message time as "t". The index holds
+    (t, offset) for the first record and every INDEX_EVERY-th after it, so a
+    range read seeks to the closest entry before its start instead of scanning
+    the whole segment.
+    """
+    __slots__ = ("number", "path", "index_path", "times", "offsets")
+
+    def __init__(self, directory: str, number: int):
+        self.number = number
+        self.path = os.path.join(directory, f"{number:08d}{SEGMENT_SUFFIX}")
+        self.index_path = os.path.join(directory, f"{number:08d}{INDEX_SUFFIX}")
+        self.times = array("d")
+        self.offsets = array("Q")
+
+    @property
+    def first_time(self) -> float:
+        return self.times[0] if self.times else float("inf")
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def load_index(self, index_every: int = INDEX_EVERY):
+        """Read the index, dropping a torn entry or entries past the end of the segment"""
+        try:
+            with open(self.index_path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            data = b""
+        size = self.size()
+        entries = INDEX_ENTRY.iter_unpack(data[:len(data) - len(data) % INDEX_ENTRY.size])
+        valid = [(t, offset) for t, offset in entries if offset < size]
+        if size and not valid:
+            self.rebuild_index(index_every)
+            return
+        self.times = array("d", (t for t, _ in valid))
+        self.offsets = array("Q", (offset for _, offset in valid))
+        if len(valid) * INDEX_ENTRY.size != len(data):
+            os.truncate(self.index_path, len(valid) * INDEX_ENTRY.size)
+
+    def rebuild_index(self, index_every: int = INDEX_EVERY):
+        """Recreate a missing index by scanning the segment"""
+        self.times = array("d")
+        self.offsets = array("Q")
+        for count, (offset, record) in enumerate(self.scan(0)):
+            if count % index_every == 0:
+                self.times.append(record["t"])
+                self.offsets.append(offset)
+        with open(self.index_path, "wb") as file:
+            for t, offset in zip(self.times, self.offsets):
+                file.write(INDEX_ENTRY.pack(t, offset))
+
+    def start_offset(self, start: float) -> int:
+        """Offset of the last indexed record before start, where a scan for start can begin"""
+        i = bisect.bisect_left(self.times, start) - 1
+        return self.offsets[i] if i >= 0 else 0
+
+    def scan(self, offset: int):
+        """Yield (offset, record) for every complete record from offset on, through an mmap"""
+        with open(self.path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if offset >= size:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                while offset < size:
+                    end = view.find(b"\n", offset)
+                    if end == -1:
+                        # A write still in progress, or a torn final line
+                        return
+                    yield offset, json.loads(view[offset:end])
+                    offset = end + 1
+
+    def tail(self, count: int) -> list:
+        """The last count complete records, oldest first"""
+        records = []
+        with open(self.path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if not size:
+                return records
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                end = view.rfind(b"\n")
+                while end != -1 and len(records) < count:
+                    start = view.rfind(b"\n", 0, end) + 1
+                    records.append(json.loads(view[start:end]))
+                    end = start - 1 if start else -1
+        records.reverse()
+        return records
+
+
+class MessageLog:
+    """
+    Append-only message log split into rotated, indexed segments.
+
+    Segments are numbered files in one directory. The active segment is rotated
+    when it grows past max_segment_bytes or spans more than max_segment_age_s of
+    message time, so old segments can be archived or deleted whole. Message
+    times are kept non-decreasing across the log, a Date earlier than the
+    previous record's being logged at that record's time, which keeps every
+    index sorted for range queries.
+    """
+
+    def __init__(self, directory: str, max_segment_bytes: int = MAX_SEGMENT_BYTES,
+                 max_segment_age_s: float = MAX_SEGMENT_AGE_S, index_every: int = INDEX_EVERY):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age_s = max_segment_age_s
+        self.index_every = index_every
+        os.makedirs(directory, exist_ok=True)
+        numbers = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit()
+        )
+        self.segments = [Segment(directory, number) for number in numbers]
+        self.last_time = float("-inf")
+        self._since_index = 0
+        self._file = None
+        self._index_file = None
+        if self.segments:
+            self._repair(self.segments[-1])
+        for segment in self.segments:
+            segment.load_index(index_every)
+        if self.segments and self.segments[-1].times:
+            # Resume the index cadence and time floor of the active segment
+            records = [record for _, record in self.segments[-1].scan(self.segments[-1].offsets[-1])]
+            self.last_time = records[-1]["t"]
+            self._since_index = len(records) % self.index_every
+
+    @staticmethod
+    def _repair(segment: Segment):
+        """Cut off a torn final record left by a crash mid-append"""
+        with open(segment.path, "rb") as file:
+            data = file.read()
+        valid_bytes = data.rfind(b"\n") + 1
+        if valid_bytes < len(data):
+            os.truncate(segment.path, valid_bytes)
+
+    def __iter__(self):
+        return self.range()
+
+    def _needs_rotation(self, t: float) -> bool:
+        segment = self.segments[-1] if self.segments else None
+        if segment is None:
+            return True
+        if not segment.times:
+            return False
+        size = self._file.tell() if self._file is not None else segment.size()
+        return size >= self.max_segment_bytes or t - segment.first_time >= self.max_segment_age_s
+
+    def _open_active(self):
+        segment = self.segments[-1]
+        self._file = open(segment.path, "ab")
+        self._index_file = open(segment.index_path, "ab")
+
+    def _rotate(self):
+        self.close()
+        number = self.segments[-1].number + 1 if self.segments else 1
+        self.segments.append(Segment(self.directory, number))
+        self._since_index = 0
+        self._open_active()
+
+    def append(self, data: dict, t: float = None):
+        """
+        Append one email.
+
+        Args:
+            data (dict): Parsed email with timestamp, sender, subject and message.
+            t (float): Message time, parsed from data["timestamp"] when not given.
+                Times more than MAX_CLOCK_SKEW_S ahead of the clock are logged as now,
+                so one far-future Date does not become the time of every later record.
+        """
+        t = message_time(data["timestamp"]) if t is None else t
+        now = time.time()
+        if t > now + MAX_CLOCK_SKEW_S:
+            t = now
+        t = max(t, self.last_time)
+        if self._needs_rotation(t):
+            self._rotate()
+        elif self._file is None:
+            self._open_active()
+        segment = self.segments[-1]
+        record = {"t": t, **{field: data[field] for field in CSV_FIELDS}}
+        offset = self._file.tell()
+        self._file.write(json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode("utf-8") + b"\n")
+        self._file.flush()
+        if self._since_index % self.index_every == 0:
+            self._index_file.write(INDEX_ENTRY.pack(t, offset))
+            self._index_file.flush()
+            segment.times.append(t)
+            segment.offsets.append(offset)
+        self._since_index = (self._since_index + 1) % self.index_every
+        self.last_time = t
+
+    def range(self, start: float = None, end: float = None):
+        """Yield the records with start <= t < end, oldest first, reading only the segments involved"""
+        start = float("-inf") if start is None else start
+        end = float("inf") if end is None else end
+        segments = self.segments
+        # Segment i covers message times from its first record up to the next segment's first
+        first = max(bisect.bisect_right([segment.first_time for segment in segments], start) - 1, 0)
+        for segment in segments[first:]:
+            if segment.first_time >= end:
+                return
+            for _, record in segment.scan(segment.start_offset(start)):
+                if record["t"] >= end:
+                    return
+                if record["t"] >= start:
+                    yield record
+
+    def tail(self, count: int) -> list:
+        """The last count records, oldest first"""
+        records = []
+        for segment in reversed(self.segments):
+            if len(records) >= count:
+                break
+            records = segment.tail(count - len(records)) + records
+        return records
+
+    def export_csv(self, path: str, start: float = None, end: float = None) -> int:
+        """Write records in a time range in the emails.csv layout, returning how many were written"""
+        count = 0
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            for record in self.range(start, end):
+                writer.writerow([record[field] for field in CSV_FIELDS])
+                count += 1
+        return count
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._index_file.close()
+        self._file = None
+        self._index_file = None
+
+
+def migrate_csv(csv_path: str, directory: str, **kwargs) -> int:
+    """
+    Build a message log in directory from every row of a legacy emails.csv, returning the row count.
+
+    The log is written to a MIGRATING_SUFFIX directory first and renamed into
+    place once complete, so a crash part way leaves no partial log and the next
+    run migrates again from scratch. The CSV is then renamed with a .migrated
+    suffix, so it is kept but not migrated twice.
+
+    Args:
+        csv_path (str): The legacy CSV.
+        directory (str): Where the log goes; must not hold any segments yet.
+        Other arguments are passed to MessageLog.
+    """
+    staging = directory + MIGRATING_SUFFIX
+    # Left over from a migration that crashed
+    shutil.rmtree(staging, ignore_errors=True)
+    log = MessageLog(staging, **kwargs)
+    count = 0
+    try:
+        with open(csv_path, "r", newline="", encoding="utf-8") as file:
+            for row in csv.reader(file):
+                if len(row) < len(CSV_FIELDS):
+                    continue
+                log.append(dict(zip(CSV_FIELDS, row)), t=message_time(row[0], default=max(log.last_time, 0.0)))
+                count += 1
+    finally:
+        log.close()
+    if os.path.isdir(directory):
+        # An empty log opened before the migration; rmdir refuses one holding anything
+        os.rmdir(directory)
+    os.replace(staging, directory)
+    os.replace(csv_path, csv_path + ".migrated")
+    return count
@@ -0,0 +1,171 @@
+"""Lightweight counters, timers and histograms for the hot path"""
+import contextlib
+import os
+import threading
+import time
+
+
+# Upper bounds in seconds for timer histograms
+BUCKETS_S = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+PROMETHEUS_PREFIX = "apollo_"
+# Shared do-nothing context manager handed out while metrics are disabled
+_NOOP = contextlib.nullcontext()
+
+
+class Histogram:
+    """Count, sum, max and cumulative bucket counts of observed durations"""
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS_S)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(BUCKETS_S):
+            if value <= bound:
+                self.buckets[i] += 1
+
+
+class Metrics:
+    """
+    In-process metrics registry.
+
+    While disabled every call returns straight away and timer() hands back a
+    shared no-op context manager, so instrumented code pays a function call
+    and nothing else.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started_at = time.time()
+
+    def increment(self, name: str, value: int = 1):
+        """Add value to a counter"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        """Record one duration in a histogram"""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def timer(self, name: str):
+        """Context manager timing its block into the named histogram"""
+        if not self.enabled:
+            return _NOOP
+        return self._timer(name)
+
+    @contextlib.contextmanager
+    def _timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def summary(self) -> str:
+        """Human readable report for the !perf command, slowest stages first"""
+        if not self.enabled:
+            return "Metrics are disabled, set APOLLO_METRICS=1 to collect them"
+        with self._lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: item[1].total, reverse=True)
+            counters = sorted(self.counters.items())
+        minutes = (time.time() - self.started_at) / 60
+        report = f"Performance over the last {minutes:.0f} minutes:"
+        for name, histogram in histograms:
+            mean_ms = histogram.total / histogram.count * 1000
+            report += (
+                f"\n\t{name}: {histogram.count} calls, {histogram.total:.2f}s total, "
+                f"mean {mean_ms:.1f} ms, max {histogram.max * 1000:.1f} ms"
+            )
+        for name, value in counters:
+            report += f"\n\t{name}: {value}"
+        return report
+
+    def prometheus_text(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        with self._lock:
+            histograms = [(name, histogram.count, histogram.total, list(histogram.buckets))
+                          for name, histogram in sorted(self.histograms.items())]
+            counters = sorted(self.counters.items())
+        lines = []
+        for name, value in counters:
+            metric = f"{PROMETHEUS_PREFIX}{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, count, total, buckets in histograms:
+            metric = f"{PROMETHEUS_PREFIX}{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for bound, bucket in zip(BUCKETS_S, buckets):
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {bucket}')
+            lines += [f'{metric}_bucket{{le="+Inf"}} {count}', f"{metric}_sum {total}", f"{metric}_count {count}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Atomically write the Prometheus text to path, e.g. for node_exporter's textfile collector"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> int:
+        """Serve the Prometheus text over HTTP from a daemon thread, returning the port"""
+        # Imported here as http.server pulls in most of the email package, which nothing else at startup needs
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        return self._server.server_address[1]
+
+    def stop_serving(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# Process-wide registry used by the instrumented modules
+METRICS = Metrics(enabled=os.getenv("APOLLO_METRICS") == "1")
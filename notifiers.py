@@ -0,0 +1,78 @@
+"""Notification sinks, looked up by name and imported on first use"""
+import importlib
+import os
+import sys
+
+
+# Sink used when none is injected, overridable with APOLLO_NOTIFIER
+DEFAULT_NOTIFIER = "discord"
+
+
+class NullNotifier:
+    """Drop every message"""
+
+    def send_message(self, body: str, subject: str = "", recipient: str = None) -> bool:
+        return True
+
+
+class ConsoleNotifier:
+    """Write messages to a stream, stdout by default"""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def send_message(self, body: str, subject: str = "", recipient: str = None) -> bool:
+        stream = self.stream or sys.stdout
+        stream.write(f"[{subject}] {body}\n" if subject else f"{body}\n")
+        stream.flush()
+        return True
+
+
+class MemoryNotifier:
+    """Keep (body, subject) of every message in messages, e.g. for tests and offline tools"""
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, body: str, subject: str = "", recipient: str = None) -> bool:
+        self.messages.append((body, subject))
+        return True
+
+
+# name -> "module:attribute" of a factory for an object with send_message(body, subject="", recipient=None),
+# or the factory itself. recipient names the player a message is for, None for everyone.
+# Modules are only imported when their sink is first created.
+NOTIFIERS = {
+    "console": "notifiers:ConsoleNotifier",
+    "discord": "email_client:DiscordClient",
+    "smtp": "email_client:EmailClient",
+    "null": "notifiers:NullNotifier",
+    "memory": "notifiers:MemoryNotifier",
+}
+
+
+def register_notifier(name: str, factory):
+    """Make a sink available by name, as a factory or a "module:attribute" string"""
+    NOTIFIERS[name] = factory
+
+
+def create_notifier(name: str = None, **kwargs):
+    """
+    Create the named sink, or the default one.
+
+    Args:
+        name (str): Key of NOTIFIERS, APOLLO_NOTIFIER or DEFAULT_NOTIFIER when None.
+        kwargs: Passed on to the sink's factory.
+
+    Raises:
+        ValueError: No sink is registered under name.
+    """
+    name = name or os.getenv("APOLLO_NOTIFIER") or DEFAULT_NOTIFIER
+    try:
+        factory = NOTIFIERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown notifier {name!r}, choose from {', '.join(sorted(NOTIFIERS))}") from None
+    if isinstance(factory, str):
+        module, _, attribute = factory.partition(":")
+        factory = getattr(importlib.import_module(module), attribute)
+    return factory(**kwargs)
@@ -0,0 +1,209 @@
+"""Durable outbox that delivers notifications on a background thread"""
+import json
+import os
+import threading
+import time
+
+from metrics import METRICS
+
+
+OUTBOX_FILE = "outbox.jsonl"
+# Rewrite the outbox once this many delivered records have piled up
+COMPACT_AFTER = 1000
+
+
+class CircuitBreaker:
+    """Stop calling a failing transport for a while after repeated failures"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout_s: float = 60):
+        """
+        Args:
+            failure_threshold (int): Consecutive failures before the circuit opens.
+            reset_timeout_s (float): Seconds the circuit stays open before one trial send.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.failures = 0
+        self.opened_at = None
+
+    def time_until_retry(self) -> float:
+        """Seconds until a send may be attempted, 0 when closed or half-open"""
+        if self.opened_at is None:
+            return 0
+        return max(0, self.opened_at + self.reset_timeout_s - time.monotonic())
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                print(f"Notification circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+
+class Outbox:
+    """
+    Append-only file of queued notifications, drained by a background sender.
+
+    Every message is written to disk before send_message returns, and only
+    acknowledged once the transport accepted it, so undelivered messages are
+    resent after a restart. Outbox has the same send_message signature as the
+    email clients so it can be handed to XPSystem as its notifier.
+    """
+
+    def __init__(
+        self,
+        transport,
+        path: str = None,
+        base_backoff_s: float = 1,
+        max_backoff_s: float = 300,
+        breaker: CircuitBreaker = None,
+    ):
+        """
+        Args:
+            transport: Object with send_message(body, subject, recipient) returning False on failure.
+            path (str): Outbox file, defaults to OUTBOX_FILE.
+            base_backoff_s (float): First retry delay after a failed send.
+            max_backoff_s (float): Ceiling for the retry delay.
+            breaker (CircuitBreaker): Breaker guarding the transport.
+        """
+        self.transport = transport
+        self.path = path or OUTBOX_FILE
+        self.base_backoff_s = base_backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.breaker = breaker or CircuitBreaker()
+        self._pending = {}  # id -> record, in insertion order
+        self._acked_records = 0
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._load()
+
+    def _load(self):
+        """Rebuild the pending queue from the outbox file"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn final line from a crash mid-append
+                        continue
+                    if record["op"] == "put":
+                        self._pending[record["id"]] = record
+                    else:
+                        self._pending.pop(record["id"], None)
+                        self._acked_records += 1
+                    self._next_id = max(self._next_id, record["id"] + 1)
+        except FileNotFoundError:
+            pass
+        if self._pending:
+            print(f"Outbox has {len(self._pending)} undelivered messages")
+
+    def _append(self, record: dict):
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def send_message(self, body: str, subject: str = "", recipient: str = None) -> bool:
+        """Queue a message for background delivery"""
+        with self._lock:
+            record = {"op": "put", "id": self._next_id, "body": body, "subject": subject}
+            if recipient:
+                record["recipient"] = recipient
+            self._next_id += 1
+            self._append(record)
+            self._pending[record["id"]] = record
+        self._wake.set()
+        return True
+
+    def pending(self) -> list:
+        """Undelivered messages, oldest first"""
+        with self._lock:
+            return list(self._pending.values())
+
+    def _ack(self, message_id: int):
+        with self._lock:
+            self._pending.pop(message_id, None)
+            self._acked_records += 1
+            if not self._pending:
+                # Nothing left to deliver, start a fresh file
+                open(self.path, "w", encoding="utf-8").close()
+                self._acked_records = 0
+            elif self._acked_records >= COMPACT_AFTER:
+                self._compact()
+            else:
+                self._append({"op": "ack", "id": message_id})
+
+    def _compact(self):
+        """Atomically rewrite the file with only the pending messages"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            for record in self._pending.values():
+                file.write(json.dumps(record) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        self._acked_records = 0
+
+    def start(self):
+        """Start the background sender thread"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-sender", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout_s: float = 10):
+        """Stop the sender, leaving undelivered messages on disk for the next start"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout_s)
+            self._thread = None
+
+    def flush(self, timeout_s: float = 10) -> bool:
+        """Wait until every queued message is delivered"""
+        deadline = time.monotonic() + timeout_s
+        while self.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self.pending()
+
+    def _deliver(self, record: dict) -> bool:
+        try:
+            with METRICS.timer("outbox_deliver"):
+                sent = self.transport.send_message(record["body"], record["subject"], record.get("recipient"))
+                delivered = sent is not False
+        except Exception as e:
+            print(f"Failed to deliver notification: {e}")
+            delivered = False
+        METRICS.increment("notifications_sent" if delivered else "notification_failures")
+        return delivered
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            pending = self.pending()
+            if not pending:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            wait_s = self.breaker.time_until_retry()
+            if wait_s > 0:
+                self._stop.wait(wait_s)
+                continue
+            record = pending[0]
+            if self._deliver(record):
+                self.breaker.record_success()
+                failures = 0
+                self._ack(record["id"])
+            else:
+                self.breaker.record_failure()
+                failures += 1
+                self._stop.wait(min(self.base_backoff_s * 2 ** (failures - 1), self.max_backoff_s))
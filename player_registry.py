@@ -0,0 +1,187 @@
+"""Route messages from many senders to their own XPSystem"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parseaddr
+from urllib.parse import quote
+
+from journal import JOURNAL_SUFFIX
+from xp_system import XPSystem
+
+
+PLAYERS_DIR = "players"
+# Rough bytes a loaded player holds beyond its actions and history, and per action, raw history event and rollup
+BASE_BYTES = 4096
+ACTION_BYTES = 64
+EVENT_BYTES = 24
+ROLLUP_BYTES = 48
+
+
+def player_key(sender: str) -> str:
+    """Normalise a From header to the bare lower-case address"""
+    return parseaddr(sender)[1].lower() or sender.strip().lower()
+
+
+def estimate_bytes(xp_system: XPSystem) -> int:
+    """Estimated size of a loaded player, from counts that grow with its state rather than by encoding it"""
+    history = xp_system.history
+    return (
+        BASE_BYTES + ACTION_BYTES * len(xp_system.actions) + EVENT_BYTES * len(history)
+        + ROLLUP_BYTES * history.rollup_count()
+    )
+
+
+class PlayerNotifier:
+    """Label a shared notifier's messages with the player they belong to and address them to that player"""
+
+    def __init__(self, notifier, player: str):
+        self.notifier = notifier
+        self.player = player
+
+    def send_message(self, body: str, subject: str = "", recipient: str = None):
+        return self.notifier.send_message(f"[{self.player}]\n{body}", subject, recipient or self.player)
+
+
+class PlayerRegistry:
+    """
+    Lazily loaded XPSystem per sender, kept in an LRU cache with a memory cap.
+
+    Each player's state lives in its own file under state_dir. Messages for
+    different players are processed in parallel on a worker pool, while each
+    player's messages are processed in order under that player's lock.
+    """
+
+    def __init__(
+        self,
+        state_dir: str = PLAYERS_DIR,
+        notifier=None,
+        max_players: int = 64,
+        max_bytes: int = 64 * 1024 * 1024,
+        workers: int = 4,
+    ):
+        """
+        Args:
+            state_dir (str): Directory holding one state file per player.
+            notifier: Shared notifier; each player's messages are labelled with their address.
+            max_players (int): Most players kept loaded at once.
+            max_bytes (int): Cap on the estimated size of loaded player state.
+            workers (int): Threads processing different players in parallel.
+        """
+        self.state_dir = state_dir
+        self.notifier = notifier
+        self.max_players = max_players
+        self.max_bytes = max_bytes
+        os.makedirs(state_dir, exist_ok=True)
+        self._players = OrderedDict()  # key -> (XPSystem, estimated bytes), least recent first
+        self._loaded_bytes = 0
+        self._lock = threading.Lock()
+        self._player_locks = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="player")
+
+    def filename_for(self, key: str) -> str:
+        """State file of a player, percent-escaping the key so different keys never share a file"""
+        return os.path.join(self.state_dir, quote(key, safe="@") + ".pkl")
+
+    def _legacy_filename_for(self, key: str) -> str:
+        """State file name used before keys were escaped, which folded every other character to _"""
+        return os.path.join(self.state_dir, re.sub(r"[^a-z0-9@._-]", "_", key) + ".pkl")
+
+    def _adopt_legacy_files(self, key: str, filename: str):
+        """Move a save written under the legacy name to the escaped one, the first time the player loads"""
+        legacy = self._legacy_filename_for(key)
+        if legacy == filename or os.path.exists(filename) or os.path.exists(filename + JOURNAL_SUFFIX):
+            return
+        for suffix in ("", JOURNAL_SUFFIX):
+            if os.path.exists(legacy + suffix):
+                os.replace(legacy + suffix, filename + suffix)
+
+    def _player_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._player_locks.setdefault(key, threading.Lock())
+
+    def get(self, sender: str) -> XPSystem:
+        """Return the sender's XPSystem, loading it if needed. Call with the player's lock held."""
+        key = player_key(sender)
+        with self._lock:
+            if key in self._players:
+                self._players.move_to_end(key)
+                return self._players[key][0]
+        filename = self.filename_for(key)
+        self._adopt_legacy_files(key, filename)
+        xp_system = XPSystem.recover(filename)
+        if self.notifier is not None:
+            xp_system.set_notifier(PlayerNotifier(self.notifier, key))
+        size = estimate_bytes(xp_system)
+        with self._lock:
+            self._players[key] = (xp_system, size)
+            self._loaded_bytes += size
+        self._evict(keep=key)
+        return xp_system
+
+    def _evict(self, keep: str):
+        """Unload least recently used players that are not busy until under both caps"""
+        for key in list(self._players):
+            with self._lock:
+                over = len(self._players) > self.max_players or self._loaded_bytes > self.max_bytes
+                if not over:
+                    return
+                if key == keep or key not in self._players:
+                    continue
+            player_lock = self._player_lock(key)
+            if not player_lock.acquire(blocking=False):
+                # Being processed right now, try the next one
+                continue
+            try:
+                with self._lock:
+                    xp_system, size = self._players.pop(key)
+                    self._loaded_bytes -= size
+                self._unload(xp_system)
+            finally:
+                player_lock.release()
+
+    @staticmethod
+    def _unload(xp_system: XPSystem):
+        xp_system.snapshot()
+        xp_system.close()
+
+    def loaded(self) -> list:
+        """Keys of loaded players, least recently used first"""
+        with self._lock:
+            return list(self._players)
+
+    def _process_player(self, sender: str, messages: list) -> dict:
+        key = player_key(sender)
+        with self._player_lock(key):
+            xp_system = self.get(sender)
+            summary = xp_system.process_messages(messages)
+            # Actions and history grow while a player stays loaded
+            size = estimate_bytes(xp_system)
+            with self._lock:
+                self._loaded_bytes += size - self._players[key][1]
+                self._players[key] = (xp_system, size)
+            self._evict(keep=key)
+            return summary
+
+    def process(self, messages: list) -> dict:
+        """
+        Process (sender, message) pairs, in parallel across senders and in order per sender.
+
+        Returns:
+            dict: process_messages summary per player key.
+        """
+        by_player = OrderedDict()
+        for sender, message in messages:
+            by_player.setdefault(player_key(sender), []).append(message)
+        futures = {key: self._executor.submit(self._process_player, key, batch) for key, batch in by_player.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+    def close(self):
+        """Stop the workers and unload every player"""
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            players, self._players = self._players, OrderedDict()
+            self._loaded_bytes = 0
+        for xp_system, _ in players.values():
+            self._unload(xp_system)
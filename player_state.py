@@ -0,0 +1,247 @@
+"""Compact, versioned on-disk format for XPSystem progress"""
+import json
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+
+from xp_history import XPHistory
+
+
+STATE_MAGIC = b"SLXP"
+STATE_VERSION = 5
+HEADER = struct.Struct(">4sH")
+# Attributes with a dedicated place in the schema; anything else is kept in "extra"
+SCHEMA_ATTRIBUTES = (
+    "total_xp", "level", "title", "unlocked_titles", "skills_xp", "skill_tree", "actions", "action_counts",
+    "journal_seq", "filename", "history",
+)
+
+
+def _add_history(body: dict) -> dict:
+    """Version 2 adds the XP event history, empty for older saves"""
+    return {**body, "history": [[], [], [], []]}
+
+
+def _replace_level_titles(body: dict) -> dict:
+    """Version 3 drops level titles, now achievement rules, and counts performed actions from zero"""
+    body = {key: value for key, value in body.items() if key != "level_titles"}
+    return {**body, "action_counts": {}}
+
+
+def _save_rollups(body: dict) -> dict:
+    """Version 4 saves the history rollups, so loading no longer replays every event, and compacts the events"""
+    keys, times, key_ids, amounts = body["history"]
+    history = XPHistory.from_columns(keys, array("d", times), array("q", key_ids), array("q", amounts))
+    history.compact()
+    return {**body, "history": _history_body(history)}
+
+
+def _index_subskills(body: dict) -> dict:
+    """Version 5 saves each action's (skill, subskill) pair as an index into a table of pairs, as XPHistory does"""
+    names, skills, subskills, xp = body["actions"]
+    pairs, pair_ids, pair_index = [], [], {}
+    for skill, subskill in zip(skills, subskills):
+        name, _, subskill_names, _ = body["skills"][skill]
+        pair = (name, subskill_names[subskill])
+        if pair not in pair_index:
+            pair_index[pair] = len(pairs)
+            pairs.append(list(pair))
+        pair_ids.append(pair_index[pair])
+    return {**body, "actions": [names, pairs, pair_ids, xp]}
+
+
+# version -> function upgrading a decoded body from that version to the next
+MIGRATIONS = {1: _add_history, 2: _replace_level_titles, 3: _save_rollups, 4: _index_subskills}
+
+
+def _history_body(history: XPHistory) -> list:
+    return [history.keys, list(history.times), list(history.key_ids), list(history.amounts), history.rollup_rows()]
+
+
+class SkillRecord:
+    """
+    A skill with its subskill names and their XP counters, indexed alike.
+
+    xp is None for a skill missing from skills_xp and subskills is None for one
+    missing from skill_tree.
+    """
+    __slots__ = ("name", "xp", "subskills", "subskill_xp")
+
+    def __init__(self, name: str, xp: int, subskills: list, subskill_xp: array):
+        self.name = name
+        self.xp = xp
+        self.subskills = subskills
+        self.subskill_xp = subskill_xp
+
+
+class ActionTable(Mapping):
+    """
+    XPSystem.actions: registered actions as parallel columns.
+
+    Row i is action names[i], worth xp[i], for the (skill, subskill) pair
+    subskills[subskill_ids[i]], the way XPHistory keys its events. A row holds
+    a name and two array slots instead of its own metadata dict. Looking an action up
+    returns a new {"skill", "subskill", "xp"} dict; rows are only added, by add().
+    """
+    __slots__ = ("names", "subskills", "subskill_ids", "xp", "_rows", "_subskill_index")
+
+    def __init__(self, names: list = None, subskills: list = None, subskill_ids: array = None, xp: array = None):
+        self.names = [] if names is None else names
+        self.subskills = [] if subskills is None else subskills
+        self.subskill_ids = array("q") if subskill_ids is None else subskill_ids
+        self.xp = array("q") if xp is None else xp
+        self._rows = dict(zip(self.names, range(len(self.names))))
+        self._subskill_index = {pair: i for i, pair in enumerate(self.subskills)}
+
+    @classmethod
+    def from_dict(cls, actions: dict) -> "ActionTable":
+        """Table of an action name -> metadata dict, as older saves kept them"""
+        table = cls()
+        for name, metadata in actions.items():
+            table.add(name, metadata["skill"], metadata["subskill"], metadata["xp"])
+        return table
+
+    def add(self, name: str, skill: str, subskill: str, xp: int):
+        """Append an action that is not in the table yet"""
+        subskill_id = self._subskill_index.get((skill, subskill))
+        if subskill_id is None:
+            subskill_id = self._subskill_index[skill, subskill] = len(self.subskills)
+            self.subskills.append((sys.intern(skill), sys.intern(subskill)))
+        self._rows[name] = len(self.names)
+        self.names.append(name)
+        self.subskill_ids.append(subskill_id)
+        self.xp.append(xp)
+
+    def __getitem__(self, name: str) -> dict:
+        row = self._rows[name]
+        skill, subskill = self.subskills[self.subskill_ids[row]]
+        return {"skill": skill, "subskill": subskill, "xp": self.xp[row]}
+
+    def __contains__(self, name) -> bool:
+        return name in self._rows
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+class PlayerState:
+    """
+    Schema of a saved XPSystem.
+
+    Skill and subskill names are stored once and XP counters are integer arrays
+    in the same order. The action table is XPSystem's own and is saved as its
+    columns.
+    """
+    __slots__ = (
+        "skills", "actions", "action_counts", "total_xp", "level", "title", "unlocked_titles", "journal_seq", "history",
+        "extra",
+    )
+
+    @classmethod
+    def from_xp_system(cls, xp_system) -> "PlayerState":
+        state = cls()
+        attributes = xp_system.__getstate__()
+        state.skills = []
+        # Skills only present in one of the two dicts still round trip
+        for name in list(xp_system.skill_tree) + [name for name in xp_system.skills_xp if name not in xp_system.skill_tree]:
+            subskills = xp_system.skill_tree.get(name)
+            state.skills.append(SkillRecord(
+                name,
+                xp_system.skills_xp.get(name),
+                None if subskills is None else list(subskills),
+                array("q", (subskills or {}).values()),
+            ))
+        state.actions = xp_system.actions
+        state.total_xp = xp_system.total_xp
+        state.level = xp_system.level
+        state.title = xp_system.title
+        state.unlocked_titles = list(xp_system.unlocked_titles)
+        state.action_counts = dict(xp_system.action_counts)
+        state.journal_seq = getattr(xp_system, "journal_seq", 0)
+        state.history = xp_system.history
+        state.extra = {key: value for key, value in attributes.items() if key not in SCHEMA_ATTRIBUTES}
+        return state
+
+    def apply_to(self, xp_system):
+        """Set the XPSystem attributes described by this state"""
+        xp_system.__dict__.update(self.extra)
+        xp_system.skill_tree = {
+            skill.name: dict(zip(skill.subskills, skill.subskill_xp)) for skill in self.skills if skill.subskills is not None
+        }
+        xp_system.skills_xp = {skill.name: skill.xp for skill in self.skills if skill.xp is not None}
+        xp_system.actions = self.actions
+        xp_system.total_xp = self.total_xp
+        xp_system.level = self.level
+        xp_system.title = self.title
+        xp_system.unlocked_titles = list(self.unlocked_titles)
+        xp_system.action_counts = dict(self.action_counts)
+        xp_system.journal_seq = self.journal_seq
+        xp_system.history = self.history
+
+    def to_body(self) -> dict:
+        actions = self.actions
+        return {
+            "skills": [[skill.name, skill.xp, skill.subskills, list(skill.subskill_xp)] for skill in self.skills],
+            "actions": [actions.names, actions.subskills, list(actions.subskill_ids), list(actions.xp)],
+            "total_xp": self.total_xp,
+            "level": self.level,
+            "title": self.title,
+            "unlocked_titles": self.unlocked_titles,
+            "action_counts": self.action_counts,
+            "journal_seq": self.journal_seq,
+            "history": _history_body(self.history),
+            "extra": self.extra,
+        }
+
+    @classmethod
+    def from_body(cls, body: dict) -> "PlayerState":
+        state = cls()
+        intern = sys.intern
+        state.skills = []
+        # Skill names repeat in the action table and history once loaded, so share one string per name
+        for name, xp, subskills, subskill_xp in body["skills"]:
+            if subskills is not None:
+                subskills = [intern(subskill) for subskill in subskills]
+            state.skills.append(SkillRecord(intern(name), xp, subskills, array("q", subskill_xp)))
+        names, subskills, subskill_ids, xp = body["actions"]
+        subskills = [(intern(skill), intern(subskill)) for skill, subskill in subskills]
+        state.actions = ActionTable(names, subskills, array("q", subskill_ids), array("q", xp))
+        state.total_xp = body["total_xp"]
+        state.level = body["level"]
+        state.title = body["title"]
+        state.unlocked_titles = body["unlocked_titles"]
+        state.action_counts = body["action_counts"]
+        state.journal_seq = body["journal_seq"]
+        keys, times, key_ids, amounts, rollups = body["history"]
+        state.history = XPHistory.from_columns(keys, array("d", times), array("q", key_ids), array("q", amounts), rollups)
+        state.extra = body["extra"]
+        return state
+
+
+def is_state(data: bytes) -> bool:
+    """True if data starts with the state format header rather than a legacy pickle"""
+    return data[:len(STATE_MAGIC)] == STATE_MAGIC
+
+
+def encode_state(xp_system) -> bytes:
+    """Serialize an XPSystem to the current state format"""
+    body = json.dumps(PlayerState.from_xp_system(xp_system).to_body(), separators=(",", ":"), ensure_ascii=False)
+    return HEADER.pack(STATE_MAGIC, STATE_VERSION) + body.encode("utf-8")
+
+
+def decode_state(data: bytes) -> PlayerState:
+    """Parse state format bytes, upgrading older versions through MIGRATIONS"""
+    magic, version = HEADER.unpack_from(data)
+    if magic != STATE_MAGIC:
+        raise ValueError("Not an XP state file")
+    if version > STATE_VERSION:
+        raise ValueError(f"State file version {version} is newer than supported version {STATE_VERSION}")
+    body = json.loads(data[HEADER.size:])
+    while version < STATE_VERSION:
+        body = MIGRATIONS[version](body)
+        version += 1
+    return PlayerState.from_body(body)
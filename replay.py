@@ -0,0 +1,224 @@
+"""Rebuild XPSystem state from the logged emails in one pass, without notifications
+
+Run from the repository root with the controller stopped:
+    python -m replay --state rdas_player.pkl
+"""
+import argparse
+import csv
+import os
+import re
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from itertools import islice
+
+import email_client
+from journal import JOURNAL_SUFFIX
+from message_log import message_time
+from player_registry import player_key
+from xp_history import day_of
+from xp_system import XPSystem, level_for_xp
+
+
+# Rows read from the log at a time
+CHUNK_ROWS = 100_000
+# Longest message process_message accepts
+MAX_MESSAGE_LENGTH = 100
+# The Date form email clients write, e.g. "Mon, 4 Dec 2023 10:00:00 +0000"
+DATE_PATTERN = re.compile(r"(?:[A-Za-z]{3}, )?(\d{1,2} [A-Za-z]{3} \d{4}) (\d\d):(\d\d)(?::(\d\d))? ([+-]\d\d)(\d\d)$")
+
+
+class Replay:
+    """
+    Fold logged messages into an XPSystem the way process_message would, in bulk.
+
+    Plain messages between two commands are counted per (day, distinct
+    message) and their XP added per (day, skill, subskill) in one step, to the
+    totals and to the XP history's rollups; no raw history events are kept.
+    Commands are applied in order: !add registers actions for the messages
+    after it, and !title is checked against the titles unlocked by that row.
+    Achievements are settled at every !title and at the end, so titles from
+    different rules met between two commands unlock in rule order rather than
+    message order. No notifications are sent.
+    """
+
+    def __init__(self, xp_system: XPSystem):
+        self.xp_system = xp_system
+        self.rows = 0
+        self.actions = 0
+        self._run = []
+
+    def feed(self, messages):
+        """Apply (message time, message) pairs in order"""
+        for t, msg in messages:
+            self.rows += 1
+            # Every command starts with "!", so most rows skip the split
+            command = msg.partition(" ")[0] if msg[:1] == "!" else None
+            if command in XPSystem.COMMANDS:
+                self._flush_run()
+                if len(msg) <= MAX_MESSAGE_LENGTH:
+                    self._command(command, msg[len(command) + 1:])
+            else:
+                self._run.append((day_of(t), msg))
+
+    def _flush_run(self):
+        """Add the XP of the plain messages collected since the last command"""
+        if not self._run:
+            return
+        xp_system = self.xp_system
+        gained = {}
+        action_counts = xp_system.action_counts
+        for (day, msg), count in Counter(self._run).items():
+            action = xp_system.actions.get(msg)
+            if action is None or len(msg) > MAX_MESSAGE_LENGTH:
+                continue
+            key = (day, action["skill"], action["subskill"])
+            gained[key] = gained.get(key, 0) + action["xp"] * count
+            action_counts[msg] = action_counts.get(msg, 0) + count
+            self.actions += count
+        for (day, skill, subskill), xp in gained.items():
+            xp_system.skill_tree[skill][subskill] += xp
+            xp_system.skills_xp[skill] += xp
+            xp_system.total_xp += xp
+            xp_system.history.record_day(skill, subskill, xp, day)
+        self._run = []
+
+    def _command(self, command: str, args: str):
+        xp_system = self.xp_system
+        if command == "!add":
+            try:
+                xp_system._cmd_add(args)
+            except ValueError as e:
+                print(f"Skipping message {command} {args!r}, got error {str(e)}")
+        elif command == "!title" and args:
+            self._settle()
+            if args in xp_system.unlocked_titles:
+                xp_system.title = args
+        # Every other command only replies, which a replay never does
+
+    def _settle(self):
+        """Bring the level and unlocked titles up to the rows applied so far"""
+        xp_system = self.xp_system
+        xp_system.level = level_for_xp(xp_system.total_xp)
+        with xp_system._silenced():
+            xp_system.check_achievements()
+
+    def finish(self) -> XPSystem:
+        """Settle the level and titles reached and return the rebuilt XPSystem"""
+        self._flush_run()
+        self._settle()
+        return self.xp_system
+
+
+def _date_time(date: str, midnights: dict, default: float) -> float:
+    """
+    message_time for a CSV Date, parsing each calendar date once.
+
+    midnights maps the date part of the headers seen so far to its UTC
+    midnight. Other Date forms go through message_time.
+    """
+    match = DATE_PATTERN.match(date)
+    if match is None:
+        return message_time(date, default)
+    day, hours, minutes, seconds, tz_hours, tz_minutes = match.groups()
+    hours, minutes, seconds = int(hours), int(minutes), int(seconds or 0)
+    # "-0000" is an unknown zone, which parsedate_to_datetime reads as local time
+    if hours > 23 or minutes > 59 or seconds > 59 or tz_hours + tz_minutes == "-0000":
+        return message_time(date, default)
+    midnight = midnights.get(day)
+    if midnight is None:
+        try:
+            midnight = midnights[day] = parsedate_to_datetime(day + " 00:00:00 +0000").timestamp()
+        except (TypeError, ValueError, IndexError):
+            return message_time(date, default)
+    offset = int(tz_hours) * 3600 + int(tz_hours[0] + tz_minutes) * 60
+    return midnight + hours * 3600 + minutes * 60 + seconds - offset
+
+
+def read_messages(csv_path: str, sender: str = None, chunk_rows: int = CHUNK_ROWS):
+    """
+    Yield lists of (message time, message) pairs from a CSV export, chunk_rows rows at a time,
+    optionally from one sender. A Date that does not parse takes the previous row's time.
+    """
+    t = 0.0
+    midnights = {}
+    with open(csv_path, "r", newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        while True:
+            messages = []
+            rows = 0
+            # Rows are dropped as they are read rather than held for the whole chunk
+            for row in islice(reader, chunk_rows):
+                rows += 1
+                if len(row) > 3 and (sender is None or player_key(row[1]) == sender):
+                    t = _date_time(row[0], midnights, t)
+                    messages.append((t, row[3]))
+            if not rows:
+                return
+            yield messages
+
+
+def read_log_messages(log, sender: str = None, chunk_rows: int = CHUNK_ROWS):
+    """
+    Yield lists of (message time, message) pairs from a MessageLog, chunk_rows records at a time,
+    optionally from one sender.
+    """
+    records = iter(log)
+    while True:
+        chunk = list(islice(records, chunk_rows))
+        if not chunk:
+            return
+        if sender is None:
+            yield [(record["t"], record["message"]) for record in chunk]
+        else:
+            yield [(record["t"], record["message"]) for record in chunk if player_key(record["sender"]) == sender]
+
+
+def replay(csv_path: str = None, filename: str = "rdas_player.pkl", sender: str = None,
+           chunk_rows: int = CHUNK_ROWS, save: bool = True) -> XPSystem:
+    """
+    Rebuild a player's state from the message log, replacing its save and journal.
+
+    The XP history's daily and weekly rollups are rebuilt from the message
+    times, so !stats and streaks cover the replayed messages.
+
+    Args:
+        csv_path (str): Replay this CSV export instead of the message log.
+        filename (str): State file to write.
+        sender (str): Only replay this sender's messages, as a player_key.
+        chunk_rows (int): Rows read from the log at a time.
+        save (bool): Write the state file and drop the old journal.
+    """
+    replayer = Replay(XPSystem(filename))
+    if csv_path is not None:
+        chunks = read_messages(csv_path, sender, chunk_rows)
+    else:
+        log = email_client.open_message_log()
+        chunks = read_log_messages(log, sender, chunk_rows)
+    for messages in chunks:
+        replayer.feed(messages)
+    xp_system = replayer.finish()
+    print(f"Replayed {replayer.rows} messages, {replayer.actions} actions, {xp_system.total_xp} XP")
+    if save:
+        xp_system.save_progress(filename)
+        # The journal describes the old state and must not be replayed on top
+        if os.path.exists(filename + JOURNAL_SUFFIX):
+            os.remove(filename + JOURNAL_SUFFIX)
+    return xp_system
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--csv", help="replay a CSV export instead of the message log")
+    parser.add_argument("--state", default="rdas_player.pkl")
+    parser.add_argument("--sender", help="only replay this sender, e.g. for a multi-player state file")
+    parser.add_argument("--dry-run", action="store_true", help="print the result without saving it")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    xp_system = replay(args.csv, args.state, args.sender and player_key(args.sender), save=not args.dry_run)
+    print(xp_system)
+    print(f"Done in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
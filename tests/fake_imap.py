@@ -0,0 +1,256 @@
+"""Minimal in-process IMAP server for exercising EmailClient over a real socket"""
+import email
+import re
+import select
+import socketserver
+import threading
+
+
+SEARCH_UID_PATTERN = re.compile(r"UID (\d+):\*")
+SEARCH_FROM_PATTERN = re.compile(r'FROM "([^"]*)"')
+HEADER_FIELDS_PATTERN = re.compile(r"BODY\.PEEK\[HEADER\.FIELDS \(([^)]*)\)\]", re.IGNORECASE)
+SECTION_PATTERN = re.compile(r"BODY\.PEEK\[([\d.]+|TEXT)\](?:<(\d+)\.(\d+)>)?", re.IGNORECASE)
+
+
+class FakeIMAPServer:
+    """
+    Serve a single inbox over plain-text IMAP on localhost.
+
+    Only the commands EmailClient uses are implemented: CAPABILITY, LOGIN, SELECT,
+    STATUS, NOOP, LOGOUT, UID SEARCH, UID FETCH and (optionally) IDLE.
+    """
+
+    def __init__(self, idle: bool = True, uidvalidity: int = 1):
+        self.idle_supported = idle
+        self.uidvalidity = uidvalidity
+        self.messages = []  # list of (uid, raw bytes)
+        self.commands = []
+        self.logins = 0
+        self.bytes_sent = 0
+        self._next_uid = 1
+        self._resets = 0
+        self._changed = threading.Condition()
+        self._server = None
+        self._thread = None
+
+    def add_message(self, raw: bytes) -> int:
+        """Deliver a raw RFC822 message and wake any IDLE sessions."""
+        with self._changed:
+            uid = self._next_uid
+            self._next_uid += 1
+            self.messages.append((uid, raw))
+            self._changed.notify_all()
+        return uid
+
+    def reset_mailbox(self, uidvalidity: int):
+        """Empty the inbox under a new UIDVALIDITY, restarting UIDs and ending open sessions."""
+        with self._changed:
+            self.uidvalidity = uidvalidity
+            self.messages = []
+            self._next_uid = 1
+            self._resets += 1
+            self._changed.notify_all()
+
+    def start(self):
+        """Start serving on an ephemeral port, returning (host, port)."""
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                fake._serve(self)
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self._server.server_address
+
+    def stop(self):
+        """Stop serving."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _capabilities(self) -> str:
+        return "IMAP4rev1 AUTH=PLAIN" + (" IDLE" if self.idle_supported else "")
+
+    def _serve(self, handler):
+        write = handler.wfile.write
+        write(f"* OK [CAPABILITY {self._capabilities()}] Fake IMAP ready\r\n".encode())
+        # Messages this session has been told about, like a real server tracks
+        known = 0
+        resets = self._resets
+        while True:
+            line = handler.rfile.readline()
+            if not line:
+                return
+            if self._resets != resets:
+                write(b"* BYE mailbox was reset\r\n")
+                return
+            tag, command, args = self._parse_command(line)
+            self.commands.append(command)
+
+            if command == "LOGOUT":
+                write(b"* BYE logging out\r\n")
+                write(f"{tag} OK LOGOUT completed\r\n".encode())
+                return
+            if command == "SELECT":
+                known = len(self.messages)
+                write(f"* {known} EXISTS\r\n".encode())
+                write(f"* OK [UIDVALIDITY {self.uidvalidity}] UIDs valid\r\n".encode())
+            elif command == "IDLE" and self.idle_supported:
+                known = self._idle(handler, tag, known)
+                if known is None:
+                    return
+                continue
+            elif not self._respond(write, command, args):
+                write(f"{tag} BAD unsupported command\r\n".encode())
+                continue
+            known = self._announce(write, known)
+            write(f"{tag} OK {command} completed\r\n".encode())
+
+    @staticmethod
+    def _parse_command(line: bytes) -> tuple:
+        """Split a command line into (tag, command, arguments), folding UID subcommands into the command"""
+        tag, _, rest = line.decode().rstrip("\r\n").partition(" ")
+        command, _, args = rest.partition(" ")
+        command = command.upper()
+        if command == "UID":
+            sub, _, args = args.partition(" ")
+            command = f"UID {sub.upper()}"
+        return tag, command, args
+
+    def _respond(self, write, command: str, args: str) -> bool:
+        """Write the untagged responses of a command that keeps no session state, False if it is unsupported"""
+        if command == "CAPABILITY":
+            write(f"* CAPABILITY {self._capabilities()}\r\n".encode())
+        elif command == "LOGIN":
+            self.logins += 1
+        elif command == "STATUS":
+            write(f"* STATUS inbox (UIDVALIDITY {self.uidvalidity})\r\n".encode())
+        elif command == "UID SEARCH":
+            uids = " ".join(str(uid) for uid in self._search(args))
+            write(f"* SEARCH {uids}\r\n".encode())
+        elif command == "UID FETCH":
+            self._fetch(write, args)
+        elif command != "NOOP":
+            return False
+        return True
+
+    def _announce(self, write, known: int) -> int:
+        """Announce new mail along with a command's completion, returning the messages now known"""
+        if known and len(self.messages) > known:
+            known = len(self.messages)
+            write(f"* {known} EXISTS\r\n".encode())
+        return known
+
+    def _search(self, criteria: str) -> list:
+        with self._changed:
+            messages = list(self.messages)
+        senders = [sender.encode() for sender in SEARCH_FROM_PATTERN.findall(criteria)]
+        if senders:
+            messages = [
+                (uid, raw) for uid, raw in messages
+                if any(sender in raw.split(b"\r\n\r\n", 1)[0] for sender in senders)
+            ]
+        start = SEARCH_UID_PATTERN.search(criteria)
+        if start and messages:
+            matched = [uid for uid, _ in messages if uid >= int(start.group(1))]
+            # n:* always includes the highest UID in the mailbox
+            return matched or [messages[-1][0]]
+        return [uid for uid, _ in messages]
+
+    def _fetch(self, write, args: str):
+        uid_set, _, items = args.partition(" ")
+        ranges = self._parse_uid_set(uid_set)
+        with self._changed:
+            messages = list(self.messages)
+        for seq, (uid, raw) in enumerate(messages, start=1):
+            if not any(lo <= uid <= hi for lo, hi in ranges):
+                continue
+            parts = [f"UID {uid}".encode()]
+            for name, payload in self.fetch_items(raw, items):
+                if isinstance(payload, bytes):
+                    parts.append(f"{name} {{{len(payload)}}}\r\n".encode() + payload)
+                else:
+                    parts.append(f"{name} {payload}".encode())
+            response = f"* {seq} FETCH (".encode() + b" ".join(parts) + b")\r\n"
+            self.bytes_sent += len(response)
+            write(response)
+
+    def fetch_items(self, raw: bytes, items: str) -> list:
+        """Return (name, payload) pairs for the requested FETCH data items."""
+        results = []
+        if "RFC822" in items.upper():
+            results.append(("RFC822", raw))
+        fields = HEADER_FIELDS_PATTERN.search(items)
+        if fields:
+            wanted = fields.group(1).upper().split()
+            header_lines = raw.split(b"\r\n\r\n", 1)[0].split(b"\r\n")
+            kept = [line for line in header_lines if line.split(b":", 1)[0].decode().upper() in wanted]
+            results.append((f"BODY[HEADER.FIELDS ({fields.group(1)})]", b"\r\n".join(kept) + b"\r\n\r\n"))
+        msg = email.message_from_bytes(raw)
+        if "BODYSTRUCTURE" in items.upper():
+            results.append(("BODYSTRUCTURE", self._bodystructure(msg)))
+        for section, origin, length in SECTION_PATTERN.findall(items):
+            if section.upper() == "TEXT":
+                data = raw.split(b"\r\n\r\n", 1)[1]
+            else:
+                part = msg
+                for index in section.split("."):
+                    part = part.get_payload()[int(index) - 1]
+                data = part.get_payload().encode()
+            if length:
+                data = data[int(origin):int(origin) + int(length)]
+                results.append((f"BODY[{section}]<{origin}>", data))
+            else:
+                results.append((f"BODY[{section}]", data))
+        return results
+
+    @classmethod
+    def _bodystructure(cls, part) -> str:
+        if part.is_multipart():
+            children = "".join(cls._bodystructure(child) for child in part.get_payload())
+            return f'({children} "{part.get_content_subtype()}")'
+        params = " ".join(f'"{key}" "{value}"' for key, value in (part.get_params() or [])[1:]) or "NIL"
+        params = f"({params})" if params != "NIL" else params
+        encoding = part.get("Content-Transfer-Encoding", "7bit").lower()
+        payload = part.get_payload()
+        lines = f" {payload.count(chr(10))}" if part.get_content_maintype() == "text" else ""
+        disposition = "NIL"
+        if part.get_content_disposition():
+            filename = part.get_filename()
+            disposition_params = f'("filename" "{filename}")' if filename else "NIL"
+            disposition = f'("{part.get_content_disposition()}" {disposition_params})'
+        return (
+            f'("{part.get_content_maintype()}" "{part.get_content_subtype()}" {params} NIL NIL '
+            f'"{encoding}" {len(payload)}{lines} NIL {disposition} NIL)'
+        )
+
+    @staticmethod
+    def _parse_uid_set(uid_set: str) -> list:
+        ranges = []
+        for part in uid_set.split(","):
+            lo, _, hi = part.partition(":")
+            hi = hi or lo
+            ranges.append((int(lo), float("inf") if hi == "*" else int(hi)))
+        return ranges
+
+    def _idle(self, handler, tag: str, seen: int):
+        """Announce new mail until DONE, returning the count the session knows, or None on disconnect"""
+        handler.wfile.write(b"+ idling\r\n")
+        while True:
+            with self._changed:
+                self._changed.wait(0.05)
+                count = len(self.messages)
+            if count > seen:
+                handler.wfile.write(f"* {count} EXISTS\r\n".encode())
+                seen = count
+            ready, _, _ = select.select([handler.connection], [], [], 0)
+            if ready:
+                line = handler.rfile.readline()
+                if not line:
+                    return None
+                if line.strip().upper() == b"DONE":
+                    handler.wfile.write(f"{tag} OK IDLE terminated\r\n".encode())
+                    return seen
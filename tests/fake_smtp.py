@@ -0,0 +1,86 @@
+"""Minimal in-process SMTP server standing in for aiosmtpd in tests and benchmarks"""
+import socketserver
+import threading
+import time
+
+
+# Commands answered with a fixed reply
+REPLIES = {
+    "EHLO": b"250-fake\r\n250 AUTH PLAIN\r\n",
+    "HELO": b"250 fake\r\n",
+    "MAIL": b"250 OK\r\n",
+    "RCPT": b"250 OK\r\n",
+    "RSET": b"250 OK\r\n",
+    "NOOP": b"250 OK\r\n",
+}
+
+
+class FakeSMTPServer:
+    """
+    Accept mail over plain-text SMTP on localhost and keep it in memory.
+
+    connect_delay_s is slept before the greeting and login_delay_s before AUTH
+    succeeds, to stand in for the TCP/TLS handshake and login round trips of a
+    real provider.
+    """
+
+    def __init__(self, connect_delay_s: float = 0, login_delay_s: float = 0):
+        self.connect_delay_s = connect_delay_s
+        self.login_delay_s = login_delay_s
+        self.messages = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        """Start serving on an ephemeral port, returning (host, port)."""
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                fake._serve(self)
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address
+
+    def stop(self):
+        """Stop serving."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _serve(self, handler):
+        with self._lock:
+            self.connections += 1
+        write = handler.wfile.write
+        time.sleep(self.connect_delay_s)
+        write(b"220 fake ESMTP ready\r\n")
+        while True:
+            line = handler.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().split(" ", 1)[0].upper()
+            if command == "AUTH":
+                time.sleep(self.login_delay_s)
+                write(b"235 2.7.0 Authentication successful\r\n")
+            elif command == "DATA":
+                write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                self._receive_data(handler)
+                write(b"250 OK queued\r\n")
+            elif command == "QUIT":
+                write(b"221 Bye\r\n")
+                return
+            else:
+                write(REPLIES.get(command, b"502 Command not implemented\r\n"))
+
+    def _receive_data(self, handler):
+        lines = []
+        while True:
+            data_line = handler.rfile.readline()
+            if not data_line or data_line in (b".\r\n", b".\n"):
+                break
+            lines.append(data_line)
+        with self._lock:
+            self.messages.append(b"".join(lines))
@@ -0,0 +1,67 @@
+"""Minimal in-process Discord webhook standing in for discord.com in tests and benchmarks"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeWebhookServer:
+    """
+    Accept webhook posts over HTTP on localhost and keep their content in memory.
+
+    delay_s is slept before each response to stand in for the round trip to
+    Discord. With rate_limit_every set, every nth post is answered with a 429
+    and a Retry-After of retry_after_s, like Discord's rate limiter.
+    """
+
+    def __init__(self, delay_s: float = 0, rate_limit_every: int = 0, retry_after_s: float = 0.01):
+        self.delay_s = delay_s
+        self.rate_limit_every = rate_limit_every
+        self.retry_after_s = retry_after_s
+        self.posts = []
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self) -> str:
+        """Start serving on an ephemeral port, returning the webhook URL."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so a reused requests.Session keeps its connection
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                fake._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/api/webhooks/bench"
+
+    def stop(self):
+        """Stop serving."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _handle(self, handler):
+        body = handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+        if self.delay_s:
+            time.sleep(self.delay_s)
+        with self._lock:
+            self.requests += 1
+            limited = self.rate_limit_every and self.requests % self.rate_limit_every == 0
+            if not limited:
+                self.posts.append(json.loads(body)["content"])
+        if limited:
+            handler.send_response(429)
+            handler.send_header("Retry-After", str(self.retry_after_s))
+        else:
+            handler.send_response(204)
+        handler.send_header("Content-Length", "0")
+        handler.end_headers()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+
+from achievements import AchievementRules, Rule, load_rules
+from notifiers import MemoryNotifier
+from xp_history import DAY_S
+from xp_system import XPSystem
+
+
+RULES = AchievementRules.from_config({"rules": [
+    {"title": "Beginner", "when": {"event": "level", "at_least": 1}},
+    {"title": "Pianist", "when": {"event": "xp", "skill": "music", "subskill": "piano", "at_least": 30}},
+    {"title": "Musician", "when": {"event": "xp", "skill": "music", "at_least": 50}},
+    {"title": "Grinder", "when": {"event": "xp", "at_least": 100}},
+    {"title": "Regular", "when": {"event": "action", "action": "scales", "count": 3}},
+    {"title": "Streaker", "when": {"event": "streak", "skill": "music", "days": 3}},
+    {"title": "Habit", "when": {"event": "streak", "days": 2}},
+]})
+# Noon on three consecutive days
+DAYS = [1700000000 + 12 * 3600 + day * DAY_S for day in range(3)]
+
+
+class TestAchievements(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.filename = os.path.join(self.tmp.name, "player.pkl")
+        self.notifier = MemoryNotifier()
+
+    def make_player(self, rules: AchievementRules = RULES) -> XPSystem:
+        xp_system = XPSystem(self.filename, notifier=self.notifier)
+        xp_system.set_achievements(rules)
+        xp_system.add_action("music", "piano", 10, "scales")
+        return xp_system
+
+    def test_rule_config_errors(self):
+        """Test rules with an unknown event or no integer threshold are rejected."""
+        with self.assertRaises(ValueError):
+            Rule.from_config({"title": "X", "when": {"event": "weather", "at_least": 1}})
+        with self.assertRaises(ValueError):
+            Rule.from_config({"title": "X", "when": {"event": "action", "action": "gym", "at_least": 1}})
+
+    def test_default_rules_are_the_level_titles(self):
+        """Test the shipped config unlocks the classic level titles in order."""
+        levels = [(rule.threshold, rule.title) for rule in load_rules().groups[("level", ())]]
+        self.assertEqual(levels[:3], [(1, "Beginner"), (5, "Novice"), (10, "Demon Slayer")])
+
+    def test_tracker_only_looks_at_the_changed_counter(self):
+        """Test reached pops the met rules of one counter, lowest threshold first."""
+        tracker = RULES.tracker(["Beginner"])
+        self.assertNotIn(("level", ()), tracker.pending)
+        self.assertEqual(tracker.reached("xp", ("music", "piano"), 29), [])
+        self.assertEqual(tracker.reached("xp", ("music", "piano"), 30), ["Pianist"])
+        self.assertEqual(tracker.next_threshold("xp", ("music", "piano")), None)
+        self.assertEqual(tracker.next_threshold("xp", ("music", None)), 50)
+
+    def test_xp_action_and_streak_rules(self):
+        """Test subskill, skill, total XP, action count and streak rules unlock as events arrive."""
+        xp_system = self.make_player()
+        xp_system.update_xp(10, "music", "piano", at=DAYS[0], action="scales")
+        xp_system.update_xp(10, "music", "piano", at=DAYS[1], action="scales")
+        self.assertEqual(xp_system.unlocked_titles, ["Tester", "Beginner", "Habit"])
+        xp_system.update_xp(10, "music", "piano", at=DAYS[2], action="scales")
+        self.assertEqual(xp_system.unlocked_titles[3:], ["Pianist", "Regular", "Streaker"])
+        xp_system.update_xp(70, "physical", "strength", at=DAYS[2])
+        self.assertEqual(xp_system.unlocked_titles[6:], ["Grinder"])
+        self.assertEqual(xp_system.title, "Grinder")
+        self.assertIn("Unlocked new title: Streaker", [body for body, _ in self.notifier.messages])
+
+    def test_set_achievements_checks_progress_so_far(self):
+        """Test new rules are checked against counters reached before they were added."""
+        xp_system = self.make_player(AchievementRules([]))
+        for _ in range(5):
+            xp_system.performed_action("scales")
+        xp_system.set_achievements(RULES)
+        self.assertEqual(xp_system.unlocked_titles, ["Tester", "Beginner", "Pianist", "Musician", "Regular"])
+
+    def test_set_achievements_sees_past_streaks(self):
+        """Test a streak rule added later counts a streak that has since ended."""
+        xp_system = self.make_player(AchievementRules([]))
+        for day in DAYS:
+            xp_system.update_xp(10, "music", "piano", at=day)
+        xp_system.set_achievements(RULES)
+        self.assertIn("Streaker", xp_system.unlocked_titles)
+        self.assertIn("Habit", xp_system.unlocked_titles)
+
+    def test_action_counts_survive_recovery(self):
+        """Test action counts are journaled, so action rules see them after a crash."""
+        xp_system = XPSystem.recover(self.filename)
+        xp_system.set_notifier(self.notifier)
+        xp_system.add_action("music", "piano", 10, "scales")
+        for _ in range(2):
+            xp_system.performed_action("scales")
+        xp_system.close()
+
+        recovered = XPSystem.recover(self.filename)
+        self.addCleanup(recovered.close)
+        recovered.set_notifier(self.notifier)
+        self.assertEqual(recovered.action_counts, {"scales": 2})
+        recovered.set_achievements(RULES)
+        recovered.performed_action("scales")
+        self.assertIn("Regular", recovered.unlocked_titles)
+
+
+if __name__ == "__main__":
+    unittest.main()
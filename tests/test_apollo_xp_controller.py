@@ -0,0 +1,240 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from apollo_xp_controller import AdaptivePollScheduler, ApolloXPController
+from async_controller import AsyncApolloXPController
+from tests.fake_imap import FakeIMAPServer
+
+
+SENDER = "player@example.com"
+
+
+def make_raw_email(body: str, minute: int = 0) -> bytes:
+    return (
+        f"From: {SENDER}\r\nDate: Mon, 4 Dec 2023 10:{minute:02d}:00 +0000\r\n"
+        f"Subject: log\r\n\r\n{body}\r\n"
+    ).encode()
+
+
+class TestApolloXPController(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        patches = [
+            patch.multiple(
+                "email_client",
+                EMAIL_CSV=os.path.join(self.tmp.name, "emails.csv"),
+                EMAIL_INDEX=os.path.join(self.tmp.name, "emails.csv.idx"),
+                EMAIL_LOG=os.path.join(self.tmp.name, "email_log"),
+                IMAP_CHECKPOINT=os.path.join(self.tmp.name, "checkpoint.json"),
+            ),
+            patch.dict("os.environ", {"EMAIL_USERNAME": "user", "EMAIL_PASSWORD": "pass", "EXPECTED_SENDER": SENDER}),
+            patch("apollo_xp_controller.XPSystem"),
+            patch("apollo_xp_controller.OUTBOX_FILE", os.path.join(self.tmp.name, "outbox.jsonl")),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    def start_controller(self, server: FakeIMAPServer, push: bool = False, controller=None) -> ApolloXPController:
+        host, port = server.start()
+        self.addCleanup(server.stop)
+        pipeline = isinstance(controller, AsyncApolloXPController)
+        if controller is None:
+            controller = ApolloXPController(push=push, idle_timeout_s=5)
+        controller.scheduler = AdaptivePollScheduler(0.01, 0.05)
+        controller.email_client.imap_host = host
+        controller.email_client.imap_port = port
+        controller.email_client.imap_ssl = False
+        run = controller.run_pipeline if pipeline else controller.run
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.thread = thread
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(controller.stop)
+        return controller
+
+    def wait_for_messages(self, controller: ApolloXPController, count: int):
+        process_messages = controller.xp_system.process_messages
+        deadline = time.monotonic() + 5
+        while self.received(process_messages) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return [msg for call in process_messages.call_args_list for msg in call.args[0]]
+
+    @staticmethod
+    def received(process_messages) -> int:
+        return sum(len(call.args[0]) for call in process_messages.call_args_list)
+
+    def test_push_mode_wakes_on_new_mail(self):
+        """Test IDLE push mode processes mail delivered while idling."""
+        server = FakeIMAPServer(idle=True)
+        server.add_message(make_raw_email("sing practice", 0))
+        controller = self.start_controller(server, push=True)
+
+        self.assertEqual(self.wait_for_messages(controller, 1), ["sing practice"])
+        deadline = time.monotonic() + 5
+        while "IDLE" not in server.commands and time.monotonic() < deadline:
+            time.sleep(0.01)
+        server.add_message(make_raw_email("!status", 1))
+        self.assertEqual(self.wait_for_messages(controller, 2), ["sing practice", "!status"])
+        # One session for both messages
+        self.assertEqual(server.logins, 1)
+        self.assertIn("IDLE", server.commands)
+
+    def test_push_mode_falls_back_to_polling(self):
+        """Test servers without IDLE are polled instead."""
+        server = FakeIMAPServer(idle=False)
+        controller = self.start_controller(server, push=True)
+
+        server.add_message(make_raw_email("sing practice", 0))
+        self.assertEqual(self.wait_for_messages(controller, 1), ["sing practice"])
+        self.assertNotIn("IDLE", server.commands)
+
+    def test_polling_reuses_one_session(self):
+        """Test polls share one authenticated session."""
+        server = FakeIMAPServer(idle=False)
+        controller = self.start_controller(server, push=False)
+
+        server.add_message(make_raw_email("sing practice", 0))
+        self.wait_for_messages(controller, 1)
+        server.add_message(make_raw_email("!level", 1))
+        self.assertEqual(self.wait_for_messages(controller, 2), ["sing practice", "!level"])
+        self.assertEqual(server.logins, 1)
+        self.assertGreaterEqual(server.commands.count("UID SEARCH"), 2)
+
+    def test_pipeline_processes_batches_in_order_and_notifies(self):
+        """Test the asyncio pipeline keeps message order and routes notifications to the outbox."""
+        server = FakeIMAPServer(idle=False)
+        for minute in range(5):
+            server.add_message(make_raw_email(f"message {minute}", minute))
+
+        controller = AsyncApolloXPController(parse_workers=3)
+        controller.outbox.transport = MagicMock()
+
+        def process_messages(messages):
+            notifier = controller.xp_system.set_notifier.call_args.args[0]
+            notifier.send_message(f"processed {len(messages)}")
+        controller.xp_system.process_messages.side_effect = process_messages
+
+        self.start_controller(server, controller=controller)
+        self.wait_for_messages(controller, 5)
+        for minute in range(5, 10):
+            server.add_message(make_raw_email(f"message {minute}", minute))
+        received = self.wait_for_messages(controller, 10)
+
+        self.assertEqual(received, [f"message {minute}" for minute in range(10)])
+        # The last notification can still be on its way to the outbox
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            self.assertTrue(controller.outbox.flush(5))
+            delivered = [call.args[0] for call in controller.outbox.transport.send_message.call_args_list]
+            if sum(int(body.split()[1]) for body in delivered) >= 10:
+                break
+            time.sleep(0.01)
+        self.assertEqual(sum(int(body.split()[1]) for body in delivered), 10)
+
+    def test_pipeline_survives_a_failing_batch(self):
+        """Test a batch that fails to apply is logged and later batches still go through."""
+        server = FakeIMAPServer(idle=False)
+        server.add_message(make_raw_email("lost", 0))
+        controller = AsyncApolloXPController()
+        controller.xp_system.process_messages.side_effect = [OSError("disk full"), None]
+        self.start_controller(server, controller=controller)
+        self.wait_for_messages(controller, 1)
+
+        server.add_message(make_raw_email("applied", 1))
+        self.assertEqual(self.wait_for_messages(controller, 2), ["lost", "applied"])
+        controller.stop()
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+
+    def test_pipeline_fetch_error_keeps_message_log_open(self):
+        """Test a failed fetch drops only the IMAP session while a batch is being applied."""
+        server = FakeIMAPServer(idle=False)
+        server.add_message(make_raw_email("message 0", 0))
+        controller = AsyncApolloXPController()
+        client = controller.email_client
+        session_dropped = threading.Event()
+        close_session = client.close_session
+
+        def drop_session():
+            close_session()
+            session_dropped.set()
+        client.close_session = drop_session
+
+        observed = []
+
+        def process_messages(messages):
+            if messages == ["message 0"]:
+                log = client.message_log()
+                # The next fetch fails while this batch is still being applied
+                server.reset_mailbox(uidvalidity=2)
+                observed.append((session_dropped.wait(5), client.message_log() is log, log._file is not None))
+        controller.xp_system.process_messages.side_effect = process_messages
+
+        self.start_controller(server, controller=controller)
+        self.wait_for_messages(controller, 1)
+        server.add_message(make_raw_email("after reset", 10))
+        self.assertEqual(self.wait_for_messages(controller, 2), ["message 0", "after reset"])
+        # The session was dropped, the log stayed the same open one
+        self.assertEqual(observed, [(True, True, True)])
+        self.assertEqual([record["message"] for record in client.message_log()], ["message 0", "after reset"])
+
+    def test_pipeline_refetches_after_uidvalidity_change(self):
+        """Test the pipeline picks up low UIDs of a mailbox rebuilt under a new UIDVALIDITY."""
+        server = FakeIMAPServer(idle=False)
+        for minute in range(3):
+            server.add_message(make_raw_email(f"message {minute}", minute))
+        controller = self.start_controller(server, controller=AsyncApolloXPController())
+        self.wait_for_messages(controller, 3)
+
+        server.reset_mailbox(uidvalidity=2)
+        server.add_message(make_raw_email("after reset", 10))
+        self.assertEqual(self.wait_for_messages(controller, 4)[3:], ["after reset"])
+        with open(os.path.join(self.tmp.name, "checkpoint.json"), "r", encoding="utf-8") as file:
+            self.assertEqual(json.load(file), {"uidvalidity": 2, "last_uid": 1})
+
+    def test_catch_up_applies_backlog_in_timestamp_order(self):
+        """Test catch-up skips interleaved duplicates and applies the rest in Date order."""
+        server = FakeIMAPServer(idle=False)
+        backlog = [("late", 9), ("first", 1), ("early duplicate", 1), ("logged", 0), ("second", 2), ("late duplicate", 9)]
+        for body, minute in backlog:
+            server.add_message(make_raw_email(body, minute))
+        host, port = server.start()
+        self.addCleanup(server.stop)
+        controller = ApolloXPController()
+        controller.email_client.imap_host = host
+        controller.email_client.imap_port = port
+        controller.email_client.imap_ssl = False
+        controller.email_client.save_email(controller.email_client.parse_raw(make_raw_email("logged", 0)))
+
+        with patch("email_client.CATCH_UP_CHUNK_SIZE", 2):
+            report = controller.catch_up(workers=2)
+        controller.email_client.close()
+
+        controller.xp_system.process_messages.assert_called_once_with(["first", "second", "late"])
+        self.assertEqual((report["fetched"], report["new"], report["duplicates"]), (6, 3, 3))
+        self.assertGreater(report["messages_per_sec"], 0)
+        self.assertEqual(server.commands.count("UID FETCH"), 3)
+        self.assertEqual(controller.email_client.fetch_new_emails(), [])
+
+    def test_scheduler_backs_off_until_activity(self):
+        """Test the poll delay grows while idle and resets on activity."""
+        scheduler = AdaptivePollScheduler(min_interval_s=1, max_interval_s=8, jitter=0)
+        delays = [scheduler.next_delay(False) for _ in range(5)]
+        self.assertEqual(delays, [2, 4, 8, 8, 8])
+        self.assertEqual(scheduler.next_delay(True), 1)
+
+        jittered = AdaptivePollScheduler(min_interval_s=1, max_interval_s=8, jitter=0.5)
+        for _ in range(20):
+            self.assertLessEqual(jittered.next_delay(False), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
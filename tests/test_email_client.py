@@ -1,6 +1,20 @@
+import io
+import os
+import socket
+import tempfile
 import unittest
-from unittest.mock import patch, mock_open
-from email_client import EmailClient, DiscordClient
+from unittest.mock import MagicMock, patch, mock_open
+from email import policy
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email_client import INDEX_HEADER, EmailClient, DiscordClient, open_message_log, split_message
+from message_log import MessageLog
+from tests.fake_imap import FakeIMAPServer
+from tests.fake_smtp import FakeSMTPServer
+
+
+SMTP_ENV = {"EMAIL_USERNAME": "me@example.com", "EMAIL_PASSWORD": "pw", "EXPECTED_SENDER": "you@example.com"}
 
 
 class TestEmailClient(unittest.TestCase):
@@ -32,48 +46,308 @@ class TestEmailClient(unittest.TestCase):
         self.assertEqual(result, "Test Subject")
         mock_decode.assert_called_with("=?utf-8?b?VGVzdCBTdWJqZWN0?=")
 
-    @patch("email_client.csv.reader")
-    @patch("email_client.open", new_callable=mock_open, read_data="timestamp,sender,subject,message")
-    def test_email_already_logged(self, mock_file, mock_csv_reader):
-        """Test checking if email already exists in CSV."""
-        mock_csv_reader.return_value = iter([["2023-12-03", "sender", "subject", "message"]])
+    def test_email_already_logged(self):
+        """Test checking if email already exists in the log, migrating the legacy CSV."""
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, "emails.csv")
+            index_path = csv_path + ".idx"
+            log_path = os.path.join(tmp, "email_log")
+            with open(csv_path, "w", encoding="utf-8") as file:
+                file.write("2023-12-03,sender,subject,message\n")
 
-        client = EmailClient()
-        result = client.email_already_logged("2023-12-03")
+            with patch.multiple("email_client", EMAIL_CSV=csv_path, EMAIL_INDEX=index_path, EMAIL_LOG=log_path):
+                client = EmailClient()
+                self.assertTrue(client.email_already_logged("sender", "2023-12-03"))
+                self.assertFalse(client.email_already_logged("sender", "2023-12-04"))
+                client.close()
+                # Index is rebuilt from the log on first use
+                self.assertTrue(os.path.exists(index_path))
+                self.assertTrue(os.path.exists(csv_path + ".migrated"))
+
+    def test_csv_migration_resumes_after_a_crash(self):
+        """Test a restart after a crash mid-migration ends up with every CSV row in the log."""
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, "emails.csv")
+            log_path = os.path.join(tmp, "email_log")
+            with open(csv_path, "w", encoding="utf-8") as file:
+                file.writelines(f"date {i},sender,subject,message {i}\n" for i in range(10))
+            append = MessageLog.append
+
+            def crash_on_fourth_row(log, data, t=None):
+                if data["message"] == "message 3":
+                    raise OSError("power loss")
+                append(log, data, t)
+
+            with patch.multiple("email_client", EMAIL_CSV=csv_path, EMAIL_LOG=log_path):
+                with patch.object(MessageLog, "append", crash_on_fourth_row), self.assertRaises(OSError):
+                    open_message_log()
+                log = open_message_log()
+                self.assertEqual(len(list(log)), 10)
+                log.close()
+                self.assertTrue(os.path.exists(csv_path + ".migrated"))
 
-        self.assertTrue(result)
-        mock_file.assert_called_with("emails.csv", "r", encoding="utf-8")
+    def test_save_email_updates_index(self):
+        """Test saved emails are deduplicated through the persisted index."""
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, "emails.csv")
+            index_path = csv_path + ".idx"
+            log_path = os.path.join(tmp, "email_log")
+            data = {"timestamp": "2023-12-03", "sender": "sender@example.com", "subject": "Test", "message": "hi"}
 
-    @patch("email_client.open", new_callable=mock_open)
-    @patch("email_client.csv.writer")
-    def test_save_to_csv(self, mock_writer, mock_file):
-        """Test saving email data to CSV."""
-        mock_csv = mock_writer.return_value
+            with patch.multiple("email_client", EMAIL_CSV=csv_path, EMAIL_INDEX=index_path, EMAIL_LOG=log_path):
+                client = EmailClient()
+                client.save_email(data)
+                client.close()
+                self.assertTrue(EmailClient().email_already_logged("Sender <SENDER@example.com>", "2023-12-03"))
+
+    def test_same_date_from_two_senders_is_not_a_duplicate(self):
+        """Test emails from different senders with the same Date are both logged."""
+        with tempfile.TemporaryDirectory() as tmp:
+            index_path = os.path.join(tmp, "emails.csv.idx")
+            log_path = os.path.join(tmp, "email_log")
+            date = "Mon, 4 Dec 2023 10:00:00 +0000"
+            with open(index_path, "w", encoding="utf-8") as file:
+                # An index from before senders were part of the key
+                file.write(f"{date}\n")
+
+            paths = {"EMAIL_CSV": os.path.join(tmp, "emails.csv"), "EMAIL_INDEX": index_path, "EMAIL_LOG": log_path}
+            with patch.multiple("email_client", **paths), \
+                    patch.dict("os.environ", {"EXPECTED_SENDER": "ana@example.com, bo@example.com"}):
+                client = EmailClient()
+                for sender in ("ana@example.com", "bo@example.com", "Bo <bo@example.com>"):
+                    client.store_new_email({"timestamp": date, "sender": sender, "subject": "log", "message": "hi"})
+                client.close()
+                self.assertEqual([record["sender"] for record in MessageLog(log_path)], ["ana@example.com", "bo@example.com"])
+                with open(index_path, encoding="utf-8") as file:
+                    self.assertEqual(file.readline(), INDEX_HEADER)
+
+    def test_save_email(self):
+        """Test saving email data to the message log."""
         data = {"timestamp": "2023-12-03", "sender": "sender@example.com", "subject": "Test", "message": "This is a test"}
 
         client = EmailClient()
-        client.save_to_csv(data)
+        client._logged_keys = set()
+        client._message_log = MagicMock()
+        with patch("email_client.open", new_callable=mock_open):
+            client.save_email(data)
 
-        mock_file.assert_called_with("emails.csv", "a", newline="", encoding="utf-8")
-        mock_csv.writerow.assert_called_with(["2023-12-03", "sender@example.com", "Test", "This is a test"])
+        client._message_log.append.assert_called_once_with(data)
+        self.assertEqual(client._logged_keys, {"sender@example.com\t2023-12-03"})
 
-    @patch("email_client.requests.post")
-    @patch("email_client.os.getenv")
-    def test_discord_send_message(self, mock_getenv, mock_post):
+    def test_fetch_and_store_emails_uses_uid_checkpoint(self):
+        """Test only UIDs past the checkpoint are fetched, in one batched FETCH."""
+        raw = b"From: me@example.com\r\nDate: Mon, 4 Dec 2023 10:00:00 +0000\r\nSubject: hi\r\n\r\nsing practice\r\n"
+        mail = MagicMock()
+        mail.response.return_value = ("OK", [b"7"])
+
+        def uid(command, *args):
+            if command == "search":
+                return "OK", [b"4 5 6"]
+            later = raw.replace(b"10:00", b"11:00")
+            return "OK", [(b"1 (UID 5 RFC822 {10}", raw), b")", (b"2 (UID 6 RFC822 {10}", later), b")"]
+        mail.uid.side_effect = uid
+
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = {
+                "email_client.EMAIL_CSV": os.path.join(tmp, "emails.csv"),
+                "email_client.EMAIL_INDEX": os.path.join(tmp, "emails.csv.idx"),
+                "email_client.EMAIL_LOG": os.path.join(tmp, "email_log"),
+                "email_client.IMAP_CHECKPOINT": os.path.join(tmp, "checkpoint.json"),
+            }
+            with open(paths["email_client.IMAP_CHECKPOINT"], "w", encoding="utf-8") as file:
+                file.write('{"uidvalidity": 7, "last_uid": 4}')
+            with patch.multiple("email_client", **{k.split(".")[1]: v for k, v in paths.items()}), \
+                    patch.dict("os.environ", {"EXPECTED_SENDER": "me@example.com"}), \
+                    patch.object(EmailClient, "connect_to_email", return_value=mail):
+                messages = EmailClient().fetch_and_store_emails()
+                self.assertEqual(messages, ["sing practice", "sing practice"])
+                mail.uid.assert_any_call("search", None, '(FROM "me@example.com" UID 5:*)')
+                mail.uid.assert_any_call("fetch", "5:6", "(RFC822)")
+                with open(paths["email_client.IMAP_CHECKPOINT"], encoding="utf-8") as file:
+                    self.assertIn('"last_uid": 6', file.read())
+
+    def fetch_all(self, server: FakeIMAPServer, partial: bool) -> list:
+        host, port = server.start()
+        self.addCleanup(server.stop)
+        client = EmailClient()
+        client.imap_host, client.imap_port, client.imap_ssl = host, port, False
+        client.partial_fetch = partial
+        with patch.dict("os.environ", {"EMAIL_USERNAME": "me", "EMAIL_PASSWORD": "pw", "EXPECTED_SENDER": "me@example.com"}):
+            _, raw_emails = client.fetch_raw_emails()
+            client.close()
+        return [client.parse_raw(raw) for _, raw in raw_emails]
+
+    @staticmethod
+    def make_multipart(body: MIMEText, *attachments, minute: int = 0) -> bytes:
+        msg = MIMEMultipart()
+        msg["From"], msg["Subject"] = "me@example.com", "log"
+        msg["Date"] = f"Mon, 4 Dec 2023 10:{minute:02d}:00 +0000"
+        msg.attach(body)
+        for attachment in attachments:
+            msg.attach(attachment)
+        return msg.as_bytes(policy=policy.SMTP)
+
+    def test_partial_fetch_skips_attachments(self):
+        """Test partial fetch matches a full fetch while downloading far less."""
+        photo = MIMEApplication(os.urandom(200_000), Name="photo.jpg")
+        photo.add_header("Content-Disposition", "attachment", filename="photo.jpg")
+        log = MIMEText("cafe practice\n" + "x" * 5000, "plain", "utf-8")
+        log.add_header("Content-Disposition", "attachment", filename="log.txt")
+        messages = [
+            self.make_multipart(MIMEText("sing practice", "plain", "utf-8"), photo, minute=0),
+            self.make_multipart(MIMEText("ignored body", "plain", "utf-8"), log, minute=1),
+            self.make_multipart(MIMEText("caf\u00e9 " * 20, "plain", "utf-8"), minute=2),
+            b"From: me@example.com\r\nDate: Mon, 4 Dec 2023 10:03:00 +0000\r\nSubject: hi\r\n\r\n!status\r\n",
+        ]
+        servers = {}
+        for partial in (False, True):
+            servers[partial] = FakeIMAPServer()
+            for raw in messages:
+                servers[partial].add_message(raw)
+            with patch.multiple("email_client", IMAP_CHECKPOINT=os.devnull):
+                parsed = self.fetch_all(servers[partial], partial)
+            self.assertEqual(
+                [email["message"][:13] for email in parsed],
+                ["sing practice", "cafe practice", "caf\u00e9 caf\u00e9 caf", "!status"],
+            )
+            self.assertEqual(parsed[0]["timestamp"], "Mon, 4 Dec 2023 10:00:00 +0000")
+            self.assertEqual(parsed[0]["subject"], "log")
+
+        self.assertLess(servers[True].bytes_sent * 20, servers[False].bytes_sent)
+
+    def test_from_criteria_matches_every_allowed_sender(self):
+        """Test several senders are combined with nested IMAP ORs."""
+        with patch.dict("os.environ", {"EXPECTED_SENDER": "a@example.com, b@example.com,c@example.com"}):
+            self.assertEqual(
+                EmailClient()._from_criteria(),
+                'OR FROM "a@example.com" OR FROM "b@example.com" FROM "c@example.com"',
+            )
+
+    def test_uid_set(self):
+        """Test UIDs are compressed into ranges."""
+        self.assertEqual(EmailClient._uid_set([1, 2, 3, 7, 9, 10]), "1:3,7,9:10")
+
+    def test_send_messages_reuses_pooled_session(self):
+        """Test bulk and repeated sends share one SMTP session."""
+        server = FakeSMTPServer()
+        host, port = server.start()
+        self.addCleanup(server.stop)
+        client = EmailClient()
+        client.smtp_host, client.smtp_port, client.smtp_tls = host, port, False
+
+        with patch.dict("os.environ", SMTP_ENV):
+            self.assertEqual(client.send_messages(["Level Up!", ("Unlocked new title", "Title")]), 2)
+            client.send_message("Another")
+            client.smtp_pool().close()
+
+        self.assertEqual(len(server.messages), 3)
+        self.assertEqual(server.connections, 1)
+
+    def test_send_message_to_one_player(self):
+        """Test a message with a recipient is only addressed to that player."""
+        server = FakeSMTPServer()
+        host, port = server.start()
+        self.addCleanup(server.stop)
+        client = EmailClient()
+        client.smtp_host, client.smtp_port, client.smtp_tls = host, port, False
+
+        env = {"EMAIL_USERNAME": "me@example.com", "EMAIL_PASSWORD": "pw", "EXPECTED_SENDER": "ana@example.com,bo@example.com"}
+        with patch.dict("os.environ", env):
+            with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+                self.assertTrue(client.send_message("Level Up!", recipient="bo@example.com"))
+                client.send_message("Maintenance tonight")
+            client.smtp_pool().close()
+
+        self.assertIn(b"To: bo@example.com\r\n", server.messages[0])
+        self.assertIn(b"To: ana@example.com, bo@example.com\r\n", server.messages[1])
+        self.assertEqual(
+            stdout.getvalue().splitlines(),
+            ["Message sent to bo@example.com", "Message sent to ana@example.com, bo@example.com"],
+        )
+
+    def test_smtp_pool_reconnects_dropped_session(self):
+        """Test a session dropped by the server is replaced transparently."""
+        server = FakeSMTPServer()
+        host, port = server.start()
+        self.addCleanup(server.stop)
+        client = EmailClient()
+        client.smtp_host, client.smtp_port, client.smtp_tls = host, port, False
+
+        with patch.dict("os.environ", SMTP_ENV):
+            pool = client.smtp_pool()
+            with pool.connection() as lease:
+                lease.server.sock.shutdown(socket.SHUT_RDWR)
+                lease.sendmail("me@example.com", "you@example.com", "Subject: hi\r\n\r\nhi")
+            pool.close()
+
+        self.assertEqual(len(server.messages), 1)
+        self.assertEqual(server.connections, 2)
+
+    @patch("email_client.requests.Session")
+    def test_discord_send_message(self, mock_session):
         """Test sending a message via Discord."""
-        mock_getenv.side_effect = lambda key: "http://discord.webhook" if key == "DISCORD_WEBHOOK" else "some_other_value"
+        mock_post = mock_session.return_value.post
         mock_post.return_value.status_code = 204
 
         with patch.dict('os.environ', {'DISCORD_WEBHOOK': 'http://discord.webhook'}):
             discord_client = DiscordClient()
-            discord_client.send_message("Test message")
+            self.assertTrue(discord_client.send_message("Test message"))
+            discord_client.send_message("Second message")
 
             mock_post.assert_called_with(
                 "http://discord.webhook",
-                json={"content": "Test message"},
+                json={"content": "Second message"},
                 timeout=10
             )
-            self.assertEqual(mock_post.return_value.status_code, 204)
+            # One HTTP session is reused across posts
+            mock_session.assert_called_once()
+
+    @patch("email_client.time.sleep")
+    @patch("email_client.requests.Session")
+    def test_discord_send_message_splits_and_honours_retry_after(self, mock_session, mock_sleep):
+        """Test long messages are split at the limit and 429s are retried."""
+        limited = MagicMock(status_code=429, headers={"Retry-After": "1.5"})
+        ok = MagicMock(status_code=204)
+        mock_post = mock_session.return_value.post
+        mock_post.side_effect = [limited, ok, ok]
+
+        with patch.dict('os.environ', {'DISCORD_WEBHOOK': 'http://discord.webhook'}):
+            self.assertTrue(DiscordClient().send_message("a" * 1500 + "\n" + "b" * 1500))
+
+        mock_sleep.assert_called_once_with(1.5)
+        contents = [call.kwargs["json"]["content"] for call in mock_post.call_args_list]
+        self.assertEqual(contents, ["a" * 1500 + "\n", "a" * 1500 + "\n", "b" * 1500])
+
+    @patch("email_client.time.sleep")
+    @patch("email_client.requests.Session")
+    def test_discord_gives_up_without_a_final_sleep(self, mock_session, mock_sleep):
+        """Test the last rate limited attempt fails straight away instead of waiting first."""
+        mock_session.return_value.post.return_value = MagicMock(status_code=429, headers={"Retry-After": "2"})
+
+        with patch.dict('os.environ', {'DISCORD_WEBHOOK': 'http://discord.webhook'}), \
+                patch("email_client.DISCORD_MAX_RATE_LIMIT_RETRIES", 2):
+            self.assertFalse(DiscordClient().send_message("hi"))
+
+        self.assertEqual(mock_session.return_value.post.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    @patch("email_client.time.sleep")
+    @patch("email_client.requests.Session")
+    def test_discord_leaves_long_retry_after_to_the_caller(self, mock_session, mock_sleep):
+        """Test a Retry-After past the cap fails the post at once instead of blocking the sender."""
+        mock_session.return_value.post.return_value = MagicMock(status_code=429, headers={"Retry-After": "3600"})
+
+        with patch.dict('os.environ', {'DISCORD_WEBHOOK': 'http://discord.webhook'}):
+            self.assertFalse(DiscordClient().send_message("hi"))
+
+        self.assertEqual(mock_session.return_value.post.call_count, 1)
+        mock_sleep.assert_not_called()
+
+    def test_split_message(self):
+        """Test chunks never exceed the limit."""
+        self.assertEqual(split_message("ab\ncd\nef", 6), ["ab\ncd\n", "ef"])
+        self.assertEqual(split_message("abcdefgh", 3), ["abc", "def", "gh"])
+        self.assertEqual(split_message("", 3), [""])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,49 @@
+import base64
+import unittest
+
+from imap_parsing import decode_partial, find_text_section, parse_fetch_response
+
+
+TEXT_PART = [b"text", b"plain", [b"charset", b"utf-8"], None, None, b"7bit", b"12", b"1", None, None, None]
+
+
+class TestImapParsing(unittest.TestCase):
+
+    def test_parse_fetch_response(self):
+        """Test literals, quoted strings and nested lists come back per message."""
+        msg_data = [
+            (b'1 (UID 5 BODY[HEADER.FIELDS (FROM DATE)] {20}', b"From: a@example.com\r\n"),
+            b' BODYSTRUCTURE ("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 12 1 NIL NIL NIL))',
+            (b'2 (UID 6 BODY[1]<0> {5}', b"hello"),
+            b")",
+        ]
+        first, second = parse_fetch_response(msg_data)
+        self.assertEqual(first["UID"], b"5")
+        self.assertEqual(first["BODY[HEADER.FIELDS (FROM DATE)]"], b"From: a@example.com\r\n")
+        self.assertEqual(first["BODYSTRUCTURE"][:2], [b"text", b"plain"])
+        self.assertEqual(second["BODY[1]<0>"], b"hello")
+
+    def test_find_text_section_single_part(self):
+        """Test a single part message uses its whole body."""
+        self.assertEqual(find_text_section(TEXT_PART), ("TEXT", "7bit", "utf-8"))
+
+    def test_find_text_section_prefers_txt_attachment(self):
+        """Test a .txt attachment wins over the inline body, like parse_email."""
+        attachment = [
+            b"text", b"plain", [b"name", b"log.txt"], None, None, b"base64", b"8", b"1", None,
+            [b"attachment", [b"filename", b"log.txt"]], None,
+        ]
+        image = [b"image", b"png", None, None, None, b"base64", b"90000", None, [b"attachment", None], None]
+        structure = [TEXT_PART, image, attachment, b"mixed"]
+        self.assertEqual(find_text_section(structure), ("3", "base64", "utf-8"))
+        self.assertEqual(find_text_section([TEXT_PART, image, b"mixed"]), ("1", "7bit", "utf-8"))
+
+    def test_decode_partial_handles_truncation(self):
+        """Test cut base64 and quoted-printable data still decode."""
+        encoded = base64.b64encode("sing practice".encode())
+        self.assertEqual(decode_partial(encoded[:10], "base64", "utf-8"), "sing p")
+        self.assertEqual(decode_partial(b"caf=C3=A9 =C3", "quoted-printable", "utf-8"), "café ")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from journal import Journal
+from xp_system import XPSystem
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.filename = os.path.join(self.tmp.name, "player.pkl")
+        self.journal_path = self.filename + ".journal"
+
+    def test_append_and_read(self):
+        """Test records round trip and a torn final line is cut off on reopen."""
+        journal = Journal(self.journal_path)
+        journal.append({"seq": 1, "op": "title", "title": "Novice"})
+        journal.close()
+        with open(self.journal_path, "a", encoding="utf-8") as file:
+            file.write('{"seq": 2, "op"')
+
+        journal = Journal(self.journal_path)
+        journal.append({"seq": 2, "op": "title", "title": "Beginner"})
+        journal.close()
+        self.assertEqual([record["title"] for record in Journal.read(self.journal_path)], ["Novice", "Beginner"])
+
+    @patch('email_client.DiscordClient.send_message')
+    def test_recover_replays_journal_after_crash(self, mock_send_message):
+        """Test actions logged since the last snapshot are recovered without notifications."""
+        xp_system = XPSystem.recover(self.filename)
+        xp_system.add_action("music", "piano", 30, "practice piano")
+        xp_system.performed_action("practice piano")
+        xp_system.performed_action("sing practice")
+        xp_system.equip_title("Tester")
+        # Simulate a crash: the journal is flushed but never snapshotted or closed
+        self.assertFalse(os.path.exists(self.filename))
+        mock_send_message.reset_mock()
+
+        recovered = XPSystem.recover(self.filename)
+        self.assertEqual(recovered.total_xp, 40)
+        self.assertEqual(recovered.level, 3)
+        self.assertEqual(recovered.skill_tree["music"]["piano"], 30)
+        self.assertIn("practice piano", recovered.actions)
+        self.assertEqual(recovered.title, "Tester")
+        # Replayed gains keep the time they were made at
+        self.assertEqual(recovered.history.times, xp_system.history.times)
+        mock_send_message.assert_not_called()
+        recovered.close()
+
+    @patch('email_client.DiscordClient.send_message')
+    def test_batch_is_fsynced_when_processed(self, mock_send_message):
+        """Test a processed batch reaches the disk without waiting for the next append."""
+        xp_system = XPSystem.recover(self.filename)
+        self.addCleanup(xp_system.close)
+        xp_system._journal.fsync_every = 1000
+        xp_system._journal.fsync_interval_s = 3600
+        with patch("journal.os.fsync") as fsync:
+            xp_system.process_messages(["sing practice", "sing practice"])
+            fsync.assert_called_once()
+            xp_system.process_message("!title Tester")
+            self.assertEqual(fsync.call_count, 2)
+
+    @patch('xp_system.SNAPSHOT_EVERY', 3)
+    @patch('email_client.DiscordClient.send_message')
+    def test_snapshot_compacts_journal(self, mock_send_message):
+        """Test the journal is folded into a snapshot and not replayed twice."""
+        xp_system = XPSystem.recover(self.filename)
+        for _ in range(4):
+            xp_system.performed_action("sing practice")
+        self.assertTrue(os.path.exists(self.filename))
+        self.assertEqual(len(list(Journal.read(self.journal_path))), 1)
+        xp_system.close()
+
+        recovered = XPSystem.recover(self.filename)
+        self.assertEqual(recovered.total_xp, 40)
+        recovered.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import csv
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from message_log import INDEX_ENTRY, MIGRATING_SUFFIX, MessageLog, message_time, migrate_csv
+
+
+def make_email(i: int) -> dict:
+    return {"timestamp": f"date {i}", "sender": "me@example.com", "subject": "log", "message": f"message {i}"}
+
+
+class TestMessageLog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.directory = os.path.join(self.tmp.name, "email_log")
+
+    def open_log(self, **kwargs) -> MessageLog:
+        log = MessageLog(self.directory, **kwargs)
+        self.addCleanup(log.close)
+        return log
+
+    def test_range_reads_only_matching_records(self):
+        """Test range queries across rotated segments return records in [start, end)."""
+        log = self.open_log(max_segment_bytes=2000, index_every=4)
+        for i in range(200):
+            log.append(make_email(i), t=float(i))
+
+        self.assertGreater(len(log.segments), 5)
+        self.assertEqual([record["message"] for record in log.range(50, 53)], ["message 50", "message 51", "message 52"])
+        self.assertEqual(len(list(log.range(end=10))), 10)
+        self.assertEqual(len(list(log)), 200)
+        # The index is sparse, one entry per index_every records
+        index_entries = sum(os.path.getsize(segment.index_path) for segment in log.segments) // INDEX_ENTRY.size
+        self.assertLess(index_entries, 200 / 3)
+
+    def test_rotates_on_message_age(self):
+        """Test a segment spanning more than max_segment_age_s is rotated."""
+        log = self.open_log(max_segment_age_s=100)
+        for t in (0, 50, 99, 100, 150, 250):
+            log.append(make_email(t), t=t)
+
+        self.assertEqual([segment.first_time for segment in log.segments], [0, 100, 250])
+
+    def test_out_of_order_dates_keep_times_sorted(self):
+        """Test a Date older than the previous record is logged at the previous time."""
+        log = self.open_log()
+        log.append(make_email(0), t=10.0)
+        log.append(make_email(1), t=5.0)
+
+        self.assertEqual([record["t"] for record in log], [10.0, 10.0])
+        self.assertEqual(message_time("Mon, 4 Dec 2023 10:00:00 +0000"), 1701684000.0)
+
+    def test_future_dated_message_does_not_pin_later_times(self):
+        """Test a Date far ahead of the clock is logged at the current time."""
+        log = self.open_log()
+        log.append({**make_email(0), "timestamp": "Fri, 1 Jan 2100 00:00:00 +0000"})
+        before = time.time()
+        log.append(make_email(1), t=before)
+
+        first, second = [record["t"] for record in log]
+        self.assertLessEqual(first, before)
+        self.assertEqual(second, before)
+
+    def test_tail(self):
+        """Test tail returns the newest records across segments, oldest first."""
+        log = self.open_log(max_segment_bytes=500)
+        for i in range(30):
+            log.append(make_email(i), t=float(i))
+
+        self.assertEqual([record["message"] for record in log.tail(12)], [f"message {i}" for i in range(18, 30)])
+        self.assertEqual(len(log.tail(100)), 30)
+
+    def test_reopen_repairs_torn_record_and_rebuilds_index(self):
+        """Test reopening drops a torn final record and rebuilds a missing index."""
+        log = MessageLog(self.directory, index_every=4)
+        for i in range(10):
+            log.append(make_email(i), t=float(i))
+        log.close()
+        with open(log.segments[-1].path, "ab") as file:
+            file.write(b'{"t":10.0,"timest')
+        os.remove(log.segments[-1].index_path)
+
+        log = self.open_log(index_every=4)
+        self.assertEqual(len(log.segments[-1].times), 3)
+        log.append(make_email(10), t=10.0)
+        self.assertEqual([record["message"] for record in log.range(9)], ["message 9", "message 10"])
+        self.assertEqual(len(log.segments[-1].times), 3)
+
+    def test_migrate_and_export_csv(self):
+        """Test a legacy CSV migrates into the log and exports back unchanged."""
+        csv_path = os.path.join(self.tmp.name, "emails.csv")
+        rows = [
+            ["Mon, 4 Dec 2023 10:00:00 +0000", "me@example.com", "log", "sing practice"],
+            ["not a date", "me@example.com", "log", 'multi\nline, "quoted"'],
+            ["Mon, 4 Dec 2023 11:00:00 +0000", "me@example.com", "log", "!status"],
+        ]
+        with open(csv_path, "w", newline="", encoding="utf-8") as file:
+            csv.writer(file).writerows(rows)
+
+        self.assertEqual(migrate_csv(csv_path, self.directory), 3)
+        self.assertTrue(os.path.exists(csv_path + ".migrated"))
+        log = self.open_log()
+        export_path = os.path.join(self.tmp.name, "export.csv")
+        self.assertEqual(log.export_csv(export_path), 3)
+        with open(export_path, "r", newline="", encoding="utf-8") as file:
+            self.assertEqual(list(csv.reader(file)), rows)
+        # The unparseable Date takes the previous record's time
+        self.assertEqual(len(list(log.range(1701684000.0, 1701684001.0))), 2)
+
+    def test_migration_interrupted_by_a_crash_is_redone(self):
+        """Test a migration that fails part way leaves no partial log and migrates every row on the next run."""
+        csv_path = os.path.join(self.tmp.name, "emails.csv")
+        with open(csv_path, "w", newline="", encoding="utf-8") as file:
+            csv.writer(file).writerows([[f"date {i}", "me@example.com", "log", f"message {i}"] for i in range(10)])
+        append = MessageLog.append
+
+        def crash_on_fourth_row(log, data, t=None):
+            if data["message"] == "message 3":
+                raise OSError("power loss")
+            append(log, data, t)
+
+        with patch.object(MessageLog, "append", crash_on_fourth_row):
+            with self.assertRaises(OSError):
+                migrate_csv(csv_path, self.directory)
+        self.assertFalse(os.path.exists(self.directory))
+        self.assertTrue(os.path.exists(csv_path))
+
+        self.assertEqual(migrate_csv(csv_path, self.directory), 10)
+        self.assertEqual([record["message"] for record in self.open_log()], [f"message {i}" for i in range(10)])
+        self.assertFalse(os.path.exists(self.directory + MIGRATING_SUFFIX))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+import urllib.request
+
+from metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_disabled_metrics_record_nothing(self):
+        """Test a disabled registry hands out a shared no-op timer and keeps no data."""
+        metrics = Metrics()
+        self.assertIs(metrics.timer("fetch"), metrics.timer("parse"))
+        with metrics.timer("fetch"):
+            metrics.increment("fetched")
+        self.assertEqual((metrics.counters, metrics.histograms), ({}, {}))
+        self.assertIn("disabled", metrics.summary())
+
+    def test_timers_and_counters(self):
+        """Test timers fill histograms and counters add up."""
+        metrics = Metrics(enabled=True)
+        for _ in range(3):
+            with metrics.timer("fetch"):
+                pass
+        metrics.observe("parse", 2)
+        metrics.increment("fetched", 5)
+        metrics.increment("fetched")
+
+        self.assertEqual(metrics.histograms["fetch"].count, 3)
+        self.assertEqual(metrics.counters["fetched"], 6)
+        summary = metrics.summary()
+        self.assertLess(summary.index("parse"), summary.index("fetch"))
+
+    def test_prometheus_text(self):
+        """Test the exposition format has cumulative buckets, sum and count."""
+        metrics = Metrics(enabled=True)
+        metrics.observe("fetch", 0.003)
+        metrics.observe("fetch", 20)
+        metrics.increment("fetched", 2)
+        text = metrics.prometheus_text()
+
+        self.assertIn("# TYPE apollo_fetched_total counter\napollo_fetched_total 2\n", text)
+        self.assertIn('apollo_fetch_seconds_bucket{le="0.001"} 0\n', text)
+        self.assertIn('apollo_fetch_seconds_bucket{le="0.005"} 1\n', text)
+        self.assertIn('apollo_fetch_seconds_bucket{le="10"} 1\n', text)
+        self.assertIn('apollo_fetch_seconds_bucket{le="+Inf"} 2\n', text)
+        self.assertIn("apollo_fetch_seconds_count 2\n", text)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "apollo.prom")
+            metrics.write_prometheus(path)
+            with open(path, encoding="utf-8") as file:
+                self.assertEqual(file.read(), text)
+
+    def test_serve(self):
+        """Test the metrics endpoint serves the Prometheus text."""
+        metrics = Metrics(enabled=True)
+        metrics.increment("fetched")
+        port = metrics.serve(0)
+        self.addCleanup(metrics.stop_serving)
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            self.assertIn(b"apollo_fetched_total 1", response.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from notifiers import ConsoleNotifier, MemoryNotifier, NullNotifier, create_notifier, register_notifier
+from xp_system import XPSystem
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestNotifiers(unittest.TestCase):
+
+    def test_create_by_name(self):
+        """Test sinks are created by name, with APOLLO_NOTIFIER choosing the default."""
+        self.assertIsInstance(create_notifier("null"), NullNotifier)
+        with patch.dict("os.environ", {"APOLLO_NOTIFIER": "memory"}):
+            self.assertIsInstance(create_notifier(), MemoryNotifier)
+        with self.assertRaises(ValueError):
+            create_notifier("pigeon")
+
+    def test_register_notifier(self):
+        """Test a registered factory is used, with keyword arguments passed on."""
+        stream = io.StringIO()
+        with patch.dict("notifiers.NOTIFIERS"):
+            register_notifier("log", ConsoleNotifier)
+            create_notifier("log", stream=stream).send_message("Level up", "XP")
+        self.assertEqual(stream.getvalue(), "[XP] Level up\n")
+
+    def test_xp_system_injected_sink(self):
+        """Test XPSystem sends through an injected sink given by name or object."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        xp_system = XPSystem(os.path.join(tmp.name, "player.pkl"), notifier="memory")
+        xp_system.process_message("sing practice")
+        self.assertEqual(xp_system.notifier().messages[0][0], "Level Up! x2\nUnlocked new title: Beginner")
+
+        memory = MemoryNotifier()
+        xp_system.set_notifier(memory)
+        xp_system.process_message("!status")
+        self.assertEqual(len(memory.messages), 1)
+
+    def test_import_does_not_load_transports(self):
+        """Test importing xp_system and using an offline sink never imports email_client."""
+        code = (
+            "import sys, xp_system\n"
+            "xp_system.XPSystem(notifier='null').process_message('!status')\n"
+            "print(sorted({'email_client', 'requests', 'smtplib', 'http.server'} & set(sys.modules)))\n"
+        )
+        result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip().splitlines()[-1], "[]")
+
+
+if __name__ == "__main__":
+    unittest.main()
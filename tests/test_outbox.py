@@ -0,0 +1,70 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from outbox import CircuitBreaker, Outbox
+
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "outbox.jsonl")
+
+    def test_send_message_delivers_in_background(self):
+        """Test queued messages are delivered in order and the file is emptied."""
+        transport = MagicMock()
+        transport.send_message.return_value = True
+        outbox = Outbox(transport, self.path)
+        outbox.start()
+        self.addCleanup(outbox.stop)
+
+        outbox.send_message("Level Up!")
+        outbox.send_message("Unlocked new title: Novice", "Title")
+
+        self.assertTrue(outbox.flush(5))
+        self.assertEqual(
+            [call.args for call in transport.send_message.call_args_list],
+            [("Level Up!", "", None), ("Unlocked new title: Novice", "Title", None)],
+        )
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_undelivered_messages_survive_restart(self):
+        """Test messages queued while the transport is down are resent after a restart."""
+        down = MagicMock()
+        down.send_message.return_value = False
+        outbox = Outbox(down, self.path, base_backoff_s=0.01, breaker=CircuitBreaker(2, 60))
+        outbox.start()
+        outbox.send_message("first")
+        outbox.send_message("second")
+        # Wait until the breaker opens, then shut down with messages still queued
+        while outbox.breaker.time_until_retry() == 0:
+            time.sleep(0.01)
+        outbox.stop()
+        self.assertEqual(down.send_message.call_count, 2)
+
+        up = MagicMock()
+        up.send_message.return_value = True
+        restarted = Outbox(up, self.path)
+        self.assertEqual([record["body"] for record in restarted.pending()], ["first", "second"])
+        restarted.start()
+        self.addCleanup(restarted.stop)
+        self.assertTrue(restarted.flush(5))
+        self.assertEqual([call.args[0] for call in up.send_message.call_args_list], ["first", "second"])
+
+    def test_circuit_breaker_opens_after_threshold(self):
+        """Test the breaker blocks sends after repeated failures until a success."""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout_s=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.time_until_retry(), 0)
+        breaker.record_failure()
+        self.assertGreater(breaker.time_until_retry(), 0)
+        breaker.record_success()
+        self.assertEqual(breaker.time_until_retry(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
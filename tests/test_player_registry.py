@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from player_registry import PlayerRegistry, estimate_bytes, player_key
+from xp_system import XPSystem
+
+
+class TestPlayerRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.notifier = MagicMock()
+
+    def make_registry(self, **kwargs) -> PlayerRegistry:
+        registry = PlayerRegistry(os.path.join(self.tmp.name, "players"), notifier=self.notifier, **kwargs)
+        self.addCleanup(registry.close)
+        return registry
+
+    def test_player_key(self):
+        """Test senders are keyed by their bare lower-case address."""
+        self.assertEqual(player_key("Ana <Ana@Example.com>"), "ana@example.com")
+        self.assertEqual(player_key("bo@example.com"), "bo@example.com")
+
+    def test_process_routes_messages_per_sender(self):
+        """Test each sender gets their own state and their messages apply in order."""
+        registry = self.make_registry()
+        summaries = registry.process([
+            ("Ana <ana@example.com>", "!add music piano 5 scales"),
+            ("bo@example.com", "sing practice"),
+            ("Ana <ana@example.com>", "scales"),
+            ("Ana <ana@example.com>", "sing practice"),
+        ])
+
+        self.assertEqual(summaries["ana@example.com"]["xp"], 15)
+        self.assertEqual(summaries["bo@example.com"]["xp"], 10)
+        self.assertEqual(registry.get("ana@example.com").skill_tree["music"]["piano"], 5)
+        self.assertNotIn("scales", registry.get("bo@example.com").actions)
+        labels = {call.args[0].split("\n", 1)[0] for call in self.notifier.send_message.call_args_list}
+        self.assertEqual(labels, {"[ana@example.com]", "[bo@example.com]"})
+        # Each player is only notified about their own progress
+        for call in self.notifier.send_message.call_args_list:
+            self.assertEqual(call.args[0].split("\n", 1)[0], f"[{call.args[2]}]")
+
+    def test_least_recently_used_player_is_evicted_and_reloaded(self):
+        """Test eviction persists state and the player reloads on next use."""
+        registry = self.make_registry(max_players=2)
+        registry.process([("a@example.com", "sing practice")])
+        registry.process([("b@example.com", "sing practice")])
+        registry.process([("c@example.com", "sing practice")])
+
+        self.assertEqual(registry.loaded(), ["b@example.com", "c@example.com"])
+        self.assertEqual(registry.get("a@example.com").total_xp, 10)
+        self.assertEqual(registry.loaded(), ["c@example.com", "a@example.com"])
+
+    def test_memory_cap_limits_loaded_players(self):
+        """Test the byte cap evicts players even below max_players."""
+        # One worker, so the other player is never busy when the cap is checked
+        registry = self.make_registry(max_bytes=1, workers=1)
+        registry.process([("a@example.com", "sing practice"), ("b@example.com", "sing practice")])
+        self.assertEqual(len(registry.loaded()), 1)
+
+    def test_memory_cap_follows_state_growth(self):
+        """Test a loaded player's size is re-estimated after each batch, evicting others once it grows."""
+        registry = self.make_registry(workers=1)
+        registry.process([("a@example.com", "sing practice"), ("b@example.com", "sing practice")])
+        registry.max_bytes = registry._loaded_bytes + 100
+        registry.process([("a@example.com", f"!add music piano 5 scales {i}") for i in range(20)])
+
+        self.assertEqual(registry.loaded(), ["a@example.com"])
+        self.assertEqual(registry._loaded_bytes, estimate_bytes(registry.get("a@example.com")))
+
+    def test_similar_keys_get_their_own_files(self):
+        """Test keys that differ only in characters outside a-z0-9@._- never share a state file."""
+        registry = self.make_registry()
+        registry.process([("a+b@example.com", "sing practice"), ("a_b@example.com", "!add music piano 5 scales")])
+        registry.close()
+
+        names = sorted(name for name in os.listdir(registry.state_dir) if name.endswith(".pkl"))
+        self.assertEqual(names, ["a%2Bb@example.com.pkl", "a_b@example.com.pkl"])
+        reloaded = self.make_registry()
+        self.assertEqual(reloaded.get("a+b@example.com").total_xp, 10)
+        self.assertNotIn("scales", reloaded.get("a+b@example.com").actions)
+
+    def test_legacy_state_file_is_adopted(self):
+        """Test a save written under the old folded name is moved to the escaped one."""
+        registry = self.make_registry()
+        legacy = registry._legacy_filename_for("a+b@example.com")
+        xp_system = XPSystem.recover(legacy)
+        xp_system.set_notifier("null")
+        xp_system.process_messages(["sing practice"])
+        xp_system.close()
+
+        self.assertEqual(registry.get("a+b@example.com").total_xp, 10)
+        self.assertFalse(os.path.exists(legacy))
+        self.assertFalse(os.path.exists(legacy + ".journal"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+import json
+from unittest.mock import patch
+
+from player_state import STATE_MAGIC, HEADER, ActionTable, decode_state, encode_state, is_state
+from xp_history import XPHistory
+from xp_system import LEGACY_BACKUP_SUFFIX, XPSystem
+
+
+class TestPlayerState(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.filename = os.path.join(self.tmp.name, "player.pkl")
+
+    def make_player(self) -> XPSystem:
+        xp_system = XPSystem(self.filename)
+        xp_system.set_notifier(self)
+        xp_system.process_messages(["!add music piano 5 scales", "scales", "sing practice"] + ["scales"] * 40)
+        xp_system.skills_xp["cooking"] = 3
+        xp_system.journal_seq = 7
+        return xp_system
+
+    def send_message(self, body: str, subject: str = "", recipient: str = None):
+        pass
+
+    def version_4_body(self, xp_system: XPSystem) -> dict:
+        """A save body with its actions as version 4 wrote them, as skill and subskill indexes into the skills list"""
+        body = json.loads(encode_state(xp_system)[HEADER.size:])
+        names, subskills, subskill_ids, xp = body["actions"]
+        skills = [skill[0] for skill in body["skills"]]
+        rows = [(skills.index(subskills[i][0]), subskills[i][1]) for i in subskill_ids]
+        body["actions"] = [
+            names, [skill for skill, _ in rows], [body["skills"][skill][2].index(sub) for skill, sub in rows], xp,
+        ]
+        return body
+
+    def assert_same_progress(self, loaded: XPSystem, original: XPSystem):
+        for attribute in ("total_xp", "level", "title", "unlocked_titles", "skills_xp", "skill_tree", "actions",
+                          "action_counts", "journal_seq"):
+            self.assertEqual(getattr(loaded, attribute), getattr(original, attribute), attribute)
+        for column in ("keys", "times", "key_ids", "amounts"):
+            self.assertEqual(getattr(loaded.history, column), getattr(original.history, column), column)
+
+    def test_round_trip(self):
+        """Test saving and loading keeps every persisted attribute."""
+        original = self.make_player()
+        original.save_progress(self.filename)
+        with open(self.filename, "rb") as file:
+            self.assertTrue(is_state(file.read()))
+
+        loaded = XPSystem.load_progress(self.filename)
+        self.assert_same_progress(loaded, original)
+        # Runtime indexes are rebuilt from the loaded actions
+        self.assertEqual(loaded._skill_actions["music"], ["sing practice", "scales"])
+
+    def test_schema_interns_names_and_indexes_actions(self):
+        """Test saved actions point at (skill, subskill) pairs by index and loaded names are interned."""
+        data = encode_state(self.make_player())
+        names, subskills, subskill_ids, xp = json.loads(data[HEADER.size:])["actions"]
+        row = names.index("scales")
+        self.assertEqual((subskills[subskill_ids[row]], xp[row]), (["music", "piano"], 5))
+
+        actions = decode_state(data).actions
+        self.assertIsInstance(actions, ActionTable)
+        self.assertEqual(actions["scales"], {"skill": "music", "subskill": "piano", "xp": 5})
+        music = next(skill for skill in decode_state(data).skills if skill.name == "music")
+        self.assertEqual(music.subskill_xp[music.subskills.index("piano")], 5 * 41)
+        subskill_id = actions.subskill_ids[row]
+        self.assertIs(actions.subskills[subskill_id][0], decode_state(data).actions.subskills[subskill_id][0])
+
+    def test_loaded_actions_are_the_action_table(self):
+        """Test a loaded player keeps the action table and new actions are added to it."""
+        original = self.make_player()
+        original.save_progress(self.filename)
+        loaded = XPSystem.load_progress(self.filename)
+        self.assertIsInstance(loaded.actions, ActionTable)
+        loaded.set_notifier(self)
+        loaded.process_messages(["!add physical strength 40 gym", "gym"])
+        self.assertEqual(loaded.actions["gym"], {"skill": "physical", "subskill": "strength", "xp": 40})
+        self.assertEqual(loaded.skill_tree["physical"]["strength"], 40)
+
+    def test_pickle_save_is_migrated(self):
+        """Test a pickle save loads, is rewritten in the state format and backed up."""
+        original = self.make_player()
+        # Pickle saves kept each action as its own metadata dict
+        original.actions = dict(original.actions)
+        with open(self.filename, "wb") as file:
+            pickle.dump(original, file)
+
+        loaded = XPSystem.load_progress(self.filename)
+        self.assert_same_progress(loaded, original)
+        self.assertIsInstance(loaded.actions, ActionTable)
+        self.assertTrue(os.path.exists(self.filename + LEGACY_BACKUP_SUFFIX))
+        with open(self.filename, "rb") as file:
+            self.assertTrue(is_state(file.read()))
+
+    def test_legacy_save_keeps_equipped_title(self):
+        """Test titles an old save skipped are unlocked on the next update without replacing the equipped one."""
+        original = XPSystem(self.filename)
+        original.total_xp = original.skills_xp["music"] = original.skill_tree["music"]["singing"] = 24 ** 3
+        original.level = 24
+        # Only the exact level a player landed on used to unlock its title
+        original.unlocked_titles = ["Tester", "Task Terminator"]
+        original.title = "Task Terminator"
+        with open(self.filename, "wb") as file:
+            pickle.dump(original, file)
+
+        loaded = XPSystem.load_progress(self.filename)
+        loaded.set_notifier(self)
+        loaded.process_message("sing practice")
+        self.assertEqual(loaded.title, "Task Terminator")
+        self.assertEqual(
+            loaded.unlocked_titles, ["Tester", "Task Terminator", "Beginner", "Novice", "Demon Slayer"]
+        )
+
+        loaded.update_xp(25 ** 3, "music", "singing")
+        self.assertEqual(loaded.title, "XP Farmer")
+
+    def test_version_1_is_migrated(self):
+        """Test a version 1 file, from before the XP history, loads with an empty history."""
+        body = self.version_4_body(self.make_player())
+        del body["history"]
+        state = decode_state(HEADER.pack(STATE_MAGIC, 1) + json.dumps(body).encode())
+        self.assertEqual(len(state.history), 0)
+        self.assertEqual(state.total_xp, self.make_player().total_xp)
+
+    def test_version_2_is_migrated(self):
+        """Test a version 2 file drops its level titles and starts counting actions."""
+        body = self.version_4_body(self.make_player())
+        del body["action_counts"]
+        body["level_titles"] = [[1, "Beginner"]]
+        body["history"] = body["history"][:4]
+        state = decode_state(HEADER.pack(STATE_MAGIC, 2) + json.dumps(body).encode())
+        self.assertEqual(state.action_counts, {})
+        self.assertNotIn("level_titles", state.extra)
+
+    def test_version_3_is_migrated(self):
+        """Test a version 3 file, with event columns only, gets its rollups rebuilt once."""
+        original = self.make_player()
+        body = self.version_4_body(original)
+        body["history"] = body["history"][:4]
+        state = decode_state(HEADER.pack(STATE_MAGIC, 3) + json.dumps(body).encode())
+        self.assertEqual(state.history.stats("music", "all"), original.history.stats("music", "all"))
+
+    def test_version_4_is_migrated(self):
+        """Test a version 4 file, with actions pointing into the skills list, loads the same actions."""
+        original = self.make_player()
+        state = decode_state(HEADER.pack(STATE_MAGIC, 4) + json.dumps(self.version_4_body(original)).encode())
+        self.assertEqual(state.actions, original.actions)
+        self.assertEqual(state.actions.subskills, [("music", "singing"), ("music", "piano")])
+
+    def test_history_rollups_are_loaded_not_rebuilt(self):
+        """Test loading reads the saved rollups instead of replaying every event."""
+        original = self.make_player()
+        data = encode_state(original)
+        with patch.object(XPHistory, "_roll", side_effect=AssertionError("rollups rebuilt")):
+            state = decode_state(data)
+        self.assertEqual(state.history.stats("music", "all"), original.history.stats("music", "all"))
+
+    def test_newer_version_is_rejected(self):
+        """Test a file from a newer schema version is refused rather than misread."""
+        data = encode_state(self.make_player())
+        newer = HEADER.pack(STATE_MAGIC, 99) + data[HEADER.size:]
+        with self.assertRaises(ValueError):
+            decode_state(newer)
+
+
+if __name__ == '__main__':
+    unittest.main()
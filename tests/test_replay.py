@@ -0,0 +1,119 @@
+import csv
+import os
+import random
+import tempfile
+import time
+import unittest
+from email.utils import formatdate
+from unittest.mock import MagicMock, patch
+
+from achievements import AchievementRules
+from message_log import message_time
+from replay import read_messages, replay
+from xp_history import DAY_S
+from xp_system import XPSystem
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.csv_path = os.path.join(self.tmp.name, "emails.csv")
+        self.filename = os.path.join(self.tmp.name, "player.pkl")
+
+    def write_csv(self, rows: list):
+        with open(self.csv_path, "w", newline="", encoding="utf-8") as file:
+            csv.writer(file).writerows(rows)
+
+    def test_matches_processing_each_message(self):
+        """Test a replay ends in the same state as process_message on every row."""
+        rng = random.Random(1)
+        messages = ["scales", "!title Novice", "!add music piano 50 scales"]
+        choices = [
+            "sing practice", "scales", "gym", "!status", "!title Beginner", "!title Novice", "!title Leviathan",
+            "!add physical strength 40 gym", "!add music piano oops scales", "x" * 120, "!title",
+        ]
+        messages += [rng.choice(choices) for _ in range(3000)]
+        self.write_csv([[f"date {i}", "player@example.com", "log", msg] for i, msg in enumerate(messages)])
+
+        expected = XPSystem()
+        expected.set_notifier(MagicMock())
+        for msg in messages:
+            try:
+                expected.process_message(msg)
+            except ValueError:
+                pass
+        replayed = replay(self.csv_path, self.filename, chunk_rows=700)
+
+        for attribute in ("total_xp", "level", "title", "unlocked_titles", "skills_xp", "skill_tree", "actions"):
+            self.assertEqual(getattr(replayed, attribute), getattr(expected, attribute), attribute)
+        self.assertEqual(XPSystem.load_progress(self.filename).total_xp, expected.total_xp)
+
+    def test_replay_replaces_journal_and_filters_sender(self):
+        """Test only the chosen sender counts and the stale journal is dropped."""
+        self.write_csv([
+            ["d1", "Ana <ana@example.com>", "log", "sing practice"],
+            ["d2", "bo@example.com", "log", "sing practice"],
+        ])
+        with open(self.filename + ".journal", "w", encoding="utf-8") as file:
+            file.write('{"seq": 1, "op": "xp", "xp": 1000, "skill": "music", "subskill": "singing"}\n')
+
+        replayed = replay(self.csv_path, self.filename, sender="ana@example.com")
+        self.assertEqual(replayed.total_xp, 10)
+        recovered = XPSystem.recover(self.filename)
+        self.addCleanup(recovered.close)
+        self.assertEqual(recovered.total_xp, 10)
+
+    def test_rebuilds_history_rollups(self):
+        """Test replayed XP lands in the history per message day, so stats and streaks see it."""
+        now = time.time()
+        dates = [formatdate(now - days_ago * DAY_S) for days_ago in (2, 1, 1, 0)]
+        # A Date that does not parse counts on the previous row's day
+        dates.append("bad date")
+        self.write_csv([[date, "ana@example.com", "log", "sing practice"] for date in dates])
+        rules = AchievementRules.from_config({"rules": [{"title": "Regular", "when": {"event": "streak", "days": 3}}]})
+
+        with patch("xp_system.load_rules", return_value=rules):
+            replayed = replay(self.csv_path, self.filename)
+        self.assertEqual(replayed.history.stats("music", "today", now), ("today", 20, {"singing": 20}))
+        self.assertEqual(replayed.history.stats("music", "3d", now)[1], 50)
+        self.assertIn("Regular", replayed.unlocked_titles)
+        self.assertEqual(XPSystem.load_progress(self.filename).history.stats("music", "all")[1], 50)
+
+    def test_unlocks_streaks_from_the_past(self):
+        """Test a streak that ended long ago unlocks its title, as it did when processed live."""
+        now = time.time()
+        self.write_csv([
+            [formatdate(now - days_ago * DAY_S), "ana@example.com", "log", "sing practice"] for days_ago in (32, 31, 30)
+        ])
+        rules = AchievementRules.from_config({"rules": [{"title": "Regular", "when": {"event": "streak", "days": 3}}]})
+
+        with patch("xp_system.load_rules", return_value=rules):
+            replayed = replay(self.csv_path, self.filename)
+        self.assertEqual(replayed.unlocked_titles, ["Tester", "Regular"])
+
+    def test_csv_dates_match_message_time(self):
+        """Test CSV Dates read without parsedate_to_datetime give the same times, whatever their zone."""
+        dates = [
+            "Mon, 4 Dec 2023 10:00:00 +0000", "4 Dec 2023 23:30 -0530", "Tue, 5 Dec 2023 00:15:00 +0545",
+            "Mon, 4 Dec 2023 10:00:00 -0000", "Tue, 31 Feb 2023 10:00:00 +0000", "Mon, 4 Dec 2023 25:00:00 +0100",
+            "Mon, 4 Dec 23 10:00:00 GMT", "bad date",
+        ]
+        self.write_csv([[date, "ana@example.com", "log", "sing practice"] for date in dates])
+        times = [t for messages in read_messages(self.csv_path) for t, _ in messages]
+        expected = [message_time(dates[0])]
+        for date in dates[1:]:
+            expected.append(message_time(date, default=expected[-1]))
+        self.assertEqual(times, expected)
+
+    def test_replays_message_log(self):
+        """Test the default source is the message log, migrated from emails.csv if needed."""
+        self.write_csv([["d1", "ana@example.com", "log", "sing practice"], ["d2", "ana@example.com", "log", "sing practice"]])
+        with patch.multiple("email_client", EMAIL_CSV=self.csv_path, EMAIL_LOG=os.path.join(self.tmp.name, "email_log")):
+            replayed = replay(filename=self.filename)
+        self.assertEqual(replayed.total_xp, 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import time
+import unittest
+from unittest.mock import patch
+
+from xp_history import XPHistory, day_of
+
+
+# Wednesday 2024-01-10, noon local time
+NOW = time.mktime((2024, 1, 10, 12, 0, 0, 0, 0, -1))
+DAY_S = 24 * 60 * 60
+
+
+class TestXPHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.history = XPHistory()
+        for days_ago, skill, subskill, xp in [
+            (0, "music", "singing", 10),
+            (0, "music", "piano", 5),
+            (1, "music", "singing", 10),   # Tuesday, same week
+            (3, "music", "piano", 20),     # Sunday, previous week
+            (20, "music", "singing", 100),
+            (0, "physical", "strength", 7),
+        ]:
+            self.history.record(skill, subskill, xp, NOW - days_ago * DAY_S)
+
+    def test_windows(self):
+        """Test each window sums the right days and weeks per skill and subskill."""
+        self.assertEqual(self.history.stats("music", "today", NOW), ("today", 15, {"singing": 10, "piano": 5}))
+        self.assertEqual(self.history.stats("music", "week", NOW)[1:], (25, {"singing": 20, "piano": 5}))
+        self.assertEqual(self.history.stats("music", "4d", NOW)[1], 45)
+        self.assertEqual(self.history.stats("music", "2w", NOW)[1], 45)
+        self.assertEqual(self.history.stats("music", "all", NOW)[1:], (145, {"singing": 120, "piano": 25}))
+        self.assertEqual(self.history.stats("social", "all", NOW)[1:], (0, {}))
+
+    def test_unknown_window(self):
+        """Test bad or oversized windows are rejected."""
+        for window in ("fortnight", "0d", "100000d"):
+            with self.assertRaises(ValueError):
+                self.history.window(window, NOW)
+
+    def test_queries_read_rollups_not_events(self):
+        """Test stats stay correct without touching the event arrays."""
+        with patch.object(self.history, "times", None), patch.object(self.history, "amounts", None):
+            self.assertEqual(self.history.stats("music", "week", NOW)[1], 25)
+
+    def test_from_columns_rebuilds_rollups(self):
+        """Test a history rebuilt from its columns answers the same queries."""
+        rebuilt = XPHistory.from_columns(
+            [list(key) for key in self.history.keys], self.history.times, self.history.key_ids, self.history.amounts
+        )
+        self.assertEqual(len(rebuilt), 6)
+        for window in ("today", "week", "4d", "all"):
+            self.assertEqual(rebuilt.stats("music", window, NOW), self.history.stats("music", window, NOW))
+
+    def test_compaction_keeps_rollups(self):
+        """Test old raw events are dropped past the limit while totals still count them."""
+        with patch("xp_history.MAX_EVENTS", 4):
+            for _ in range(5):
+                self.history.record("music", "piano", 1, NOW)
+        self.assertEqual(len(self.history), 6)
+        self.assertEqual(self.history.stats("music", "all", NOW)[1:], (150, {"singing": 120, "piano": 30}))
+
+        rebuilt = XPHistory.from_columns(
+            self.history.keys, self.history.times, self.history.key_ids, self.history.amounts, self.history.rollup_rows()
+        )
+        self.assertEqual(rebuilt.stats("music", "all", NOW), self.history.stats("music", "all", NOW))
+
+    def test_longest_streak(self):
+        """Test the longest run of days with XP is found wherever it lies in the history."""
+        for days_ago in (40, 39, 38):
+            self.history.record("music", "piano", 1, NOW - days_ago * DAY_S)
+        self.assertEqual(self.history.streak("music", NOW), 2)
+        self.assertEqual(self.history.longest_streak("music"), 3)
+        self.assertEqual(self.history.longest_streak("physical"), 1)
+        self.assertEqual(self.history.longest_streak(), 3)
+        self.assertEqual(self.history.longest_streak("music", limit=2), 2)
+        self.assertEqual(self.history.longest_streak("social"), 0)
+
+    def test_day_of_uses_local_midnight(self):
+        """Test events just either side of local midnight land on different days."""
+        midnight = time.mktime((2024, 1, 10, 0, 0, 0, 0, 0, -1))
+        self.assertEqual(day_of(midnight) - day_of(midnight - 1), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 from unittest.mock import patch
-from xp_system import XPSystem
+from metrics import Metrics
+from xp_system import XPSystem, level_for_xp
 
 
 class TestXPSystem(unittest.TestCase):
@@ -9,7 +10,7 @@ class TestXPSystem(unittest.TestCase):
         """Set up a fresh XPSystem instance before each test."""
         self.xp_system = XPSystem()
 
-    @patch('xp_system.DiscordClient.send_message')
+    @patch('email_client.DiscordClient.send_message')
     def test_initial_state(self, mock_send_message):
         """Test the initial state of the XP system."""
         self.assertEqual(self.xp_system.total_xp, 0)
@@ -17,7 +18,7 @@ class TestXPSystem(unittest.TestCase):
         self.assertEqual(self.xp_system.title, "Tester")
         self.assertEqual(self.xp_system.skills_xp, {"music": 0, "programming": 0, "social": 0, "life": 0, "physical": 0})
 
-    @patch('xp_system.DiscordClient.send_message')
+    @patch('email_client.DiscordClient.send_message')
     def test_level_up(self, mock_send_message):
         """Test leveling up logic."""
         self.xp_system.level = 3
@@ -29,20 +30,40 @@ class TestXPSystem(unittest.TestCase):
         self.xp_system.level_up()
         self.assertEqual(self.xp_system.level, 10)
 
-    @patch('xp_system.DiscordClient.send_message')
+    def test_level_for_xp(self):
+        """Test the closed-form solver agrees with climbing level by level."""
+        for xp in list(range(0, 3000)) + [999 ** 3 - 1, 1000 ** 3, 1000 ** 3 + 1, 12345 ** 3 - 1, 12345 ** 3]:
+            level = 0
+            while xp >= (level + 1) ** 3:
+                level += 1
+            self.assertEqual(level_for_xp(xp), level, xp)
+
+    @patch('email_client.DiscordClient.send_message')
+    def test_level_up_crosses_several_milestones(self, mock_send_message):
+        """Test one large grant unlocks every title milestone it crosses."""
+        self.xp_system.update_xp(27000, "music", "general")
+        self.assertEqual(self.xp_system.level, 30)
+        self.assertEqual(
+            self.xp_system.unlocked_titles,
+            ["Tester", "Beginner", "Novice", "Demon Slayer", "Task Terminator", "XP Farmer"],
+        )
+        self.assertEqual(self.xp_system.title, "XP Farmer")
+        self.assertEqual(self.xp_system.xp_to_next_level(), 31 ** 3 - 27000)
+
+    @patch('email_client.DiscordClient.send_message')
     def test_add_action(self, mock_send_message):
         """Test adding a new action."""
         self.xp_system.add_action('music', 'singing', 20, 'karaoke')
         self.assertIn('karaoke', self.xp_system.actions)
 
-    @patch('xp_system.DiscordClient.send_message')
+    @patch('email_client.DiscordClient.send_message')
     def test_performed_action(self, mock_send_message):
         """Test performing an action."""
         initial_xp = self.xp_system.total_xp
         self.xp_system.performed_action('sing practice')
         self.assertEqual(self.xp_system.total_xp, initial_xp + 10)
 
-    @patch('xp_system.DiscordClient.send_message')
+    @patch('email_client.DiscordClient.send_message')
     def test_equip_title(self, mock_send_message):
         """Test equipping a new title."""
         self.xp_system.level = 10
@@ -50,13 +71,84 @@ class TestXPSystem(unittest.TestCase):
         self.xp_system.equip_title("Demon Slayer")
         self.assertEqual(self.xp_system.title, "Demon Slayer")
 
-    @patch('xp_system.DiscordClient.send_message')
+    @patch('email_client.DiscordClient.send_message')
     def test_show_actions(self, mock_send_message):
         """Test showing actions for a specific skill."""
         self.xp_system.show_actions('music')
         mock_send_message.assert_called()
 
-    @patch('xp_system.DiscordClient.send_message')
+    @patch('email_client.DiscordClient.send_message')
+    def test_process_message_sends_one_notification(self, mock_send_message):
+        """Test every message from one command is coalesced into one send."""
+        self.xp_system.add_action('music', 'singing', 1000, 'concert')
+        self.xp_system.process_message('concert')
+        mock_send_message.assert_called_once()
+        self.assertIn("Unlocked new title: Demon Slayer", mock_send_message.call_args.args[0])
+
+    @patch('email_client.DiscordClient.send_message')
+    def test_process_messages_matches_sequential_processing(self, mock_send_message):
+        """Test a batch ends in the same state as one-by-one processing, with one save and one send."""
+        messages = ["!add music piano 300 recital", "sing practice", "recital", "!level", "!add bad", "recital"]
+        sequential = XPSystem()
+        with patch.object(XPSystem, 'save_progress'):
+            for msg in messages:
+                try:
+                    sequential.process_message(msg)
+                except ValueError:
+                    pass
+        mock_send_message.reset_mock()
+
+        with patch.object(XPSystem, 'save_progress') as mock_save:
+            summary = self.xp_system.process_messages(messages)
+
+        self.assertEqual(summary, {"messages": 6, "actions": 3, "xp": 610})
+        mock_save.assert_called_once()
+        mock_send_message.assert_called_once()
+        self.assertIn("Current Level: 6", mock_send_message.call_args.args[0])
+        for attribute in ("total_xp", "level", "unlocked_titles", "title", "skill_tree"):
+            self.assertEqual(getattr(self.xp_system, attribute), getattr(sequential, attribute))
+
+    @patch('email_client.DiscordClient.send_message')
+    def test_action_names_are_not_routed_as_commands(self, mock_send_message):
+        """Test an action containing a command word is logged, not dispatched."""
+        self.xp_system.process_message("!add programming general 5 push !level fix")
+        self.xp_system.process_message("push !level fix")
+        self.assertEqual(self.xp_system.skill_tree["programming"]["general"], 5)
+
+    @patch('email_client.DiscordClient.send_message')
+    def test_show_actions_lists_only_skill_actions(self, mock_send_message):
+        """Test per-skill listing uses actions registered for that skill only."""
+        self.xp_system.add_action('programming', 'terminal', 5, 'vim golf')
+        self.xp_system.add_action('music', 'piano', 20, 'scales')
+        self.xp_system.process_message('!action music')
+        listing = mock_send_message.call_args.args[0]
+        self.assertIn("sing practice: 10 XP", listing)
+        self.assertIn("scales: 20 XP", listing)
+        self.assertNotIn("vim golf", listing)
+
+    @patch('email_client.DiscordClient.send_message')
+    def test_stats_command(self, mock_send_message):
+        """Test !stats answers from the history rollups."""
+        self.xp_system.process_messages(['!add music piano 5 scales', 'scales', 'sing practice', 'sing practice'])
+        self.xp_system.process_message('!stats music today')
+        self.assertEqual(mock_send_message.call_args.args[0], "Music XP today: 25\n\tpiano: 5\n\tsinging: 20")
+        self.xp_system.process_message('!stats music')
+        self.assertTrue(mock_send_message.call_args.args[0].startswith("Music XP this week: 25"))
+        self.xp_system.process_message('!stats music fortnight')
+        self.assertIn("Unknown window", mock_send_message.call_args.args[0])
+
+    @patch('email_client.DiscordClient.send_message')
+    def test_perf_command_reports_stage_timings(self, mock_send_message):
+        """Test !perf sends the metrics summary, slowest stage first."""
+        metrics = Metrics(enabled=True)
+        with patch('xp_system.METRICS', metrics):
+            self.xp_system.process_messages(['sing practice', 'sing practice'])
+            self.xp_system.process_message('!perf')
+        report = mock_send_message.call_args.args[0]
+        self.assertIn("process_messages: 1 calls", report)
+        self.assertIn("messages_processed: 2", report)
+
+    @patch('email_client.DiscordClient.send_message')
     def test_save_and_load_progress(self, mock_send_message):
         """Test saving and loading progress."""
         self.xp_system.total_xp = 100
@@ -0,0 +1,202 @@
+"""Time series of XP events with daily and weekly rollups"""
+import re
+import sys
+import time
+from array import array
+
+
+DAY_S = 24 * 60 * 60
+# Calendar granularities kept pre-aggregated
+DAY = "day"
+WEEK = "week"
+# Pseudo granularity holding all-time totals in bucket 0
+ALL = "all"
+WINDOW_PATTERN = re.compile(r"(\d+)([dw])")
+# Most buckets an Nd or Nw window may span
+MAX_WINDOW = 1000
+# Raw events kept once older ones are compacted away; the rollups still cover every event
+MAX_EVENTS = 10000
+
+
+def day_of(timestamp: float) -> int:
+    """Local calendar day number of a Unix timestamp"""
+    return int((timestamp + time.localtime(timestamp).tm_gmtoff) // DAY_S)
+
+
+def week_of(day: int) -> int:
+    """Monday-based week number of a day number (day 0, 1970-01-01, was a Thursday)"""
+    return (day + 3) // 7
+
+
+class XPHistory:
+    """
+    Append-only XP events kept in arrays, with rollups updated as events arrive.
+
+    Each event is a timestamp, an XP amount and an index into the (skill,
+    subskill) key table. Rollups map (granularity, bucket, skill, subskill) to
+    XP, with subskill None for the whole skill, so a query over a window of
+    days or weeks reads one entry per bucket however long the history is.
+    Only the latest MAX_EVENTS raw events are kept once the history grows to
+    twice that; the rollups are saved with the history rather than rebuilt.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.times = array("d")
+        self.key_ids = array("q")
+        self.amounts = array("q")
+        self._init_rollups()
+
+    def _init_rollups(self, rollups: dict = None):
+        self._key_index = {}
+        self._subskills = {}  # skill -> subskills seen for it, in first seen order
+        for key_id, key in enumerate(self.keys):
+            self._index_key(key_id, key)
+        if rollups is not None:
+            self._rollups = rollups
+            return
+        self._rollups = {}
+        for i in range(len(self.times)):
+            self._roll(self.times[i], self.keys[self.key_ids[i]], self.amounts[i])
+
+    @classmethod
+    def from_columns(cls, keys: list, times: array, key_ids: array, amounts: array, rollups: list = None) -> "XPHistory":
+        """Load a history from saved columns, rebuilding the rollups from the events when none are given"""
+        history = cls.__new__(cls)
+        history.keys = [tuple(key) for key in keys]
+        history.times = times
+        history.key_ids = key_ids
+        history.amounts = amounts
+        if rollups is not None:
+            intern = sys.intern
+            rollups = {
+                (intern(granularity), bucket, intern(skill), subskill and intern(subskill)): xp
+                for granularity, bucket, skill, subskill, xp in rollups
+            }
+        history._init_rollups(rollups)
+        return history
+
+    def rollup_rows(self) -> list:
+        """Rollups as [granularity, bucket, skill, subskill, xp] rows, for saving"""
+        return [[*key, xp] for key, xp in self._rollups.items()]
+
+    def __len__(self) -> int:
+        """Number of raw events kept"""
+        return len(self.times)
+
+    def rollup_count(self) -> int:
+        """Number of rollup entries"""
+        return len(self._rollups)
+
+    def _index_key(self, key_id: int, key: tuple):
+        self._key_index[key] = key_id
+        self._subskills.setdefault(key[0], []).append(key[1])
+
+    def record(self, skill: str, subskill: str, xp: int, at: float = None):
+        """Append one XP event, at the current time unless given"""
+        at = time.time() if at is None else at
+        key = (skill, subskill)
+        key_id = self._key_index.get(key)
+        if key_id is None:
+            key_id = len(self.keys)
+            self.keys.append(key)
+            self._index_key(key_id, key)
+        self.times.append(at)
+        self.key_ids.append(key_id)
+        self.amounts.append(xp)
+        self._roll(at, key, xp)
+        if len(self.times) > 2 * MAX_EVENTS:
+            self.compact()
+
+    def record_day(self, skill: str, subskill: str, xp: int, day: int):
+        """Fold XP gained on a day into the rollups without keeping raw events, e.g. when rebuilding state in bulk"""
+        key = (skill, subskill)
+        if key not in self._key_index:
+            self.keys.append(key)
+            self._index_key(len(self.keys) - 1, key)
+        self._roll_day(day, key, xp)
+
+    def compact(self, keep: int = None):
+        """Drop all but the latest keep (MAX_EVENTS by default) raw events, leaving the rollups untouched"""
+        keep = MAX_EVENTS if keep is None else keep
+        for column in (self.times, self.key_ids, self.amounts):
+            del column[:max(0, len(column) - keep)]
+
+    def _roll(self, at: float, key: tuple, xp: int):
+        self._roll_day(day_of(at), key, xp)
+
+    def _roll_day(self, day: int, key: tuple, xp: int):
+        skill, subskill = key
+        rollups = self._rollups
+        for bucket in ((DAY, day), (WEEK, week_of(day)), (ALL, 0)):
+            for rollup_key in (bucket + (skill, None), bucket + (skill, subskill)):
+                rollups[rollup_key] = rollups.get(rollup_key, 0) + xp
+
+    def total(self, granularity: str, first: int, last: int, skill: str, subskill: str = None) -> int:
+        """XP for a skill (or one of its subskills) over buckets first..last inclusive"""
+        rollups = self._rollups
+        return sum(rollups.get((granularity, bucket, skill, subskill), 0) for bucket in range(first, last + 1))
+
+    def streak(self, skill: str = None, now: float = None, limit: int = MAX_WINDOW) -> int:
+        """Consecutive days up to today with XP in skill (any skill when None), counting at most limit"""
+        today = day_of(time.time() if now is None else now)
+        skills = self._subskills if skill is None else (skill,)
+        rollups = self._rollups
+        days = 0
+        while days < limit and any(rollups.get((DAY, today - days, name, None)) for name in skills):
+            days += 1
+        return days
+
+    def longest_streak(self, skill: str = None, limit: int = MAX_WINDOW) -> int:
+        """Most consecutive days with XP in skill (any skill when None) anywhere in the history, counting at most limit"""
+        days = sorted({
+            bucket for (granularity, bucket, name, subskill), xp in self._rollups.items()
+            if granularity == DAY and subskill is None and xp and (skill is None or name == skill)
+        })
+        longest = run = 0
+        for i, day in enumerate(days):
+            run = run + 1 if i and day == days[i - 1] + 1 else 1
+            longest = max(longest, run)
+            if longest >= limit:
+                return limit
+        return longest
+
+    def window(self, window: str, now: float = None) -> tuple:
+        """
+        Turn a window name into (granularity, first bucket, last bucket, description).
+
+        Windows: today, week (this calendar week), Nd (last N days), Nw (last N
+        calendar weeks) and all.
+
+        Raises:
+            ValueError: The window is not recognised.
+        """
+        today = day_of(time.time() if now is None else now)
+        if window in ("today", "day"):
+            return DAY, today, today, "today"
+        if window == "week":
+            return WEEK, week_of(today), week_of(today), "this week"
+        if window == "all":
+            return ALL, 0, 0, "all time"
+        match = WINDOW_PATTERN.fullmatch(window)
+        if match is None or not 0 < int(match.group(1)) <= MAX_WINDOW:
+            raise ValueError(f"Unknown window {window!r}, use today, week, all, <N>d or <N>w with N up to {MAX_WINDOW}")
+        count = int(match.group(1))
+        if match.group(2) == "d":
+            return DAY, today - count + 1, today, f"the last {count} days"
+        return WEEK, week_of(today) - count + 1, week_of(today), f"the last {count} weeks"
+
+    def stats(self, skill: str, window: str, now: float = None) -> tuple:
+        """
+        XP for a skill in a window, with the per-subskill breakdown.
+
+        Returns:
+            tuple: (description of the window, total XP, {subskill: XP} for subskills with XP).
+        """
+        granularity, first, last, description = self.window(window, now)
+        breakdown = {}
+        for subskill in self._subskills.get(skill, ()):
+            xp = self.total(granularity, first, last, skill, subskill)
+            if xp:
+                breakdown[subskill] = xp
+        return description, self.total(granularity, first, last, skill), breakdown
@@ -1,12 +1,67 @@
 """XP System for player"""
+import bisect
+import contextlib
+import os
 import pickle
+import shutil
+import time
 
-from email_client import DiscordClient
+from achievements import load_rules
+from journal import JOURNAL_SUFFIX, Journal
+from metrics import METRICS
+from notifiers import create_notifier
+from player_state import ActionTable, decode_state, encode_state, is_state
+from xp_history import XPHistory
+
+# Runtime-only attributes left out of saved progress
+TRANSIENT_ATTRIBUTES = (
+    "_notifier", "_pending_messages", "_journal", "_batch", "_dirty", "_achievements", "_skill_actions",
+)
+# Fold the journal into a fresh snapshot after this many records
+SNAPSHOT_EVERY = 500
+# Copy kept of a pickle save when it is migrated to the state format
+LEGACY_BACKUP_SUFFIX = ".pickle.bak"
+# XP needed for each level, precomputed well past any realistic level
+MAX_TABLE_LEVEL = 1000
+LEVEL_THRESHOLDS = [level ** 3 for level in range(MAX_TABLE_LEVEL + 1)]
+
+
+HELP_TEXT = (
+    "List of messages:\n"
+    + "!status - show concise status\n"
+    + "!status full - show full status of skill tree\n"
+    + "!add <skill> <subskill> <xp> <action name> - register action\n"
+    + "!title - change title\n"
+    + "!level - display current level and title\n"
+    + "!action <skill> - display all registered actions for a skill\n"
+    + "!stats <skill> [today|week|all|<N>d|<N>w] - XP gained in a window, this week by default\n"
+    + "!perf - show where processing time is going\n"
+    + "<action> - log action\n"
+)
+
+
+def level_for_xp(xp: int) -> int:
+    """Highest level whose XP threshold (level ** 3) is at most xp"""
+    if xp < LEVEL_THRESHOLDS[-1]:
+        return bisect.bisect_right(LEVEL_THRESHOLDS, xp) - 1
+    # Integer cube root, corrected for floating point error
+    level = round(xp ** (1 / 3))
+    while level ** 3 > xp:
+        level -= 1
+    while (level + 1) ** 3 <= xp:
+        level += 1
+    return level
 
 
 class XPSystem:
     """XP System for the player"""
-    def __init__(self, filename="test.pkl"):
+    def __init__(self, filename="test.pkl", notifier=None):
+        """
+        Args:
+            filename (str): File progress is saved to.
+            notifier: Sink for notifications, an object with send_message or a
+                notifiers.NOTIFIERS name. The default sink is created on first send.
+        """
         self.total_xp = 0
         self.level = 0
         self.unlocked_titles = ["Tester"]
@@ -46,60 +101,196 @@ class XPSystem:
                 "general": 0,
             }
         }
-        self.actions = {
-            "sing practice": {
-                "skill": "music",
-                "subskill": "singing",
-                "xp": 10
-            }
-        }
-        self.level_titles = {
-            1: "Beginner",
-            5: "Novice",
-            10: "Demon Slayer",
-            15: "Task Terminator",
-            25: "XP Farmer",
-            50: "Leviathan",
-            100: "Demon King",
-            150: "Dreamer",
-            200: "Player"
-        }
+        self.actions = ActionTable()
+        self.actions.add("sing practice", "music", "singing", 10)
+        # Times each action was performed, for action count achievements
+        self.action_counts = {}
         self.filename = filename
+        # Sequence number of the last journal record reflected in this state
+        self.journal_seq = 0
+        # Every XP gain with its time, rolled up per day and week
+        self.history = XPHistory()
+        self._init_transient()
+        if notifier is not None:
+            self.set_notifier(notifier)
+
+    def _init_transient(self):
+        """Set up runtime-only state that is never saved"""
+        self._notifier = None
+        self._pending_messages = None
+        self._journal = None
+        # Summary of the process_messages batch in progress, None outside a batch
+        self._batch = None
+        self._dirty = False
+        # Title rules from the achievements config not met yet, indexed by the counter they watch
+        self._achievements = load_rules().tracker(self.unlocked_titles)
+        # skill -> registered action names, kept in sync by add_action
+        self._skill_actions = {}
+        skills = [skill for skill, _ in self.actions.subskills]
+        for action, subskill_id in zip(self.actions.names, self.actions.subskill_ids):
+            self._skill_actions.setdefault(skills[subskill_id], []).append(action)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        for key in TRANSIENT_ATTRIBUTES:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state: dict):
+        state.setdefault("journal_seq", 0)
+        state.setdefault("history", XPHistory())
+        state.setdefault("action_counts", {})
+        # Level titles come from the achievements config now
+        state.pop("level_titles", None)
+        # Pickle saves kept each action as its own metadata dict
+        if isinstance(state.get("actions"), dict):
+            state["actions"] = ActionTable.from_dict(state["actions"])
+        self.__dict__.update(state)
+        self._init_transient()
+
+    def notifier(self):
+        """Sink used to deliver notifications, the default one created on first use"""
+        if self._notifier is None:
+            self._notifier = create_notifier()
+        return self._notifier
+
+    def set_notifier(self, notifier):
+        """Deliver notifications through notifier, e.g. a background Outbox, or the sink registered under that name"""
+        self._notifier = create_notifier(notifier) if isinstance(notifier, str) else notifier
 
     def send_message(self, msg: str):
-        """Send string message"""
+        """Send string message, or hold it until the current batch is flushed"""
         print(msg)
-        DiscordClient().send_message(msg)
+        if self._pending_messages is not None:
+            self._pending_messages.append(msg.strip("\n"))
+        else:
+            self.notifier().send_message(msg)
+
+    @contextlib.contextmanager
+    def batched_notifications(self):
+        """Collect every message sent inside the block and send them as one"""
+        if self._pending_messages is not None:
+            # Already batching, the outermost block flushes
+            yield
+            return
+        self._pending_messages = []
+        try:
+            yield
+        finally:
+            pending, self._pending_messages = self._pending_messages, None
+            if pending:
+                self.notifier().send_message("\n".join(pending))
+
+    @contextlib.contextmanager
+    def _silenced(self):
+        """Drop every message sent inside the block"""
+        pending, self._pending_messages = self._pending_messages, []
+        try:
+            yield
+        finally:
+            self._pending_messages = pending
 
     def level_up(self) -> str:
         """See if user has levelled up or not"""
         # Taken from pokemon medium-fast levelling equation:
         # https://bulbapedia.bulbagarden.net/wiki/Experience
-        while self.total_xp >= (self.level+1) ** 3:
-            self.level += 1
-            self.send_message("Level Up!\n")
-        if self.level in [1, 5, 10, 15, 25, 50, 75, 100, 150, 200]:
-            if self.level_titles[self.level] not in self.unlocked_titles:
-                self.unlocked_titles.append(self.level_titles[self.level])
-                self.title = self.unlocked_titles[-1]
-                self.send_message(f"Unlocked new title: {self.title}")
+        previous_level = self.level
+        new_level = level_for_xp(self.total_xp)
+        if new_level > self.level:
+            gained = new_level - self.level
+            self.level = new_level
+            self.send_message("Level Up!\n" if gained == 1 else f"Level Up! x{gained}\n")
+        # Unlock every level title reached, even if one update crossed several
+        self._unlock_reached("level", (), self.level, previous_level)
+
+    def set_achievements(self, rules):
+        """Use another AchievementRules, checking it against the progress made so far"""
+        self._achievements = rules.tracker(self.unlocked_titles)
+        self.check_achievements()
+
+    def check_achievements(self):
+        """Check every waiting rule against the current counters, e.g. after a bulk update"""
+        for event, key in list(self._achievements.pending):
+            if event == "level":
+                value = self.level
+            elif event == "xp":
+                skill, subskill = key
+                if skill is None:
+                    value = self.total_xp
+                elif subskill is None:
+                    value = self.skills_xp.get(skill, 0)
+                else:
+                    value = self.skill_tree.get(skill, {}).get(subskill, 0)
+            elif event == "action":
+                value = self.action_counts.get(key[0], 0)
+            else:
+                # Streaks that ended before today counted when they were live too
+                value = self.history.longest_streak(key[0], limit=self._achievements.next_threshold(event, key))
+            self._unlock_reached(event, key, value)
+
+    def _unlock_reached(self, event: str, key: tuple, value: int, previous: int = None):
+        """Unlock the titles value meets; only those previous did not meet yet are equipped"""
+        if previous is not None:
+            # Met before this event, e.g. milestones an older save never unlocked
+            for title in self._achievements.reached(event, key, previous):
+                self.unlock_title(title, equip=False)
+        for title in self._achievements.reached(event, key, value):
+            self.unlock_title(title)
+
+    def unlock_title(self, title: str, equip: bool = True):
+        """Unlock a title, equipping it unless equip is False"""
+        if title in self.unlocked_titles:
+            return
+        self.unlocked_titles.append(title)
+        if equip:
+            self.title = title
+        self.send_message(f"Unlocked new title: {title}")
+
+    def xp_to_next_level(self) -> int:
+        """XP still needed to reach the next level"""
+        return max(0, (self.level + 1) ** 3 - self.total_xp)
 
     def equip_title(self, title: str):
         """Change title"""
         if title == "":
-            self.send_message(f"Current title: {title}")
+            self.send_message(f"Current title: {self.title}")
         elif title in self.unlocked_titles:
             self.title = title
+            self._record("title", title=title)
             self.send_message(f"Updated title to {title}")
         else:
             self.send_message(f"Could not equip title, titles available to player are: {self.unlocked_titles}")
 
-    def update_xp(self, xp: int, skill: str, subskill: str):
-        """Update xp calculations for particular subskill"""
+    def update_xp(self, xp: int, skill: str, subskill: str, at: float = None, action: str = None):
+        """Update xp calculations for particular subskill, gained at the given time or now, by action if given"""
+        at = time.time() if at is None else at
         self.skill_tree[skill][subskill] += xp
         self.skills_xp[skill] += xp
         self.total_xp += xp
-        self.level_up()
+        self.history.record(skill, subskill, xp, at)
+        if action is None:
+            self._record("xp", xp=xp, skill=skill, subskill=subskill, at=at)
+        else:
+            self.action_counts[action] = self.action_counts.get(action, 0) + 1
+            self._record("xp", xp=xp, skill=skill, subskill=subskill, at=at, action=action)
+        if self._achievements.pending:
+            self._check_event_achievements(xp, skill, subskill, at, action)
+        if self._batch is None:
+            # Batches settle levels once at the end instead
+            self.level_up()
+
+    def _check_event_achievements(self, xp: int, skill: str, subskill: str, at: float, action: str):
+        """Check only the rules watching a counter this XP event changed"""
+        check = self._unlock_reached
+        check("xp", (skill, subskill), self.skill_tree[skill][subskill], self.skill_tree[skill][subskill] - xp)
+        check("xp", (skill, None), self.skills_xp[skill], self.skills_xp[skill] - xp)
+        check("xp", (None, None), self.total_xp, self.total_xp - xp)
+        if action is not None:
+            check("action", (action,), self.action_counts[action], self.action_counts[action] - 1)
+        for key in ((skill,), (None,)):
+            days = self._achievements.next_threshold("streak", key)
+            if days is not None:
+                check("streak", key, self.history.streak(key[0], at, days))
 
     def add_action(self, skill: str, subskill: str, xp: int, action: str):
         """Add an action to registered actions"""
@@ -108,35 +299,33 @@ class XPSystem:
         if subskill not in self.skill_tree[skill].keys():
             return
         if action not in self.actions:
-            self.actions[action] = {
-                "skill": skill,
-                "subskill": subskill,
-                "xp": xp,
-            }
+            self.actions.add(action, skill, subskill, xp)
+            self._skill_actions.setdefault(skill, []).append(action)
+            self._record("add_action", skill=skill, subskill=subskill, xp=xp, action=action)
 
     def performed_action(self, action: str):
         """Update xps after performing an action"""
-        if action not in self.actions:
+        metadata = self.actions.get(action)
+        if metadata is None:
             return
-        self.update_xp(
-            self.actions[action]["xp"],
-            self.actions[action]["skill"],
-            self.actions[action]["subskill"]
-        )
-        self.save_progress(self.filename)
+        self.update_xp(metadata["xp"], metadata["skill"], metadata["subskill"], action=action)
+        if self._batch is None:
+            self.commit()
+        else:
+            self._batch["actions"] += 1
 
     def show_actions(self, skill: str):
         if skill not in self.skills_xp:
             return self.send_message("Requested skill does not exist")
         skill_actions = f"All actions for skill {skill}:\n"
-        for action, metadata in self.actions.items():
-            if metadata["skill"] == skill:
-                skill_actions += f"\t{action}: {metadata['xp']} XP\n"
+        for action in self._skill_actions.get(skill, []):
+            skill_actions += f"\t{action}: {self.actions[action]['xp']} XP\n"
         self.send_message(skill_actions)
 
     def show_level(self):
         """Show level"""
         status = f"Current Level: {self.level} | Total XP: {self.total_xp}"
+        status += f" | XP to next level: {self.xp_to_next_level()}"
         status += (f"\nEquipped Title: {self.title}")
         self.send_message(status)
 
@@ -159,60 +348,205 @@ class XPSystem:
         return status
 
     def save_progress(self, filename):
-        """Save progress to file"""
-        with open(filename, 'wb') as f:
-            pickle.dump(self, f)
-            print(f"Progress saved to {filename}")
+        """Save progress to file in the player_state format, atomically replacing the previous save"""
+        tmp_filename = f"{filename}.tmp"
+        with METRICS.timer("save_progress"):
+            with open(tmp_filename, 'wb') as f:
+                f.write(encode_state(self))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_filename, filename)
+        print(f"Progress saved to {filename}")
+
+    def _record(self, op: str, **fields):
+        """Mark state as changed and append the change to the journal, if one is attached"""
+        self._dirty = True
+        if self._journal is None:
+            return
+        self.journal_seq += 1
+        with METRICS.timer("journal_append"):
+            self._journal.append({"seq": self.journal_seq, "op": op, **fields})
+
+    def _apply(self, record: dict):
+        """Re-apply a journal record"""
+        if record["op"] == "xp":
+            # Records from before the history was kept have no time and count as now
+            self.update_xp(record["xp"], record["skill"], record["subskill"], record.get("at"), record.get("action"))
+        elif record["op"] == "add_action":
+            self.add_action(record["skill"], record["subskill"], record["xp"], record["action"])
+        elif record["op"] == "title":
+            self.title = record["title"]
+
+    def commit(self):
+        """Persist changes: the journal records fsynced when journaling, otherwise a full save"""
+        self._dirty = False
+        if self._journal is None:
+            self.save_progress(self.filename)
+        elif self._journal.records >= SNAPSHOT_EVERY:
+            self.snapshot()
+        else:
+            self._journal.sync()
+
+    def snapshot(self):
+        """Save a full snapshot and drop the journal records it covers"""
+        self.save_progress(self.filename)
+        if self._journal is not None:
+            self._journal.reset()
+
+    def close(self):
+        """Flush and close the journal"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
 
     def process_message(self, msg: str) -> None:
         """process an input text message"""
+        with METRICS.timer("process_message"), self.batched_notifications():
+            self._process_message(msg)
+        if self._dirty:
+            self.commit()
+        METRICS.increment("messages_processed")
+
+    def process_messages(self, messages) -> dict:
+        """
+        Apply a batch of input text messages in order.
+
+        Level-ups are settled once at the end (or before any command that reads
+        them), progress is persisted once, and every reply plus a summary goes
+        out as one notification.
+
+        Returns:
+            dict: Counts of messages and actions processed and XP gained.
+        """
+        summary = {"messages": 0, "actions": 0, "xp": 0}
+        start_xp = self.total_xp
+        with METRICS.timer("process_messages"), self.batched_notifications():
+            self._batch = summary
+            try:
+                for msg in messages:
+                    summary["messages"] += 1
+                    if msg not in self.actions:
+                        self.level_up()
+                    try:
+                        self._process_message(msg)
+                    except Exception as e:
+                        print(f"Skipping message {msg!r}, got error {str(e)}")
+                self.level_up()
+            finally:
+                self._batch = None
+            summary["xp"] = self.total_xp - start_xp
+            if summary["actions"]:
+                self.send_message(f"Logged {summary['actions']} actions for {summary['xp']} XP")
+        if self._dirty:
+            self.commit()
+        METRICS.increment("messages_processed", summary["messages"])
+        return summary
+
+    def _process_message(self, msg: str) -> None:
         print(f"Input: {msg}")
         if len(msg) > 100:
             print("Command too long to be processed")
-        elif "!help" in msg:
-            self.send_message(
-                "List of messages:\n"
-                + "!status - show concise status\n"
-                + "!status full - show full status of skill tree\n"
-                + "!add <skill> <subskill> <xp> <action name> - register action\n"
-                + "!title - change title\n"
-                + "!level - display current level and title\n"
-                + "!action <skill> - display all registered actions for a skill\n"
-                + "<action> - log action\n"
-            )
-        elif "!status" in msg:
-            if "full" in msg:
-                self.send_message(str(self))
-            else:
-                self.display_concise_output()
-        elif "!level" in msg:
-            self.show_level()
-        elif "!add" in msg:
-            msg = msg.split("!add ", 1)[-1]
-            skill, subskill, xp, action = msg.split(" ", 3)
-            xp = int(xp)
-            self.add_action(skill, subskill, xp, action)
-        elif "!title" in msg:
-            self.equip_title(msg.split(" ", 1)[-1])
-        elif "!action" in msg:
-            skill = msg.split("!action ", 1)[-1]
-            self.show_actions(skill)
+            return
+        command, _, args = msg.partition(" ")
+        handler = self.COMMANDS.get(command)
+        if handler is not None:
+            getattr(self, handler)(args)
         elif msg in self.actions:
             self.performed_action(msg)
         else:
             print("Could not recognize command. Send \"!help\" for list of commands")
 
+    def _cmd_help(self, args: str):
+        self.send_message(HELP_TEXT)
+
+    def _cmd_status(self, args: str):
+        if "full" in args:
+            self.send_message(str(self))
+        else:
+            self.display_concise_output()
+
+    def _cmd_level(self, args: str):
+        self.show_level()
+
+    def _cmd_add(self, args: str):
+        skill, subskill, xp, action = args.split(" ", 3)
+        self.add_action(skill, subskill, int(xp), action)
+
+    def _cmd_title(self, args: str):
+        self.equip_title(args)
+
+    def _cmd_action(self, args: str):
+        self.show_actions(args)
+
+    def _cmd_stats(self, args: str):
+        skill, _, window = args.strip().partition(" ")
+        if skill not in self.skills_xp:
+            return self.send_message("Requested skill does not exist")
+        try:
+            description, total, breakdown = self.history.stats(skill, window.strip() or "week")
+        except ValueError as e:
+            return self.send_message(str(e))
+        stats = f"{skill.capitalize()} XP {description}: {total}"
+        for subskill, xp in breakdown.items():
+            stats += f"\n\t{subskill}: {xp}"
+        self.send_message(stats)
+
+    def _cmd_perf(self, args: str):
+        self.send_message(METRICS.summary())
+
+    # Command word -> handler method, looked up once per message
+    COMMANDS = {
+        "!help": "_cmd_help",
+        "!status": "_cmd_status",
+        "!level": "_cmd_level",
+        "!add": "_cmd_add",
+        "!title": "_cmd_title",
+        "!action": "_cmd_action",
+        "!stats": "_cmd_stats",
+        "!perf": "_cmd_perf",
+    }
+
     @staticmethod
     def load_progress(filename: str):
-        """Load the XP system state from a file."""
+        """Load the XP system state from a file, migrating a pickle save to the state format."""
         try:
             with open(filename, 'rb') as f:
-                xp_system = pickle.load(f)
-                print(f"Progress loaded from {filename}")
-                return xp_system
+                data = f.read()
         except FileNotFoundError:
             print("No previous progress found. Starting fresh.")
             return XPSystem(filename)  # Return a new XPSystem instance if no file exists
+        if is_state(data):
+            with METRICS.timer("load_progress"):
+                xp_system = XPSystem(filename)
+                decode_state(data).apply_to(xp_system)
+                xp_system._init_transient()
+        else:
+            # Saves from before the state format; unpickle once, then never again
+            xp_system = pickle.loads(data)
+            shutil.copyfile(filename, filename + LEGACY_BACKUP_SUFFIX)
+            xp_system.save_progress(filename)
+            print(f"Migrated {filename} from pickle, the old file is kept as {filename + LEGACY_BACKUP_SUFFIX}")
+        print(f"Progress loaded from {filename}")
+        return xp_system
+
+    @staticmethod
+    def recover(filename: str):
+        """Load the latest snapshot, replay the journal tail after it and keep journaling."""
+        xp_system = XPSystem.load_progress(filename)
+        xp_system.filename = filename
+        journal_path = filename + JOURNAL_SUFFIX
+        replayed = 0
+        with xp_system._silenced():
+            for record in Journal.read(journal_path):
+                # Records at or below journal_seq are already in the snapshot
+                if record["seq"] > xp_system.journal_seq:
+                    xp_system._apply(record)
+                    xp_system.journal_seq = record["seq"]
+                    replayed += 1
+        if replayed:
+            print(f"Replayed {replayed} journal records from {journal_path}")
+        xp_system._journal = Journal(journal_path)
+        return xp_system
 
 
 if __name__ == "__main__":